@@ -8,7 +8,7 @@ import argparse
 import vcfpy
 
 
-VERSION = '0.3.0'
+VERSION = '0.3.1'
 
 
 def supply_args():
@@ -36,14 +36,11 @@ def main():
                                "Description": args.desc})
     vcf.header.add_filter_line(header_line)
     writer = vcfpy.Writer.from_path(args.outfile, vcf.header)
-    my_bed = BedReader(args.bed).split_coords()
+    my_bed = BedReader(args.bed).interval_index()
 
     for rec in vcf:
-        chrom = rec.CHROM
-        pos = rec.POS
-        if chrom in my_bed:
-            if pos in my_bed[chrom]:
-                rec.add_filter(args.anno)
+        if my_bed.contains(rec.CHROM, rec.POS):
+            rec.add_filter(args.anno)
         writer.write_record(rec)
 
     vcf.close()
@@ -1,3 +1,6 @@
+import numpy as np
+
+
 class BedReader(object):
     """
     Simple class to ingest BED files and return a data structure as such:
@@ -51,6 +54,13 @@ class BedReader(object):
 
         return split_coords
 
+    def interval_index(self):
+        """
+        Return a BedIndex of the intervals for fast point and range lookups.
+        :return:
+        """
+        return BedIndex(self.bed_ints)
+
 
 class ExtBedReader(object):
     """
@@ -109,6 +119,16 @@ class ExtBedReader(object):
 
         return ext_bed_ints
 
+    def interval_index(self):
+        """
+        Return a BedIndex of the intervals for fast point and range lookups.
+        :return:
+        """
+        return BedIndex(
+            {chrom: [[entry['start'], entry['stop']]
+                     for entry in self.bed_ints[chrom].values()]
+             for chrom in self.bed_ints})
+
     def find_primer_coords(self, tsize=250):
         """
         Based on a given region length, and BED coordinates, find the
@@ -162,3 +182,62 @@ class ExtBedReader(object):
                 primer_coords[chrom][strand].append(pstop)
 
         return primer_coords
+
+
+class BedIndex(object):
+    """
+    Sorted interval index of BED coordinates, queried with binary search
+    instead of a scan over every base:
+    {chrom: (starts, stops)}
+
+    Overlapping and adjacent intervals are merged, so the starts and stops
+    are both increasing.
+
+    Input: {chrom: [[start1, stop1], [start2, stop2], ...]} in 1-based coords
+    """
+
+    def __init__(self, bed_ints):
+
+        self.bed_index = self._create_index(bed_ints)
+
+    def __contains__(self, chrom):
+
+        return chrom in self.bed_index
+
+    @staticmethod
+    def _create_index(bed_ints):
+        """
+        Sort and merge the intervals of each chromosome.
+        :return bed_index:
+        """
+        bed_index = {}
+        for chrom, coords in bed_ints.items():
+            merged = []
+            for start, stop in sorted(coords):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], stop)
+                else:
+                    merged.append([start, stop])
+            bed_index[chrom] = (np.array([x[0] for x in merged], dtype=np.int64),
+                                np.array([x[1] for x in merged], dtype=np.int64))
+        return bed_index
+
+    def contains(self, chrom, pos):
+        """
+        Return True if the 1-based position is in one of the intervals.
+        :return:
+        """
+        return self.overlaps(chrom, pos, pos)
+
+    def overlaps(self, chrom, start, stop):
+        """
+        Return True if any base of the 1-based, inclusive range
+        start - stop is in one of the intervals.
+        :return:
+        """
+        if chrom not in self.bed_index:
+            return False
+        starts, stops = self.bed_index[chrom]
+        # First interval that ends at or after the start of the range.
+        i = np.searchsorted(stops, start, side='left')
+        return bool(i < len(starts) and starts[i] <= stop)
@@ -1,6 +1,7 @@
 import argparse
+from bisect import bisect_right
 
-VERSION = '0.0.6'
+VERSION = '0.0.7'
 
 def supply_args():
     parser = argparse.ArgumentParser(description='')
@@ -36,6 +37,64 @@ def filter_genes(genelist_filepath, ot_input):
     return gene_filter
 
 
+class GeneIndex(object):
+    """
+    Per chromosome index of the genes in a GFF, used to find the genes that
+    overlap a position without looping over every gene.
+
+    The gene coordinates are cut into segments at every gene start and
+    end, and each segment holds the genes that cover it, in the same order
+    as gene_dict. A lookup is a binary search for the segment:
+    {chrom: ([segment start1, segment start2, ...], [genes1, genes2, ...])}
+    """
+
+    def __init__(self, gene_dict):
+
+        self.gene_index = self._create_index(gene_dict)
+
+    @staticmethod
+    def _create_index(gene_dict):
+
+        by_chrom = {}
+        for rank, (gene, v) in enumerate(gene_dict.items()):
+            start, end = int(v[1]), int(v[2])
+            # A gene with start > end can't contain any position
+            if start <= end:
+                by_chrom.setdefault(v[0], []).append((start, end, rank, gene))
+
+        gene_index = {}
+        for chrom, genes in by_chrom.items():
+            starts = {}
+            stops = {}
+            for gene in genes:
+                starts.setdefault(gene[0], []).append(gene)
+                # Genes cover start to end inclusive, so they leave at end + 1
+                stops.setdefault(gene[1] + 1, []).append(gene)
+
+            bounds = sorted(set(starts) | set(stops))
+            segments = []
+            active = set()
+            for bound in bounds:
+                active.difference_update(stops.get(bound, []))
+                active.update(starts.get(bound, []))
+                segments.append(tuple(gene[3] for gene in sorted(active, key=lambda x: x[2])))
+            gene_index[chrom] = (bounds, segments)
+
+        return gene_index
+
+    def genes_at(self, chrom, pos):
+        """
+        Return the names of the genes where start <= pos <= end.
+        """
+        if chrom not in self.gene_index:
+            return ()
+        bounds, segments = self.gene_index[chrom]
+        i = bisect_right(bounds, pos) - 1
+        if i < 0:
+            return ()
+        return segments[i]
+
+
 def annotate_vcf(gff_filepath, vcf_filepath, new_filepath, genes=[]):
     gff = open(gff_filepath, 'r')
     vcf = open(vcf_filepath, 'r')
@@ -59,6 +118,10 @@ def annotate_vcf(gff_filepath, vcf_filepath, new_filepath, genes=[]):
                 end = line_array[4]
                 gene = line_array[8].split(';')[1].partition('Name=')[2]
                 gene_dict[gene] = [current_chr, start, end]
+    gff.close()
+
+    gene_index = GeneIndex(gene_dict)
+    gene_set = set(genes)
 
     # Insert ##INFO description for Gene annotation
     header_insert = False
@@ -79,20 +142,20 @@ def annotate_vcf(gff_filepath, vcf_filepath, new_filepath, genes=[]):
             if vcf_chr.startswith('chr'):
                 vcf_chr = vcf_chr[3:]
 
-            # iterate through .gff genes
-            for k, v in gene_dict.items():
-                if v[0] == vcf_chr and int(line_array2[1]) >= int(v[1]) and int(line_array2[1]) <= int(v[2]) and len(info_array) == info_array_check:
+            # look up the .gff genes that overlap the variant
+            for k in gene_index.genes_at(vcf_chr, int(line_array2[1])):
+                if len(info_array) == info_array_check:
                     info_array.append('Gene=' + k)
-                elif v[0] == vcf_chr and int(line_array2[1]) >= int(v[1]) and int(line_array2[1]) <= int(v[2]) and len(info_array) > info_array_check:
+                else:
                     info_array[-1] = str(info_array[-1]) + ',' + k
 
             # Filter if not in gene list
             gene_in_list = False
             if info_array[-1][0:4] == 'Gene' and len(genes) != 0:
                 for g in info_array[-1].split(','):
-                    if g[0:5] == 'Gene=' and g[5:] in genes:
+                    if g[0:5] == 'Gene=' and g[5:] in gene_set:
                         gene_in_list = True
-                    elif g in genes:
+                    elif g in gene_set:
                         gene_in_list = True
 
             if gene_in_list is False and len(genes) != 0:
@@ -102,23 +165,10 @@ def annotate_vcf(gff_filepath, vcf_filepath, new_filepath, genes=[]):
             if info_array[-1][0:4] != 'Gene' and len(genes) != 0:
                 continue
 
-            first = True
-            for entry in info_array:
-                if first:
-                    corrected_info = entry
-                    first = False
-                else:
-                    corrected_info += ';' + entry
-            line_array2[7] = corrected_info
+            line_array2[7] = ';'.join(info_array)
 
             # write the updated line array to the new vcf
-            first = True
-            for entry in line_array2:
-                if first:
-                    new_vcf.write(entry)
-                    first = False
-                else:
-                    new_vcf.write('\t' + entry)
+            new_vcf.write('\t'.join(line_array2))
 
     vcf.close()
     new_vcf.close()
@@ -5,7 +5,9 @@ Created on May 18, 2022
 '''
 import argparse
 import datetime
+import hashlib
 import logging.config
+import os
 import sys
 import time
 
@@ -16,11 +18,13 @@ from edu.ohsu.compbio.txeff.tx_eff_annotate import TxEffAnnotate
 from edu.ohsu.compbio.txeff.tx_eff_annovar import TxEffAnnovar
 from edu.ohsu.compbio.txeff.tx_eff_ccds import TxEffCcds
 from edu.ohsu.compbio.txeff.tx_eff_hgvs import TxEffHgvs
-from edu.ohsu.compbio.txeff.tx_eff_vcf import TxEffVcf
+from edu.ohsu.compbio.txeff.tx_eff_vcf import TxEffVcf, get_annovar_checksums
+from edu.ohsu.compbio.txeff.util.stage_metrics import StageMetrics
 from edu.ohsu.compbio.txeff.util.tfx_log_config import TfxLogConfig
 from edu.ohsu.compbio.txeff.util.tx_eff_pysam import PysamTxEff
+from edu.ohsu.compbio.txeff.variant import Variant
 
-VERSION = '0.7.8'
+VERSION = '0.8.0'
 
 def _parse_args():
     '''
@@ -65,7 +69,24 @@ def _parse_args():
                     help='Method for looking up reference sequences (can be a url, path, or "ncbi")')
     
     parser.add_argument('-t', '--threads', default = 1, type=int,
-                    help="Number of threads to use", )
+                    help="Number of threads to use. Each thread opens its own UTA connection.", )
+
+    parser.add_argument('--bulk_region_query',
+                    help='Fetch the transcripts for all variants using a few UTA range queries per chromosome instead of one query per variant', 
+                    action='store_true')
+
+    parser.add_argument('--stream_vcf',
+                    help='Write each VCF record as soon as it is annotated instead of reading the whole VCF into memory. The transcripts are still all held in memory. The input VCF must be sorted.', 
+                    action='store_true')
+
+    parser.add_argument('--uta_cache',
+                    help='SQLite file used to cache UTA transcript lookups and c./p. projections between runs. The file is created if it does not exist.')
+    
+    parser.add_argument('--previous_vcf',
+                    help='VCF written by an earlier run. Transcript effects are reused for variants it has, as long as the tool and data versions, and the variant\'s annovar records, are the same.')
+
+    parser.add_argument('--metrics_json',
+                    help='JSON file where per-stage timing, memory and cache metrics are written (default is the output VCF with its extension replaced by .metrics.json)')
     
     parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
     
@@ -77,6 +98,9 @@ def _parse_args():
 
     if args.threads > 1 and args.benchmark:
         raise ValueError('Benchmarking is not possible when multiple threads are used')
+
+    if args.previous_vcf and os.path.abspath(args.previous_vcf) == os.path.abspath(args.out_vcf.name):
+        raise ValueError('--previous_vcf must not be the same file as --out_vcf')
     
     return args
 
@@ -90,6 +114,38 @@ def _get_time(real_seconds, user_seconds):
     
     return str(dt_real), str(dt_user)
     
+def _get_data_version(tx_eff_hgvs: TxEffHgvs, args):
+    """
+    Return a string identifying the data that the transcript effects depend on: the hgvs library, UTA, the sequence source, 
+    the reference genome and the CCDS map. It is written to the output VCF so that a later run can tell whether the 
+    transcript effects can be reused.   
+    """
+    with open(args.ccds_map.name, 'rb') as ccds_file:
+        ccds_checksum = hashlib.sha256(ccds_file.read()).hexdigest()
+    
+    return f"{tx_eff_hgvs.get_data_version()}|{os.path.basename(args.reference_fasta)}|{ccds_checksum}"
+
+def _get_reused_transcripts(previous_transcripts: dict, annovar_records: list):
+    """
+    Return the transcripts from a previous run for the variants in the annovar records, along with the annovar records of the variants 
+    that were not found and have to be looked up.  
+    """
+    reused_transcripts = []
+    reused_variants = set()
+    new_annovar_records = []
+    
+    for annovar_record in annovar_records:
+        variant = Variant(annovar_record.chromosome, annovar_record.position, annovar_record.reference, annovar_record.alt)
+        transcripts = previous_transcripts.get(variant)
+        
+        if transcripts is None:
+            new_annovar_records.append(annovar_record)
+        elif variant not in reused_variants:
+            reused_variants.add(variant)
+            reused_transcripts.extend(transcripts)
+    
+    return reused_transcripts, new_annovar_records
+
 def _main():
     '''
     main function
@@ -116,33 +172,73 @@ def _main():
     
     print(f"Thread count: {args.threads}")
     
+    # Wall time, CPU time, memory and throughput of each stage
+    stage_metrics = StageMetrics()
+    stage_metrics.add_info('version', VERSION)
+    stage_metrics.add_info('hgvs_version', hgvs.__version__)
+    stage_metrics.add_info('threads', args.threads)
+    
     # Use tx_eff_annovar to read annovar records
-    annovar_records = TxEffAnnovar().get_annovar_records(args.annovar_variant_function.name, args.annovar_exonic_variant_function.name)
+    with stage_metrics.stage('annovar_parse') as stage:
+        annovar_records = TxEffAnnovar().get_annovar_records(args.annovar_variant_function.name, args.annovar_exonic_variant_function.name)
+        stage.records = len(annovar_records)
+
+    # Taken before the records are merged with HGVS results, so that a later run can tell whether annovar's records have changed
+    annovar_checksums = get_annovar_checksums(annovar_records)
 
     # Load the reference genome with pysam.
     pysam_file = PysamTxEff(args.reference_fasta)
 
-    # Look for additional transcripts in the HGVA/UTA database and merge them with the annovar records.
-    with TxEffHgvs(pysam_file = pysam_file, sequence_source = args.sequence_source, threads = args.threads, benchmark = args.benchmark) as tx_eff_hgvs:
-        merged_transcripts = tx_eff_hgvs.get_updated_hgvs_transcripts(annovar_records)
+    # Transcript effects from an earlier run that are reused rather than looked up again 
+    reused_transcripts = []
+
+    with TxEffHgvs(pysam_file = pysam_file, sequence_source = args.sequence_source, threads = args.threads, benchmark = args.benchmark, uta_cache = args.uta_cache, bulk = args.bulk_region_query) as tx_eff_hgvs:
+        tx_eff_vcf = TxEffVcf(VERSION, args.in_vcf.name, args.out_vcf.name, _get_data_version(tx_eff_hgvs, args), annovar_checksums)
+        
+        # Variants that were annotated by a previous run using the same versions and annovar records don't need to be looked up again 
+        if args.previous_vcf:
+            with stage_metrics.stage('previous_vcf') as stage:
+                previous_transcripts = tx_eff_vcf.get_previous_transcripts(args.previous_vcf)
+                reused_transcripts, annovar_records = _get_reused_transcripts(previous_transcripts, annovar_records)
+                stage.records = len(reused_transcripts)
+            stage_metrics.add_info('reused_transcripts', len(reused_transcripts))
+            print(f"Reusing {len(reused_transcripts)} transcripts from {args.previous_vcf}")
+
+        # Look for additional transcripts in the HGVA/UTA database and merge them with the annovar records.
+        with stage_metrics.stage('hgvs_lookup', len(annovar_records)):
+            merged_transcripts = tx_eff_hgvs.get_updated_hgvs_transcripts(annovar_records) if annovar_records else []
     
     # Close the reference FASTA
-    pysam_file.my_fasta.close()
+    pysam_file.close()
+
+    for name, hits, misses in tx_eff_hgvs.get_cache_stats():
+        stage_metrics.add_cache(name, hits, misses)
 
     # Find CCDS ids for all refseq ids. To do this we use a mapping file that was generated by tx_eff_ccds.py
-    tx_eff_ccds = TxEffCcds(args.ccds_map.name)
-    ccds_transcripts = tx_eff_ccds.get_ccds_transcripts(merged_transcripts)
-    merged_transcripts.extend(ccds_transcripts)
+    with stage_metrics.stage('ccds_mapping', len(merged_transcripts)):
+        tx_eff_ccds = TxEffCcds(args.ccds_map.name)
+        ccds_transcripts = tx_eff_ccds.get_ccds_transcripts(merged_transcripts)
+        merged_transcripts.extend(ccds_transcripts)
 
     # Add additional annotations to each variant
-    tx_eff_annotate = TxEffAnnotate(args.sequence_source)
-    tx_eff_annotate.annotate(merged_transcripts)
+    with stage_metrics.stage('annotate', len(merged_transcripts)):
+        tx_eff_annotate = TxEffAnnotate(args.sequence_source)
+        tx_eff_annotate.annotate(merged_transcripts)
     
+    # The reused transcripts already have their CCDS transcripts and annotations 
+    merged_transcripts.extend(reused_transcripts)
+
     # Use tx_eff_vcf to write the transcript effects to a VCF
-    TxEffVcf(VERSION, args.in_vcf.name, args.out_vcf.name).create_vcf(merged_transcripts)
+    with stage_metrics.stage('vcf_write', len(merged_transcripts)):
+        tx_eff_vcf.create_vcf(merged_transcripts, streaming = args.stream_vcf)
     
     print(f"Wrote {len(merged_transcripts)} transcripts to {args.out_vcf.name}")
 
+    # The metrics are written next to the output VCF unless another file is requested
+    metrics_json = args.metrics_json if args.metrics_json else os.path.splitext(args.out_vcf.name)[0] + '.metrics.json'
+    stage_metrics.write(metrics_json)
+    print(f"Wrote stage metrics to {metrics_json}")
+
     stop_time_real = time.perf_counter()
     stop_time_user = time.process_time()
     real_time, user_time = _get_time(stop_time_real - start_time_real, stop_time_user - start_time_user) 
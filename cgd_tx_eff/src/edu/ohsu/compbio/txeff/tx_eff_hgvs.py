@@ -10,8 +10,6 @@ from collections import defaultdict
 import csv
 import itertools
 import logging
-from multiprocessing.dummy import Pool as ThreadPool
-
 import os
 from pathlib import Path
 import re
@@ -27,12 +25,19 @@ from edu.ohsu.compbio.annovar import annovar_parser
 from edu.ohsu.compbio.annovar.annovar_parser import AnnovarVariantFunction
 from edu.ohsu.compbio.txeff.util import chromosome_map
 from edu.ohsu.compbio.txeff.util.benchmarking import Benchmarking
+from edu.ohsu.compbio.txeff.util.interval_index import IntervalIndex
+from edu.ohsu.compbio.txeff.util.tfx_cache import TfxCache
 from edu.ohsu.compbio.txeff.util.tx_eff_pysam import PysamTxEff
+from edu.ohsu.compbio.txeff.util.uta_cache import UtaCache
+from edu.ohsu.compbio.txeff.util.worker_pool import WorkerPool
 from edu.ohsu.compbio.txeff.variant import Variant
 from edu.ohsu.compbio.txeff.variant_transcript import VariantTranscript
 
 ASSEMBLY_VERSION = "GRCh37"
 
+# In bulk mode, variants on the same chromosome that are further apart than this are looked up in separate UTA range queries 
+BULK_QUERY_MAX_GAP = 10000000
+
 class RptHandler:
     """
     Handle coordinate changes due to repetitive sequences in both deletions and duplications.  HGVS requires
@@ -89,17 +94,41 @@ class RptHandler:
         new_start = coord - len(self.allele)
         new_end = new_start + len(self.allele) - 1
         return new_start, new_end
+
+class HgvsWorker(object):
+    """
+    The UTA connection, AssemblyMapper and reference FASTA used by one worker thread. Each thread has its own because 
+    queries made on a shared connection are serialized, and a pysam FastaFile must not be read by several threads at once.   
+    """
+    def __init__(self, uta_cache: UtaCache, reference_fasta: str):
+        self.hdp = hgvs.dataproviders.uta.connect()
+        self.am = hgvs.assemblymapper.AssemblyMapper(self.hdp, assembly_name=ASSEMBLY_VERSION, alt_aln_method='splign')
+        self.uta_cache = uta_cache.with_hdp(self.hdp)
+        self.pysam_file = PysamTxEff(reference_fasta)
+
+    def close(self):
+        self.pysam_file.close()
+        self.hdp.close()
         
 class TxEffHgvs(object):
     """
     Finds transcripts associated with variant. Makes use of the SeqRepo and UTA datasources. 
     Benchmarking can be enabled to produce a csv file that shows how long SeqRepo and UTA queries are taking.
     pysam_file is an instance of PysamTxEff 
+    UTA query results and c./p. projections are cached in memory, and also in the uta_cache file when one is given so that they can be 
+    reused by later runs. 
+    In bulk mode the transcripts for all variants are fetched from UTA using a few range queries per chromosome, rather than one query per variant. 
     """ 
-    def __init__(self, pysam_file, sequence_source = None, threads = 1, benchmark = False):
+    def __init__(self, pysam_file, sequence_source = None, threads = 1, benchmark = False, uta_cache = None, bulk = False):
         self.logger = logging.getLogger(__name__)
         self.pysam_file = pysam_file
         self._sequence_source = sequence_source
+        self._uta_cache_file = uta_cache
+        self._bulk = bulk
+        
+        # Reference cache counts from the worker threads' FASTA files 
+        self._worker_reference_cache_hits = 0
+        self._worker_reference_cache_misses = 0
         self._benchmarking = None
         self._variant_counter = 0
 
@@ -129,10 +158,15 @@ class TxEffHgvs(object):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
+        self.uta_cache.close()
+        self.projection_cache.close()
+
         self.logger.debug("Closing UTA connection")
         self.hdp.close()
         
         if self._benchmarking:
+            for name in self._benchmarking.get_counter_names():
+                self.logger.info(f"Benchmark counter {name}: {self._benchmarking.get_count(name)}")
             self._benchmark_file.close() 
 
     def _configure_uta(self):
@@ -149,6 +183,25 @@ class TxEffHgvs(object):
         self.hdp = hgvs.dataproviders.uta.connect()
         self.am = hgvs.assemblymapper.AssemblyMapper(self.hdp, assembly_name=ASSEMBLY_VERSION, alt_aln_method='splign')
         self.hgvs_parser = hgvs.parser.Parser()      
+
+        # Transcript lookups are served from the cache when possible 
+        if self._uta_cache_file:
+            self.logger.info(f"Using UTA cache file {self._uta_cache_file}")
+        self.uta_cache = UtaCache(self.hdp, self._uta_cache_file, benchmarking = self._benchmarking)
+        self.projection_cache = TfxCache('am.g_to_c/am.c_to_p', self.get_data_version(), self._uta_cache_file, benchmarking = self._benchmarking)
+
+    def get_data_version(self):
+        """
+        Return a string identifying the versions of everything that g_to_c and c_to_p depend on: the hgvs library, the UTA schema, 
+        and the sequence source. The SeqRepo file repository path normally includes the SeqRepo instance name (eg /opt/seqrepo/2021-01-29).
+        It is also part of the data version written to the output VCF.
+        """
+        seqfetcher = getattr(self.hdp, 'seqfetcher', None)
+        sequence_source = getattr(seqfetcher, 'source', None) \
+            or os.environ.get('HGVS_SEQREPO_DIR') \
+            or os.environ.get('HGVS_SEQREPO_URL') \
+            or 'ncbi'
+        return f"{hgvs.__version__}|{self.hdp.data_version()}|{sequence_source}"
           
     def _configure_sequence_source(self):
         """
@@ -236,14 +289,18 @@ class TxEffHgvs(object):
         
         raise ValueError("The sequence_source parameter must be a url, a directory, or 'ncbi': " + self._sequence_source)
 
-    def _correct_indel_coords(self, chrom, pos, ref, alt):
+    def _correct_indel_coords(self, chrom, pos, ref, alt, pysam_file = None):
         """
         Using a VCF position, create coords that are compatible with HGVS nomenclature.
         Since we are already determining at this stage whether the event is an ins or del, also
         include the ins or del strings in the result.
         substitution event -> ac:g.[pos][ref]>[alt]
+        pysam_file defaults to the PysamTxEff given to the constructor.
         :return:
         """
+        if pysam_file is None:
+            pysam_file = self.pysam_file
+        
         lref = len(ref)
         lalt = len(alt)
         if lref == 1 and lalt == 1:
@@ -252,7 +309,7 @@ class TxEffHgvs(object):
             new_pos = str(pos) + change
             return new_pos
         elif lalt == 1 and lref > lalt:
-            dels = RptHandler(self.pysam_file, chrom, pos, ref)
+            dels = RptHandler(pysam_file, chrom, pos, ref)
             # Deletion case
             if dels.check_rpt_status():
                 new_start, new_end = dels.find_rpt_coords()
@@ -270,7 +327,7 @@ class TxEffHgvs(object):
                     new_pos = '_'.join([new_start, new_end]) + 'del'
             return new_pos
         elif lref == 1 and lalt > lref:
-            dups = RptHandler(self.pysam_file, chrom, pos, alt)
+            dups = RptHandler(pysam_file, chrom, pos, alt)
             # Duplication case
             if dups.check_rpt_status():
                 new_start, new_end = dups.find_rpt_coords()
@@ -310,39 +367,142 @@ class TxEffHgvs(object):
         '''
         Return the HGVS transcripts associated with a list of variants  
         '''
-        pool = ThreadPool(processes = self._threads)
-        
-        # One thread per variant 
-        results = pool.map(self._lookup_variant_hgvs_transcripts, variants)        
+        if self._bulk:
+            # Each item is a (variant, var_g, tx_list) tuple
+            items = self._get_bulk_tx_for_region(variants)
+        else:
+            items = [(variant, None, None) for variant in variants]
         
-        pool.close()
-        pool.join()
+        lookup = lambda worker, item: self._lookup_variant_hgvs_transcripts(worker, *item) 
+
+        if self._threads == 1:
+            # This object's own connection is the only worker
+            results = map(lambda item: lookup(self, item), items)
+        else:
+            # Each thread has its own UTA connection and AssemblyMapper, and the transcripts for each variant are collected as soon as they are ready.
+            pool = WorkerPool(self._threads, self._create_worker, self._close_worker)
+            results = pool.imap_unordered(lookup, items)
         
-        # The results from pool.map is a list of lists where each index is the list of transcripts for one variant. 
+        # Each result is the list of transcripts for one variant. 
         # itertools flattens the results into a single list of all transcripts for all variants. 
         return list(itertools.chain.from_iterable(results))                        
+
+    def _create_worker(self):
+        '''
+        Open the connections used by one worker thread
+        '''
+        self.logger.debug("Opening UTA connection for worker thread")
+        return HgvsWorker(self.uta_cache, self.pysam_file.filename)
+
+    def _close_worker(self, worker: HgvsWorker):
+        '''
+        Close the connections used by one worker thread and keep its reference cache counts 
+        '''
+        block_cache = worker.pysam_file.block_cache
+        if block_cache:
+            with self._lock:
+                self._worker_reference_cache_hits += block_cache.hits
+                self._worker_reference_cache_misses += block_cache.misses
+        worker.close()
+
+    def get_cache_stats(self):
+        '''
+        Return a (name, hits, misses) tuple for each of the caches used while looking up transcripts  
+        '''
+        stats = [(cache.namespace, cache.hits, cache.misses) for cache in self.uta_cache.get_caches() + [self.projection_cache]]
+
+        reference_cache_hits = self._worker_reference_cache_hits
+        reference_cache_misses = self._worker_reference_cache_misses
+        if self.pysam_file.block_cache:
+            reference_cache_hits += self.pysam_file.block_cache.hits
+            reference_cache_misses += self.pysam_file.block_cache.misses
+        stats.append(('reference', reference_cache_hits, reference_cache_misses))
         
-    def _lookup_variant_hgvs_transcripts(self, variant: Variant):
+        return stats
+        
+    def _get_bulk_tx_for_region(self, variants: list):
         '''
-        Use HGVS/UTA to return a list of the transcripts for a variant
+        Return a (variant, var_g, tx_list) tuple for every variant. The variants are sorted by chromosome and position, the transcripts 
+        for each group of nearby variants are fetched with one UTA range query, and each variant is resolved against an in-memory 
+        index of those transcripts.
+        
+        UTA's get_tx_for_region returns the transcripts that contain a region (min(start_i) < start and end <= max(end_i)), not those 
+        that overlap it, so querying the span of a group would only return the transcripts that cover the whole group. Instead the 
+        group is queried with the largest variant start and the smallest variant end, which returns every transcript that contains 
+        any of the group's variants (and some that don't). Each variant is then given the transcripts that contain it, so the result 
+        is the same as querying each variant on its own. A group of one variant makes exactly the per-variant query.
         '''
-        self._increment_variant_counter()
+        var_gs_by_ac = defaultdict(list)
+        for variant in variants:
+            var_g = self._get_var_g(variant, self.pysam_file)
+            var_gs_by_ac[str(var_g.ac)].append((variant, var_g))
+
+        items = []
+        query_count = 0
+        for ac, var_gs in var_gs_by_ac.items():
+            var_gs.sort(key=lambda x: x[1].posedit.pos.start.base)
+
+            for group in self._group_nearby_variants(var_gs):
+                start = max(var_g.posedit.pos.start.base for _, var_g in group)
+                end = min(var_g.posedit.pos.end.base for _, var_g in group)
+                
+                self._benchmark_start('hdp.get_tx_for_region (UTA bulk)')
+                rows = [list(row) for row in self.hdp.get_tx_for_region(ac, 'splign', start, end)]
+                self._benchmark_stop('hdp.get_tx_for_region (UTA bulk)')
+                query_count += 1
+                
+                # Columns 4 and 5 are the transcript's start_i and end_i
+                index = IntervalIndex((row[4], row[5], row) for row in rows)
+                for variant, var_g in group:
+                    items.append((variant, var_g, index.containing(var_g.posedit.pos.start.base, var_g.posedit.pos.end.base)))
+
+        self.logger.info(f"Fetched transcripts for {len(items)} variants using {query_count} UTA range queries")
+        return items
+
+    def _group_nearby_variants(self, var_gs: list):
+        '''
+        Split a list of (variant, var_g) tuples, sorted by position, wherever neighbouring variants are more than BULK_QUERY_MAX_GAP apart.   
+        '''
+        group = []
+        for variant, var_g in var_gs:
+            if group and var_g.posedit.pos.start.base - group[-1][1].posedit.pos.end.base > BULK_QUERY_MAX_GAP:
+                yield group
+                group = []
+            group.append((variant, var_g))
+        if group:
+            yield group
 
+    def _get_var_g(self, variant: Variant, pysam_file: PysamTxEff):
+        '''
+        Return the variant as an HGVS SequenceVariant with g. nomenclature 
+        '''
         # Even the numeric chromosomes need to be strings in order to be found in the chromosome map
         assert type(variant.chromosome) == str 
 
         refseq_chromosome = chromosome_map.get_refseq(variant.chromosome)
         
-        # Look up the variant using HGVS
-        pos_part = self._correct_indel_coords(variant.chromosome, variant.position, variant.reference, variant.alt)
+        pos_part = self._correct_indel_coords(variant.chromosome, variant.position, variant.reference, variant.alt, pysam_file)
         new_hgvs = refseq_chromosome + ':g.' + pos_part
     
-        var_g = self.hgvs_parser.parse_hgvs_variant(new_hgvs)
+        return self.hgvs_parser.parse_hgvs_variant(new_hgvs)
+
+    def _lookup_variant_hgvs_transcripts(self, worker, variant: Variant, var_g: SequenceVariant = None, tx_list: list = None):
+        '''
+        Use HGVS/UTA to return a list of the transcripts for a variant. The worker is an HgvsWorker, or this object when 
+        running on a single thread, and provides the UTA connection, AssemblyMapper and reference FASTA. In bulk mode 
+        the g. and the transcripts in the variant's region have already been looked up.
+        '''
+        self._increment_variant_counter()
+
+        # Look up the variant using HGVS
+        if var_g is None:
+            var_g = self._get_var_g(variant, worker.pysam_file)
     
         # Retrieve transcripts that are in a genomic region
-        self._benchmark_start('hdp.get_tx_for_region (UTA)')
-        tx_list = self.hdp.get_tx_for_region(str(var_g.ac), 'splign', var_g.posedit.pos.start.base, var_g.posedit.pos.end.base)
-        self._benchmark_stop('hdp.get_tx_for_region (UTA)')
+        if tx_list is None:
+            self._benchmark_start('hdp.get_tx_for_region (UTA)')
+            tx_list = worker.uta_cache.get_tx_for_region(str(var_g.ac), 'splign', var_g.posedit.pos.start.base, var_g.posedit.pos.end.base)
+            self._benchmark_stop('hdp.get_tx_for_region (UTA)')
 
         hgvs_transcripts = []
         
@@ -357,57 +517,22 @@ class TxEffHgvs(object):
                 
                 # Annovar doesn't provide a gene for UTR and introns, so in those cases the gene information comes from HGVS using this function.
                 self._benchmark_start('hdp.get_tx_info (UTA)')
-                transcript_detail = self.hdp.get_tx_info(refseq_transcript, refseq_chromosome, 'splign')
+                transcript_detail = worker.uta_cache.get_tx_info(refseq_transcript, refseq_chromosome, 'splign')
                 variant_transcript.hgnc_gene = transcript_detail['hgnc']
                 self._benchmark_stop('hdp.get_tx_info (UTA)')
                 
                 # Determine c. and p.. Non coding transcripts will throw an error. See HGVSUsageError caught below.
-                self._benchmark_start('am.g_to_c (SeqRepo)') 
-                var_c = self.am.g_to_c(var_g, str(refseq_transcript))
-                self._benchmark_stop('am.g_to_c (SeqRepo)')
+                projection = self._get_projection(worker.am, var_g, refseq_transcript, variant)
 
-                self._benchmark_start('am.c_to_p (SeqRepo)') 
-                var_p = self.am.c_to_p(var_c)
-                self._benchmark_stop('am.c_to_p (SeqRepo)')
-                
-                # setting uncertain to False removes the parentheses on the stringified form
-                if var_p.posedit:
-                    var_p.posedit.uncertain = False
-    
-                # Convert the three letter amino acid seq to a one letter and remove the 'transcript:' prefix.             
-                var_p1 = var_p.format(conf={"p_3_letter": False}).replace(var_p.ac+':','')
-                var_p3 = var_p.format(conf={"p_3_letter": True}).replace(var_p.ac+':','')
-    
-                # Correct bug in biocommons/hgvs lib that always returns the three letter amino acid when variant is start loss. 
-                if var_p1 == 'p.Met1?':
-                    var_p1 = 'p.M1?'
-    
-                c_dot = var_c.type +'.' + str(var_c.posedit)
-                
                 # HGVS doesrn't provide a variant type. 
-                variant_type = None
-                
-                # The amino acid position only exists for certain types of variants.             
-                if var_p3 == 'p.?' and var_p.posedit:
-                    self.logger.warning(f"A position is not expected with 'p.?': {variant}, pos={var_p.posedit}")
-                elif isinstance(var_p.posedit, hgvs.edit.AARefAlt):
-                    # Some variants don't have any position information, and that is ok. Most of the time these are indels, as indicated by ``var_p.posedit.type``
-                    self.logger.debug(f"HGVS variant does not have a position: ref={var_p.posedit.ref}, alt={var_p.posedit.alt}, type={var_p.posedit.type}, str={str(var_p.posedit)}. Keeping.")                    
-                elif var_p.posedit:
-                    variant_transcript.hgvs_amino_acid_position = var_p.posedit.pos.start.pos
-
-                variant_transcript.hgvs_base_position = var_c.posedit.pos.start.base
-                
-                variant_transcript.hgvs_c_dot = c_dot
-                variant_transcript.hgvs_p_dot_one = var_p1
-                variant_transcript.hgvs_p_dot_three = var_p3
-                variant_transcript.refseq_transcript = var_c.ac
-                variant_transcript.variant_type = variant_type
-    
-                # Sometimes the am.c_to_p function returns the protein accession as an MD5 hash 
-                # of the amino acid sequence (see uta.get_acs_for_protein_seq)
-                if not var_p.ac.startswith('MD5'):
-                    variant_transcript.protein_transcript = var_p.ac
+                variant_transcript.variant_type = None
+                variant_transcript.hgvs_amino_acid_position = projection['hgvs_amino_acid_position']
+                variant_transcript.hgvs_base_position = projection['hgvs_base_position']
+                variant_transcript.hgvs_c_dot = projection['hgvs_c_dot']
+                variant_transcript.hgvs_p_dot_one = projection['hgvs_p_dot_one']
+                variant_transcript.hgvs_p_dot_three = projection['hgvs_p_dot_three']
+                variant_transcript.refseq_transcript = projection['refseq_transcript']
+                variant_transcript.protein_transcript = projection['protein_transcript']
     
                 # Data validation. We'd like to know how often this happens.
                 if (variant_transcript.hgvs_p_dot_one or variant_transcript.hgvs_p_dot_three) and not variant_transcript.protein_transcript:
@@ -462,6 +587,68 @@ class TxEffHgvs(object):
 
         return hgvs_transcripts
     
+    def _get_projection(self, am, var_g: SequenceVariant, refseq_transcript: str, variant: Variant):
+        '''
+        Project a g. onto a transcript and return the c. and p. fields as a dictionary. Results are kept in the projection cache,
+        keyed by the g., the transcript and the data versions, so that recurrent variants don't go back to SeqRepo.
+        '''
+        key = [str(var_g), refseq_transcript]
+        projection = self.projection_cache.get(key)
+        if projection is None:
+            projection = self._project(am, var_g, refseq_transcript, variant)
+            self.projection_cache.put(key, projection)
+        return projection
+
+    def _project(self, am, var_g: SequenceVariant, refseq_transcript: str, variant: Variant):
+        '''
+        Use the assembly mapper to determine the c. and p. of a variant on a transcript
+        '''
+        self._benchmark_start('am.g_to_c (SeqRepo)') 
+        var_c = am.g_to_c(var_g, str(refseq_transcript))
+        self._benchmark_stop('am.g_to_c (SeqRepo)')
+
+        self._benchmark_start('am.c_to_p (SeqRepo)') 
+        var_p = am.c_to_p(var_c)
+        self._benchmark_stop('am.c_to_p (SeqRepo)')
+        
+        # setting uncertain to False removes the parentheses on the stringified form
+        if var_p.posedit:
+            var_p.posedit.uncertain = False
+
+        # Convert the three letter amino acid seq to a one letter and remove the 'transcript:' prefix.             
+        var_p1 = var_p.format(conf={"p_3_letter": False}).replace(var_p.ac+':','')
+        var_p3 = var_p.format(conf={"p_3_letter": True}).replace(var_p.ac+':','')
+
+        # Correct bug in biocommons/hgvs lib that always returns the three letter amino acid when variant is start loss. 
+        if var_p1 == 'p.Met1?':
+            var_p1 = 'p.M1?'
+
+        c_dot = var_c.type +'.' + str(var_c.posedit)
+        
+        # The amino acid position only exists for certain types of variants.             
+        amino_acid_position = None
+        if var_p3 == 'p.?' and var_p.posedit:
+            self.logger.warning(f"A position is not expected with 'p.?': {variant}, pos={var_p.posedit}")
+        elif isinstance(var_p.posedit, hgvs.edit.AARefAlt):
+            # Some variants don't have any position information, and that is ok. Most of the time these are indels, as indicated by ``var_p.posedit.type``
+            self.logger.debug(f"HGVS variant does not have a position: ref={var_p.posedit.ref}, alt={var_p.posedit.alt}, type={var_p.posedit.type}, str={str(var_p.posedit)}. Keeping.")                    
+        elif var_p.posedit:
+            amino_acid_position = var_p.posedit.pos.start.pos
+
+        # Sometimes the am.c_to_p function returns the protein accession as an MD5 hash 
+        # of the amino acid sequence (see uta.get_acs_for_protein_seq)
+        protein_transcript = None
+        if not var_p.ac.startswith('MD5'):
+            protein_transcript = var_p.ac
+
+        return {'hgvs_c_dot': c_dot,
+                'hgvs_base_position': var_c.posedit.pos.start.base,
+                'hgvs_p_dot_one': var_p1,
+                'hgvs_p_dot_three': var_p3,
+                'hgvs_amino_acid_position': amino_acid_position,
+                'refseq_transcript': var_c.ac,
+                'protein_transcript': protein_transcript}
+
     def __to_g_dot(self, var_g: SequenceVariant):
         '''
         Convert the SequenceVariant object to a g-dot. The string 'NC_000002.11:g.48033742_48033759dup' is split and just the g. is returned.  
@@ -6,14 +6,17 @@ Created on Apr 29, 2022
 Update a VCF with the variant-transcript details.  
 '''
 
-from collections import defaultdict
+from collections import defaultdict, OrderedDict
 from enum import Enum
+import hashlib
+import json
 import logging
 import sys
 
 import vcfpy
 
 from edu.ohsu.compbio.txeff.variant import Variant
+from edu.ohsu.compbio.txeff.variant_transcript import VariantTranscript
 
 
 class TranscriptEffect(Enum):
@@ -38,10 +41,31 @@ class TranscriptEffect(Enum):
     TFX_EXON = 'TFX_EXON'
     TFX_AMINO_ACID_POSITION = 'TFX_AMINO_ACID_POSITION'
     TFX_REFERENCE_CONTEXT = 'TFX_REFERENCE_CONTEXT' 
+    TFX_ANNOVAR_CHECKSUM = 'TFX_ANNOVAR_CHECKSUM'
+
+# VCF header lines that identify the tool and data versions used to create the transcript effects 
+TFX_VERSION_HEADER = 'TfxVersion'
+TFX_DATA_VERSION_HEADER = 'TfxDataVersion'
+
+def get_annovar_checksums(annovar_records: list):
+    '''
+    Return a dictionary where the key is a variant and the value is a checksum of the variant's annovar records. It is 
+    written to the output VCF so that a later run only reuses a variant's transcript effects if annovar said the same 
+    thing about it.
+    '''
+    variant_records = defaultdict(list)
+    
+    for annovar_record in annovar_records:
+        variant = Variant(annovar_record.chromosome, annovar_record.position, annovar_record.reference, annovar_record.alt)
+        variant_records[variant].append(json.dumps(vars(annovar_record), sort_keys=True, default=str))
+    
+    return {variant: hashlib.sha256('\n'.join(sorted(records)).encode()).hexdigest() for variant, records in variant_records.items()}
 
 class TxEffVcf(object):
-    def __init__(self, tfx_version: str, in_vcf:str, out_vcf:str):
+    def __init__(self, tfx_version: str, in_vcf:str, out_vcf:str, data_version: str = None, annovar_checksums: dict = None):
         self.version = tfx_version
+        self.data_version = data_version
+        self.annovar_checksums = annovar_checksums if annovar_checksums else dict()
         self.logger = logging.getLogger(__name__)
         self.in_vcf_filename = in_vcf
         self.out_vcf_filename = out_vcf
@@ -87,67 +111,74 @@ class TxEffVcf(object):
         vcf_records = []
 
         for (variant, vcf_record) in vcf_variant_dict.items():
-            transcripts = transcript_dict.get(variant)
-
-            if not transcripts:
-                self.logger.warning(f"No transcripts found for VCF variant {variant}")
-                vcf_records.append(vcf_record)
-                continue
-            
-            # These values are the same for all transcripts so there is only one value. 
-            tfx_splice = self._get_any_splicing(transcripts)            
-            tfx_reference_context = self._get_and_confirm_single_value('reference_context', lambda x: x.reference_context, transcripts)
-
-            # These values are different for each transcript
-            tfx_base_positions = []
-            tfx_exons = []
-            tfx_genes = []
-            tfx_g_dots = []
-            tfx_c_dots = []
-            tfx_p1 = []
-            tfx_p3 = []
-            tfx_refseq_transcripts = []
-            tfx_variant_effects = []
-            tfx_variant_types = []
-            tfx_protein_transcripts = []
-            tfx_amino_acid_positions = []
-            
-            for transcript in sorted(transcripts):
-                tfx_base_positions.append(transcript.hgvs_base_position)
-                tfx_exons.append(transcript.exon)
-                tfx_genes.append(transcript.hgnc_gene)
-                tfx_g_dots.append(transcript.sequence_variant)
-                tfx_c_dots.append(transcript.hgvs_c_dot)
-                tfx_p1.append(transcript.hgvs_p_dot_one)
-                tfx_p3.append(transcript.hgvs_p_dot_three)
-                tfx_refseq_transcripts.append(transcript.refseq_transcript)
-                tfx_variant_effects.append(transcript.variant_effect)
-                tfx_variant_types.append(transcript.variant_type)
-                tfx_protein_transcripts.append(transcript.protein_transcript)
-                tfx_amino_acid_positions.append(transcript.hgvs_amino_acid_position)
-    
-            vcf_record.INFO[TranscriptEffect.TFX_SPLICE.value] = [tfx_splice]
-            vcf_record.INFO[TranscriptEffect.TFX_REFERENCE_CONTEXT.value] = [tfx_reference_context]
-            vcf_record.INFO[TranscriptEffect.TFX_BASE_POSITION.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_base_positions])]
-            vcf_record.INFO[TranscriptEffect.TFX_EXON.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_exons])]
-            vcf_record.INFO[TranscriptEffect.TFX_GENE.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_genes])]
-            vcf_record.INFO[TranscriptEffect.TFX_G_DOT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_g_dots])]
-            vcf_record.INFO[TranscriptEffect.TFX_HGVSC.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_c_dots])]
-            vcf_record.INFO[TranscriptEffect.TFX_HGVSP1.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_p1])]
-            vcf_record.INFO[TranscriptEffect.TFX_HGVSP3.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_p3])]
-            vcf_record.INFO[TranscriptEffect.TFX_AMINO_ACID_POSITION.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_amino_acid_positions])]
-            vcf_record.INFO[TranscriptEffect.TFX_TRANSCRIPT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_refseq_transcripts])]        
-            vcf_record.INFO[TranscriptEffect.TFX_VARIANT_TYPE.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_variant_types])]        
-            vcf_record.INFO[TranscriptEffect.TFX_PROTEIN_TRANSCRIPT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_protein_transcripts])]
-
-            # Replace spaces with underscore because spaces are not allowed in the INFO field.
-            # Example: annovar's "nonframeshift insertion" and "nonframeshift deletion" will have an underscore inserted. 
-            vcf_record.INFO[TranscriptEffect.TFX_VARIANT_EFFECT.value] = [':'.join([self._replaceNoneWithEmpty(x).replace(' ', '_') for x in tfx_variant_effects])]
-            
-            vcf_records.append(vcf_record)
+            vcf_records.append(self._add_transcripts_to_record(variant, vcf_record, transcript_dict.get(variant)))
         
         return vcf_records
 
+    def _add_transcripts_to_record(self, variant: Variant, vcf_record: vcfpy.Record, transcripts: list):
+        '''
+        Transform the details of a variant's transcripts into parallel arrays and add them to the variant's VCF row.  
+        '''
+        if not transcripts:
+            self.logger.warning(f"No transcripts found for VCF variant {variant}")
+            return vcf_record
+        
+        # These values are the same for all transcripts so there is only one value. 
+        tfx_splice = self._get_any_splicing(transcripts)            
+        tfx_reference_context = self._get_and_confirm_single_value('reference_context', lambda x: x.reference_context, transcripts)
+
+        # These values are different for each transcript
+        tfx_base_positions = []
+        tfx_exons = []
+        tfx_genes = []
+        tfx_g_dots = []
+        tfx_c_dots = []
+        tfx_p1 = []
+        tfx_p3 = []
+        tfx_refseq_transcripts = []
+        tfx_variant_effects = []
+        tfx_variant_types = []
+        tfx_protein_transcripts = []
+        tfx_amino_acid_positions = []
+        
+        for transcript in sorted(transcripts):
+            tfx_base_positions.append(transcript.hgvs_base_position)
+            tfx_exons.append(transcript.exon)
+            tfx_genes.append(transcript.hgnc_gene)
+            tfx_g_dots.append(transcript.sequence_variant)
+            tfx_c_dots.append(transcript.hgvs_c_dot)
+            tfx_p1.append(transcript.hgvs_p_dot_one)
+            tfx_p3.append(transcript.hgvs_p_dot_three)
+            tfx_refseq_transcripts.append(transcript.refseq_transcript)
+            tfx_variant_effects.append(transcript.variant_effect)
+            tfx_variant_types.append(transcript.variant_type)
+            tfx_protein_transcripts.append(transcript.protein_transcript)
+            tfx_amino_acid_positions.append(transcript.hgvs_amino_acid_position)
+
+        vcf_record.INFO[TranscriptEffect.TFX_SPLICE.value] = [tfx_splice]
+        vcf_record.INFO[TranscriptEffect.TFX_REFERENCE_CONTEXT.value] = [tfx_reference_context]
+        vcf_record.INFO[TranscriptEffect.TFX_BASE_POSITION.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_base_positions])]
+        vcf_record.INFO[TranscriptEffect.TFX_EXON.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_exons])]
+        vcf_record.INFO[TranscriptEffect.TFX_GENE.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_genes])]
+        vcf_record.INFO[TranscriptEffect.TFX_G_DOT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_g_dots])]
+        vcf_record.INFO[TranscriptEffect.TFX_HGVSC.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_c_dots])]
+        vcf_record.INFO[TranscriptEffect.TFX_HGVSP1.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_p1])]
+        vcf_record.INFO[TranscriptEffect.TFX_HGVSP3.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_p3])]
+        vcf_record.INFO[TranscriptEffect.TFX_AMINO_ACID_POSITION.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_amino_acid_positions])]
+        vcf_record.INFO[TranscriptEffect.TFX_TRANSCRIPT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_refseq_transcripts])]        
+        vcf_record.INFO[TranscriptEffect.TFX_VARIANT_TYPE.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_variant_types])]        
+        vcf_record.INFO[TranscriptEffect.TFX_PROTEIN_TRANSCRIPT.value] = [':'.join([self._replaceNoneWithEmpty(x) for x in tfx_protein_transcripts])]
+
+        # Replace spaces with underscore because spaces are not allowed in the INFO field.
+        # Example: annovar's "nonframeshift insertion" and "nonframeshift deletion" will have an underscore inserted. 
+        vcf_record.INFO[TranscriptEffect.TFX_VARIANT_EFFECT.value] = [':'.join([self._replaceNoneWithEmpty(x).replace(' ', '_') for x in tfx_variant_effects])]
+        
+        annovar_checksum = self.annovar_checksums.get(variant)
+        if annovar_checksum:
+            vcf_record.INFO[TranscriptEffect.TFX_ANNOVAR_CHECKSUM.value] = [annovar_checksum]
+        
+        return vcf_record
+
     def _get_and_confirm_single_value(self, field_name, getter, transcripts: list):
         '''
         Takes a list of trancripts and a getter function for one of the fields in the transcript. This function
@@ -196,71 +227,260 @@ class TxEffVcf(object):
         Add the new transcript effect fields to the VCF header 
         '''
         header.add_line(vcfpy.HeaderLine('tfx_commandline', ' '.join(sys.argv)))
-        header.add_line(vcfpy.HeaderLine('TfxVersion', self.version))
+        header.add_line(vcfpy.HeaderLine(TFX_VERSION_HEADER, self.version))
+        if self.data_version:
+            header.add_line(vcfpy.HeaderLine(TFX_DATA_VERSION_HEADER, self.data_version))
         
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_BASE_POSITION.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_BASE_POSITION.value),
                                                 ('Number', '.'),
                                                 ('Type', 'String'),
                                                 ('Description', 'Coding sequence start position.')]))
     
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_EXON.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_EXON.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Exon number associated with given transcript (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_GENE.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_GENE.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'HGNC gene symbol (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_G_DOT.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_G_DOT.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'HGVS g-dot nomenclature (parallel array of values).')]))    
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_HGVSC.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_HGVSC.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'HGVS cdot nomenclature (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_HGVSP1.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_HGVSP1.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'HGVS pdot nomenclature, single letter amino acids (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_HGVSP3.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_HGVSP3.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'HGVS pdot nomenclature, three letter amino acids (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_SPLICE.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_SPLICE.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Splice site annotation (single value).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_TRANSCRIPT.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_TRANSCRIPT.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Transcript identifier (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_VARIANT_EFFECT.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_VARIANT_EFFECT.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Variant effect annotation (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_VARIANT_TYPE.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_VARIANT_TYPE.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Variant type or location annotation (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_PROTEIN_TRANSCRIPT.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_PROTEIN_TRANSCRIPT.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Protein transcript (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_AMINO_ACID_POSITION.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_AMINO_ACID_POSITION.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Amino acid start position (parallel array of values).')]))
-        header.add_info_line(vcfpy.OrderedDict([('ID', TranscriptEffect.TFX_REFERENCE_CONTEXT.value),
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_REFERENCE_CONTEXT.value),
                                                                 ('Number', '.'),
                                                                 ('Type', 'String'),
                                                                 ('Description', 'Reference context (single value).')]))
+        header.add_info_line(OrderedDict([('ID', TranscriptEffect.TFX_ANNOVAR_CHECKSUM.value),
+                                                                ('Number', '.'),
+                                                                ('Type', 'String'),
+                                                                ('Description', 'Checksum of the annovar records the transcript effects were made from (single value).')]))
         
     
-    def create_vcf(self, transcripts: list):
+    def get_previous_transcripts(self, previous_vcf_filename: str):
+        '''
+        Read the transcript effects from a VCF written by an earlier run and return a dictionary where the key is a variant and 
+        the value is a list of transcripts. The transcripts are only returned if the earlier run used the same tfx version and 
+        data version as this one, otherwise the dictionary is empty. Variants without transcript effects are not included, nor 
+        are variants whose annovar checksum doesn't match annovar_checksums, because annovar said something different about them.
+        '''
+        vcf_reader = vcfpy.Reader.from_path(previous_vcf_filename)
+        
+        previous_version = self._get_header_value(vcf_reader.header, TFX_VERSION_HEADER)
+        previous_data_version = self._get_header_value(vcf_reader.header, TFX_DATA_VERSION_HEADER)
+        
+        if previous_version != self.version or previous_data_version != self.data_version:
+            self.logger.warning(f"Transcript effects in {previous_vcf_filename} can't be reused. They were created by version {previous_version} "
+                                f"with data version {previous_data_version} but this is version {self.version} with data version {self.data_version}")
+            vcf_reader.close()
+            return dict()
+        
+        transcript_dict = dict()
+        changed_count = 0
+
+        for vcf_record in vcf_reader:
+            if len(vcf_record.ALT) != 1:
+                continue
+
+            variant = Variant(vcf_record.CHROM, vcf_record.POS, vcf_record.REF, vcf_record.ALT[0].value)
+            transcripts = self._get_transcripts_from_info(variant, vcf_record.INFO)
+            
+            if not transcripts:
+                continue
+            elif self._get_info_value(vcf_record.INFO, TranscriptEffect.TFX_ANNOVAR_CHECKSUM) != self.annovar_checksums.get(variant):
+                changed_count += 1
+            else:
+                transcript_dict[variant] = transcripts
+
+        vcf_reader.close()
+        
+        self.logger.info(f"Read transcript effects for {len(transcript_dict)} variants from {previous_vcf_filename}, "
+                         f"{changed_count} variants can't be reused because their annovar records are different")
+        return transcript_dict
+
+    def _get_header_value(self, header: vcfpy.header.Header, key: str):
+        '''
+        Return the value of a simple header line (eg ##TfxVersion=0.7.8) or None if the header doesn't have it
+        '''
+        lines = list(header.get_lines(key))
+        if not lines:
+            return None
+        return lines[0].value
+
+    def _get_transcripts_from_info(self, variant: Variant, info: dict):
+        '''
+        Transform the parallel arrays in a VCF row's INFO fields back into transcripts. This is the reverse of _add_transcripts_to_record.  
+        '''
+        if TranscriptEffect.TFX_TRANSCRIPT.value not in info:
+            return []
+        
+        tfx_splice = self._get_info_value(info, TranscriptEffect.TFX_SPLICE)
+        tfx_reference_context = self._get_info_value(info, TranscriptEffect.TFX_REFERENCE_CONTEXT)
+        
+        fields = {'hgvs_base_position': TranscriptEffect.TFX_BASE_POSITION,
+                  'exon': TranscriptEffect.TFX_EXON,
+                  'hgnc_gene': TranscriptEffect.TFX_GENE,
+                  'sequence_variant': TranscriptEffect.TFX_G_DOT,
+                  'hgvs_c_dot': TranscriptEffect.TFX_HGVSC,
+                  'hgvs_p_dot_one': TranscriptEffect.TFX_HGVSP1,
+                  'hgvs_p_dot_three': TranscriptEffect.TFX_HGVSP3,
+                  'hgvs_amino_acid_position': TranscriptEffect.TFX_AMINO_ACID_POSITION,
+                  'refseq_transcript': TranscriptEffect.TFX_TRANSCRIPT,
+                  'variant_type': TranscriptEffect.TFX_VARIANT_TYPE,
+                  'protein_transcript': TranscriptEffect.TFX_PROTEIN_TRANSCRIPT,
+                  'variant_effect': TranscriptEffect.TFX_VARIANT_EFFECT}
+        
+        field_values = {name: self._get_info_value(info, effect, '').split(':') for name, effect in fields.items()}
+
+        transcript_count = len(field_values['refseq_transcript'])
+        for name, values in field_values.items():
+            if len(values) != transcript_count:
+                raise ValueError(f"Variant {variant} field {fields[name].value} has {len(values)} values but there are {transcript_count} transcripts")
+        
+        transcripts = []
+        for i in range(transcript_count):
+            transcript = VariantTranscript(variant.chromosome, variant.position, variant.reference, variant.alt)
+            for name, values in field_values.items():
+                setattr(transcript, name, values[i] if values[i] != '' else None)
+            transcript.splicing = tfx_splice
+            transcript.reference_context = tfx_reference_context
+            transcripts.append(transcript)
+        
+        return transcripts
+
+    def _get_info_value(self, info: dict, effect: TranscriptEffect, default: str = None):
+        '''
+        Return the single value that the transcript effects are written as, or the default if it is missing or empty. vcfpy
+        splits INFO values on commas so the pieces are joined back together.
         '''
-        Read VCF variants from file, add transcript effects to the INFO fields and write out a new VCF. 
+        values = info.get(effect.value)
+        value = ','.join(x for x in values if x is not None) if values else ''
+        return value if value else default
+
+    def _get_sorted_transcripts_dict(self, transcripts: list):
         '''
+        Return a dictionary where the key is a chromosome and the value is a list of the chromosome's transcripts sorted by position 
+        '''
+        transcript_dict = defaultdict(list)
+        
+        for transcript in transcripts:
+            transcript_dict[transcript.chromosome].append(transcript)
+
+        for chromosome_transcripts in transcript_dict.values():
+            chromosome_transcripts.sort(key=lambda x: x.position)
+        
+        return transcript_dict
+
+    def _stream_vcf(self, transcripts: list):
+        '''
+        Walk through the input VCF and the position sorted transcripts together, and write each VCF record as soon as its 
+        transcript effects have been added. No VCF records are held in memory, but only the VCF side streams: every transcript 
+        is still held, along with a per-chromosome copy of the list sorted by position. The input VCF must be sorted by 
+        position within each chromosome.   
+        '''
+        transcript_dict = self._get_sorted_transcripts_dict(transcripts)
+        
+        # Index of the first transcript on each chromosome that has not been passed, and the last position seen on each chromosome
+        transcript_index = defaultdict(int)
+        last_position = dict()
+        
+        # Variants at the current position, used to detect duplicates 
+        position_variants = set()
+        record_count = 0
+        
+        vcf_reader = vcfpy.Reader.from_path(self.in_vcf_filename)
+        
+        # Add new INFO fields to VCF header
+        self._update_header(vcf_reader.header)
+        writer = vcfpy.Writer.from_path(self.out_vcf_filename, vcf_reader.header)
+
+        try:
+            for vcf_record in vcf_reader:
+                if len(vcf_record.ALT) > 1:
+                    raise Exception(f'VCF variants must have just one ALT allele: {vcf_record.CHROM}-{vcf_record.POS}-{vcf_record.REF}-{vcf_record.ALT}')
+            
+                variant = Variant(vcf_record.CHROM, vcf_record.POS, vcf_record.REF, vcf_record.ALT[0].value)
+            
+                previous_position = last_position.get(variant.chromosome)
+                if previous_position is not None and variant.position < previous_position:
+                    raise ValueError(f"{self.in_vcf_filename} must be sorted by position to be streamed: {variant} comes after position {previous_position}")
+                elif previous_position != variant.position:
+                    position_variants.clear()
+            
+                if variant in position_variants:
+                    raise Exception(f"Duplicate variant in {self.in_vcf_filename}: {variant}")
+                position_variants.add(variant)
+                last_position[variant.chromosome] = variant.position
+            
+                # Skip past transcripts at earlier positions, then collect the ones for this variant
+                chromosome_transcripts = transcript_dict.get(variant.chromosome, [])
+                i = transcript_index[variant.chromosome]
+                while i < len(chromosome_transcripts) and chromosome_transcripts[i].position < variant.position:
+                    i += 1
+                transcript_index[variant.chromosome] = i
+            
+                variant_transcripts = []
+                while i < len(chromosome_transcripts) and chromosome_transcripts[i].position == variant.position:
+                    transcript = chromosome_transcripts[i]
+                    if transcript.reference == variant.reference and transcript.alt == variant.alt:
+                        variant_transcripts.append(transcript)
+                    i += 1
+
+                writer.write_record(self._add_transcripts_to_record(variant, vcf_record, variant_transcripts))
+                record_count += 1
+        finally:
+            vcf_reader.close()
+            writer.close()
+        
+        self.logger.info(f"Wrote {record_count} variants with transcript effects to VCF file {self.out_vcf_filename}")
+
+    def create_vcf(self, transcripts: list, streaming: bool = False):
+        '''
+        Read VCF variants from file, add transcript effects to the INFO fields and write out a new VCF. In streaming mode each 
+        VCF record is written as soon as it is annotated rather than reading the whole VCF first. The transcripts are still 
+        held in memory.
+        '''
+        if streaming:
+            self._stream_vcf(transcripts)
+            return
+
         # Transform the transcript list into a dictionary 
         transcript_dict = self._get_transcripts_dict(transcripts)
         self.logger.info(f'There are {len(transcript_dict)} distinct variants among {len(transcripts)} transcripts')
@@ -30,6 +30,7 @@ class Benchmarking(object):
         '''
         self.logger = logging.getLogger(__name__)
         self._benchmarks = dict()
+        self._counters = dict()
         self._last_name_updated = None
     
     def start(self, name):
@@ -90,9 +91,28 @@ class Benchmarking(object):
 
     def clear(self):
         """
-        Remove all events being timed 
+        Remove all events being timed. Counters are not cleared. 
         """
         self._benchmarks.clear()
+
+    def increment(self, name, n=1):
+        """
+        Add n to a named counter (eg cache hits and misses) 
+        """
+        assert name, "name must be specified"
+        self._counters[name] = self._counters.get(name, 0) + n
+
+    def get_count(self, name):
+        """
+        Return the value of a named counter
+        """
+        return self._counters.get(name, 0)
+
+    def get_counter_names(self):
+        """
+        Return the names of the counters
+        """
+        return self._counters.keys()
     
     def get_time_total(self, name):
         """
@@ -0,0 +1,34 @@
+'''
+In-memory index for finding the intervals that contain a region. Used to resolve variants against the transcripts
+returned by a single UTA range query, rather than querying UTA once per variant.
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+from bisect import bisect_left
+
+class IntervalIndex(object):
+    '''
+    Intervals are sorted by start. A query bisects to the intervals that start before the start of the region, and skips
+    those that start so early that even the longest interval can't reach the end of the region.
+    '''
+    def __init__(self, intervals):
+        '''
+        intervals is an iterable of (start, end, value) tuples
+        '''
+        self._intervals = sorted(intervals, key=lambda interval: interval[0])
+        self._starts = [interval[0] for interval in self._intervals]
+        self._max_length = max((end - start for start, end, _ in self._intervals), default=0)
+
+    def __len__(self):
+        return len(self._intervals)
+
+    def containing(self, start: int, end: int):
+        '''
+        Return the values of the intervals where interval start < start and end <= interval end. This is the same condition
+        that UTA uses in get_tx_for_region: min(start_i) < start and end <= max(end_i).
+        '''
+        first = bisect_left(self._starts, end - self._max_length)
+        last = bisect_left(self._starts, start)
+        return [value for (interval_start, interval_end, value) in self._intervals[first:last] if end <= interval_end]
@@ -0,0 +1,117 @@
+'''
+Record wall time, CPU time, peak memory and throughput for each stage of tx_eff_control.py, along with cache hit rates,
+and write them to a JSON file so that performance can be compared across releases.
+
+See test_stage_metrics.py for example usage.
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+from contextlib import contextmanager
+import json
+import logging
+import resource
+import sys
+import time
+
+class Stage(object):
+    '''
+    The measurements for one stage. Set ``records`` to the number of records the stage processed.
+    '''
+    def __init__(self, name):
+        self.name = name
+        self.records = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_rss_mb = None
+
+    def to_dict(self):
+        records_per_second = None
+        if self.records is not None and self.wall_seconds:
+            records_per_second = self.records / self.wall_seconds
+
+        return {'name': self.name,
+                'wall_seconds': self.wall_seconds,
+                'cpu_seconds': self.cpu_seconds,
+                'peak_rss_mb': self.peak_rss_mb,
+                'records': self.records,
+                'records_per_second': records_per_second}
+
+class StageMetrics(object):
+    '''
+    Peak RSS is the high-water mark of the whole process at the end of each stage, so it never decreases from one stage to the next.
+    CPU time includes all threads.
+    '''
+    def __init__(self):
+        '''
+        Constructor
+        '''
+        self.logger = logging.getLogger(__name__)
+        self._stages = []
+        self._caches = []
+        self._info = dict()
+
+    @contextmanager
+    def stage(self, name: str, records: int = None):
+        '''
+        Measure the code run inside a ``with`` block. The Stage is returned so that the record count can be set when it
+        isn't known until the stage is done.
+        '''
+        stage = Stage(name)
+        stage.records = records
+
+        start_real = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield stage
+        finally:
+            stage.wall_seconds = time.perf_counter() - start_real
+            stage.cpu_seconds = time.process_time() - start_cpu
+            stage.peak_rss_mb = get_peak_rss_mb()
+            self._stages.append(stage)
+            self.logger.info(f"Stage {name}: wall={stage.wall_seconds:.3f}s, cpu={stage.cpu_seconds:.3f}s, peak rss={stage.peak_rss_mb:.1f}MB, records={stage.records}")
+
+    def add_cache(self, name: str, hits: int, misses: int):
+        '''
+        Record the hit rate of a cache
+        '''
+        lookups = hits + misses
+        self._caches.append({'name': name,
+                             'hits': hits,
+                             'misses': misses,
+                             'hit_rate': hits / lookups if lookups else None})
+
+    def add_info(self, name: str, value):
+        '''
+        Record a value that describes the run (eg version, thread count)
+        '''
+        self._info[name] = value
+
+    def get_stages(self):
+        return list(self._stages)
+
+    def to_dict(self):
+        return {'info': self._info,
+                'stages': [stage.to_dict() for stage in self._stages],
+                'caches': self._caches,
+                'total_wall_seconds': sum(stage.wall_seconds for stage in self._stages),
+                'total_cpu_seconds': sum(stage.cpu_seconds for stage in self._stages),
+                'peak_rss_mb': get_peak_rss_mb()}
+
+    def write(self, filename: str):
+        '''
+        Write the metrics to a JSON file
+        '''
+        with open(filename, 'w') as json_file:
+            json.dump(self.to_dict(), json_file, indent=4)
+        self.logger.info(f"Wrote stage metrics to {filename}")
+
+def get_peak_rss_mb():
+    '''
+    Return the peak resident set size of this process in megabytes. ru_maxrss is in kilobytes on Linux and bytes on macOS.
+    '''
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return peak_rss / (1024 * 1024)
+    return peak_rss / 1024
@@ -0,0 +1,162 @@
+'''
+A least-recently-used cache that is held in memory and can optionally be backed by a SQLite file. When a file is
+used the cached values survive between runs and can be shared by several jobs running at the same time.
+
+Keys and values must be JSON serializable. See test_tfx_cache.py for example usage.
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+from collections import OrderedDict
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Seconds to wait for another process to release a lock on the cache file
+SQLITE_TIMEOUT = 120
+
+class TfxCache(object):
+    '''
+    Entries are stored under a namespace (eg the name of the function whose results are cached) and a version (eg the
+    UTA schema). Entries made using a different version are never returned.
+
+    The in-memory cache holds at most ``max_size`` entries and evicts the least recently used entry when it is full.
+    The file holds at most ``max_disk_size`` entries per namespace; the oldest entries are evicted when the cache is closed.
+    '''
+    def __init__(self, namespace: str, version: str, filename: str = None, max_size: int = 100000, max_disk_size: int = 5000000, benchmarking = None):
+        '''
+        Constructor
+        '''
+        assert namespace, "namespace must be specified"
+        assert max_size > 0, "max_size must be greater than zero"
+
+        self.logger = logging.getLogger(__name__)
+        self.namespace = namespace
+        self.version = str(version)
+        self.filename = filename
+        self.max_size = max_size
+        self.max_disk_size = max_disk_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._benchmarking = benchmarking
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = None
+
+        if filename:
+            self._open(filename)
+
+    def _open(self, filename: str):
+        '''
+        Open the cache file and create the cache table if it doesn't already exist. The default rollback journal is used
+        rather than WAL because WAL does not work on network file systems.
+        '''
+        self.logger.debug(f"Opening {self.namespace} cache file {filename}")
+        self._connection = sqlite3.connect(filename, timeout=SQLITE_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._connection.execute('''create table if not exists tfx_cache (
+                                        namespace text not null,
+                                        version text not null,
+                                        key text not null,
+                                        value text not null,
+                                        updated real not null,
+                                        primary key (namespace, version, key))''')
+        self._connection.execute('create index if not exists tfx_cache_updated on tfx_cache (namespace, updated)')
+
+    def get(self, key):
+        '''
+        Return the value stored for a key, or None if the key is not in the cache.
+        '''
+        json_key = json.dumps(key)
+
+        with self._lock:
+            if json_key in self._memory:
+                self._memory.move_to_end(json_key)
+                self._count_hit()
+                return self._memory[json_key]
+
+            if self._connection:
+                row = self._connection.execute('select value from tfx_cache where namespace=? and version=? and key=?',
+                                               (self.namespace, self.version, json_key)).fetchone()
+                if row:
+                    value = json.loads(row[0])
+                    self._put_memory(json_key, value)
+                    self._count_hit()
+                    return value
+
+            self._count_miss()
+            return None
+
+    def put(self, key, value):
+        '''
+        Add a value to the cache. Values of None are not stored because None indicates a cache miss.
+        '''
+        if value is None:
+            return
+
+        json_key = json.dumps(key)
+
+        with self._lock:
+            self._put_memory(json_key, value)
+
+            if self._connection:
+                self._connection.execute('insert or replace into tfx_cache (namespace, version, key, value, updated) values (?, ?, ?, ?, ?)',
+                                         (self.namespace, self.version, json_key, json.dumps(value), time.time()))
+
+    def _put_memory(self, json_key: str, value):
+        '''
+        Add a value to the in-memory cache and evict the least recently used entry if the cache is full.
+        '''
+        self._memory[json_key] = value
+        self._memory.move_to_end(json_key)
+
+        if len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _count_hit(self):
+        self.hits += 1
+        if self._benchmarking:
+            self._benchmarking.increment(f'{self.namespace} (cache hit)')
+
+    def _count_miss(self):
+        self.misses += 1
+        if self._benchmarking:
+            self._benchmarking.increment(f'{self.namespace} (cache miss)')
+
+    def get_hit_rate(self):
+        '''
+        Return the fraction of lookups that were found in the cache
+        '''
+        lookups = self.hits + self.misses
+        if lookups == 0:
+            return 0
+        return self.hits / lookups
+
+    def _evict_disk(self):
+        '''
+        Remove the oldest entries from the cache file so that the namespace holds no more than max_disk_size entries.
+        '''
+        count = self._connection.execute('select count(*) from tfx_cache where namespace=?', (self.namespace,)).fetchone()[0]
+        excess = count - self.max_disk_size
+        if excess > 0:
+            self.logger.info(f"Evicting {excess} entries from the {self.namespace} cache file")
+            self._connection.execute('''delete from tfx_cache where rowid in
+                                          (select rowid from tfx_cache where namespace=? order by updated limit ?)''',
+                                     (self.namespace, excess))
+
+    def close(self):
+        '''
+        Log the hit rate and close the cache file
+        '''
+        self.logger.info(f"{self.namespace} cache: hits={self.hits}, misses={self.misses}, evictions={self.evictions}, hit rate={self.get_hit_rate():.1%}")
+
+        with self._lock:
+            if self._connection:
+                self._evict_disk()
+                self._connection.close()
+                self._connection = None
@@ -1,13 +1,113 @@
+from collections import OrderedDict
+import logging
+
 import pysam
 
+class ReferenceBlockCache:
+    '''
+    Least-recently-used cache of reference sequence held in fixed size blocks that are aligned to multiples of the
+    block size. Neighbouring variants read overlapping windows of the reference, so most reads are served from blocks
+    that are already in memory. The cache holds at most max_bytes of sequence.
+    '''
+    def __init__(self, fasta: pysam.FastaFile, block_size: int = 65536, max_bytes: int = 64 * 1024 * 1024):
+        self.logger = logging.getLogger(__name__)
+        self.fasta = fasta
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+        self._bytes = 0
+        self._reference_lengths = dict()
+
+    def get_reference_length(self, chrom: str) -> int:
+        """
+        Return the length of a reference sequence. The lengths are read from the FASTA index once.
+        :param chrom:
+        :return:
+        """
+        length = self._reference_lengths.get(chrom)
+        if length is None:
+            length = self.fasta.get_reference_length(chrom)
+            self._reference_lengths[chrom] = length
+        return length
+
+    def fetch(self, chrom: str, start: int, end: int) -> str:
+        """
+        Return the sequence between 0-based start and end, the same as pysam.FastaFile.fetch.
+        :param chrom:
+        :param start:
+        :param end:
+        :return:
+        """
+        end = min(end, self.get_reference_length(chrom))
+        if end <= start:
+            return ''
+
+        first_block = start // self.block_size
+        last_block = (end - 1) // self.block_size
+        sequence = ''.join(self._get_block(chrom, block) for block in range(first_block, last_block + 1))
+
+        offset = first_block * self.block_size
+        return sequence[start - offset:end - offset]
+
+    def _get_block(self, chrom: str, block: int) -> str:
+        """
+        Return one block of the reference, reading it from the FASTA if it isn't cached.
+        :param chrom:
+        :param block:
+        :return:
+        """
+        key = (chrom, block)
+        sequence = self._blocks.get(key)
+
+        if sequence is not None:
+            self.hits += 1
+            self._blocks.move_to_end(key)
+            return sequence
+
+        self.misses += 1
+        start = block * self.block_size
+        sequence = self.fasta.fetch(reference=chrom, start=start, end=start + self.block_size)
+        self._blocks[key] = sequence
+        self._bytes += len(sequence)
+
+        # Evict the least recently used blocks, but always keep the one just read
+        while self._bytes > self.max_bytes and len(self._blocks) > 1:
+            _, evicted = self._blocks.popitem(last=False)
+            self._bytes -= len(evicted)
+
+        return sequence
+
+    def get_hit_rate(self) -> float:
+        """
+        Return the fraction of block reads that were served from the cache.
+        :return:
+        """
+        reads = self.hits + self.misses
+        if reads == 0:
+            return 0
+        return self.hits / reads
+
 class PysamTxEff:
     '''
-    Class used to query reference genome fasta file.    
+    Class used to query reference genome fasta file. Reads go through a ReferenceBlockCache unless cache_bytes is 0.
     '''
-    def __init__(self, filename, size=2000):
+    def __init__(self, filename, size=2000, cache_bytes=64 * 1024 * 1024):
+        self.logger = logging.getLogger(__name__)
         self.filename = filename
         self.my_fasta = pysam.FastaFile(self.filename)
         self.size = size
+        self.block_cache = ReferenceBlockCache(self.my_fasta, max_bytes=cache_bytes) if cache_bytes else None
+
+    def close(self):
+        """
+        Log the reference cache hit rate and close the FASTA file.
+        :return:
+        """
+        if self.block_cache:
+            self.logger.info(f"Reference cache: hits={self.block_cache.hits}, misses={self.block_cache.misses}, hit rate={self.block_cache.get_hit_rate():.1%}")
+        self.my_fasta.close()
 
     def faidx_query(self, chrom: str, pos: int) -> str:
         """
@@ -18,6 +118,8 @@ class PysamTxEff:
         :return:
         """
         start_pos, end_pos = self._set_endpts(chrom, pos)
+        if self.block_cache:
+            return self.block_cache.fetch(chrom, start_pos, end_pos)
         return self.my_fasta.fetch(reference=chrom, start=start_pos, end=end_pos)
 
     def _set_endpts(self, chrom: str, pos: int) -> (int, int):
@@ -28,7 +130,10 @@ class PysamTxEff:
         :return:
         """
         # Min and max coordinates for given reference chrom.
-        max_pos = self.my_fasta.get_reference_length(chrom)
+        if self.block_cache:
+            max_pos = self.block_cache.get_reference_length(chrom)
+        else:
+            max_pos = self.my_fasta.get_reference_length(chrom)
         min_pos = 1
         # Get the search range
         start_pos, end_pos = self._set_range(pos)
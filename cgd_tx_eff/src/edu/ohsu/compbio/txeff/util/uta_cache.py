@@ -0,0 +1,74 @@
+'''
+Cache the results of the UTA queries made by tx_eff_hgvs.py. Recurrent variants are looked up over and over again,
+so the transcripts in a region, and the details of each transcript, are kept in a TfxCache keyed by the UTA schema
+version, the accession, the region and the alignment method.
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import copy
+
+from edu.ohsu.compbio.txeff.util.tfx_cache import TfxCache
+
+class UtaCache(object):
+    '''
+    Wraps an hgvs UTA data provider (hdp) and serves ``get_tx_for_region`` and ``get_tx_info`` from the cache.
+    The database is only queried when the cache doesn't have the answer.
+    '''
+    def __init__(self, hdp, filename: str = None, max_size: int = 100000, benchmarking = None):
+        '''
+        hdp is the UTA data provider returned by hgvs.dataproviders.uta.connect(). filename is an optional SQLite file
+        that allows cached values to be reused in later runs.
+        '''
+        self._hdp = hdp
+        self.version = hdp.data_version()
+        self._tx_for_region_cache = TfxCache('hdp.get_tx_for_region', self.version, filename, max_size, benchmarking=benchmarking)
+        self._tx_info_cache = TfxCache('hdp.get_tx_info', self.version, filename, max_size, benchmarking=benchmarking)
+
+    def get_tx_for_region(self, alt_ac: str, alt_aln_method: str, start_i: int, end_i: int):
+        '''
+        Return the transcripts that contain a region. Each row is a list of the columns returned by hdp.get_tx_for_region.
+        '''
+        key = [alt_ac, alt_aln_method, start_i, end_i]
+        rows = self._tx_for_region_cache.get(key)
+
+        if rows is None:
+            rows = [list(row) for row in self._hdp.get_tx_for_region(alt_ac, alt_aln_method, start_i, end_i)]
+            self._tx_for_region_cache.put(key, rows)
+
+        return rows
+
+    def get_tx_info(self, tx_ac: str, alt_ac: str, alt_aln_method: str):
+        '''
+        Return a dictionary with the transcript details returned by hdp.get_tx_info (eg 'hgnc', 'cds_start_i').
+        '''
+        key = [tx_ac, alt_ac, alt_aln_method]
+        tx_info = self._tx_info_cache.get(key)
+
+        if tx_info is None:
+            tx_info = dict(self._hdp.get_tx_info(tx_ac, alt_ac, alt_aln_method).items())
+            self._tx_info_cache.put(key, tx_info)
+
+        return tx_info
+
+    def with_hdp(self, hdp):
+        '''
+        Return a UtaCache that shares this cache but queries UTA using a different connection. Each worker thread has its own connection.
+        '''
+        uta_cache = copy.copy(self)
+        uta_cache._hdp = hdp
+        return uta_cache
+
+    def get_caches(self):
+        '''
+        Return the caches so that their hit rates can be reported
+        '''
+        return [self._tx_for_region_cache, self._tx_info_cache]
+
+    def close(self):
+        '''
+        Close the cache files. The UTA connection is not closed.
+        '''
+        for cache in self.get_caches():
+            cache.close()
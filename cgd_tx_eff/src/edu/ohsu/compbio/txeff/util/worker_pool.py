@@ -0,0 +1,140 @@
+'''
+Run a function over a stream of items using a fixed number of worker threads. Unlike multiprocessing's ThreadPool,
+each worker is created once with its own resources (eg a UTA connection and an AssemblyMapper) so that workers
+don't serialize on a shared connection. Items are fed to the workers through a bounded queue and results are
+returned as soon as they are ready.
+
+See test_worker_pool.py for example usage.
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import logging
+import queue
+import threading
+
+# Marks the end of the input queue, and a worker that has finished, on the output queue
+_DONE = object()
+
+class WorkerPool(object):
+    '''
+    ``create_worker`` is called once in each thread and its return value is passed to every call of the function
+    run by that thread. ``close_worker`` is called with the same value when the thread finishes.
+    '''
+    def __init__(self, worker_count: int, create_worker = None, close_worker = None, queue_size: int = None):
+        '''
+        Constructor
+        '''
+        assert worker_count > 0, "worker_count must be greater than zero"
+
+        self.logger = logging.getLogger(__name__)
+        self.worker_count = worker_count
+        self._create_worker = create_worker
+        self._close_worker = close_worker
+
+        # Bound the number of items waiting to be processed so the input doesn't have to be held in memory
+        self._queue_size = queue_size if queue_size else worker_count * 4
+
+    def imap_unordered(self, function, items):
+        '''
+        Call ``function(worker, item)`` for every item and yield the results in the order they are completed. If the
+        function raises an exception then the remaining items are abandoned and the exception is raised to the caller.
+        '''
+        in_queue = queue.Queue(self._queue_size)
+        out_queue = queue.Queue()
+        stop = threading.Event()
+
+        feeder = threading.Thread(target=self._feed, args=(items, in_queue, out_queue, stop), daemon=True)
+        threads = [threading.Thread(target=self._work, args=(function, in_queue, out_queue, stop), daemon=True) for _ in range(self.worker_count)]
+
+        feeder.start()
+        for thread in threads:
+            thread.start()
+
+        running = self.worker_count
+        try:
+            while running:
+                result = out_queue.get()
+                if result is _DONE:
+                    running -= 1
+                elif isinstance(result, _Failure):
+                    raise result.exception
+                else:
+                    yield result
+        finally:
+            # Release the feeder and workers if the caller stopped early or a worker failed
+            stop.set()
+            self._drain(in_queue)
+            for thread in threads:
+                thread.join()
+            feeder.join()
+
+    def _feed(self, items, in_queue: queue.Queue, out_queue: queue.Queue, stop: threading.Event):
+        '''
+        Put each item on the input queue, followed by one end marker for each worker
+        '''
+        try:
+            for item in items:
+                if not self._put(in_queue, item, stop):
+                    return
+        except Exception as e:
+            # The input could not be read. Make sure the caller hears about it.
+            out_queue.put(_Failure(e))
+            stop.set()
+        finally:
+            for _ in range(self.worker_count):
+                self._put(in_queue, _DONE, stop)
+
+    def _put(self, in_queue: queue.Queue, item, stop: threading.Event):
+        '''
+        Put an item on the bounded queue, giving up if the pool is stopped. Returns False if the item was not queued.
+        '''
+        while not stop.is_set():
+            try:
+                in_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _work(self, function, in_queue: queue.Queue, out_queue: queue.Queue, stop: threading.Event):
+        '''
+        Create the worker resources and process items until the end marker is found
+        '''
+        worker = None
+        try:
+            worker = self._create_worker() if self._create_worker else None
+            while not stop.is_set():
+                try:
+                    item = in_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                if item is _DONE:
+                    break
+                out_queue.put(function(worker, item))
+        except Exception as e:
+            self.logger.debug(f"Worker failed: {str(e)}")
+            out_queue.put(_Failure(e))
+            stop.set()
+        finally:
+            if worker is not None and self._close_worker:
+                self._close_worker(worker)
+            out_queue.put(_DONE)
+
+    def _drain(self, in_queue: queue.Queue):
+        '''
+        Discard any items that were never processed
+        '''
+        while True:
+            try:
+                in_queue.get_nowait()
+            except queue.Empty:
+                return
+
+class _Failure(object):
+    '''
+    Carries an exception from a worker thread back to the caller
+    '''
+    def __init__(self, exception: Exception):
+        self.exception = exception
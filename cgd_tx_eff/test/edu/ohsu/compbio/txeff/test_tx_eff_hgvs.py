@@ -1,7 +1,12 @@
 import os
+import sqlite3
 import unittest
 
-from edu.ohsu.compbio.txeff.tx_eff_hgvs import TxEffHgvs
+import hgvs.dataproviders.uta
+import hgvs.parser
+
+from edu.ohsu.compbio.txeff.tx_eff_hgvs import TxEffHgvs, BULK_QUERY_MAX_GAP
+from edu.ohsu.compbio.txeff.variant import Variant
 from edu.ohsu.compbio.txeff.util.tx_eff_pysam import PysamTxEff
 from edu.ohsu.compbio.txeff.variant_transcript import VariantTranscript
 
@@ -230,3 +235,61 @@ class TxEffHgvsTest(unittest.TestCase):
         self.assertEqual(tx_eff_hgvs._configure_sequence_source(), 5, "Return value should indicate file repository will be used")
         self.assertEqual(os.environ.get('HGVS_SEQREPO_DIR'), path, "HGVS_SEQREPO_DIR should be set to the argument path")
         self.assertIsNone(os.environ.get('HGVS_SEQREPO_URL'), "HGVS_SEQREPO_URL should be unset")
+
+
+class SqliteAlignments(object):
+    '''
+    Stands in for the UTA data provider. Runs the same alignments_for_region query as hgvs against an in-memory 
+    database of exons, where each alignment is (tx_ac, alt_ac, alt_strand, alt_aln_method, [(start_i, end_i), ...]).
+    '''
+    def __init__(self, alignments):
+        self._db = sqlite3.connect(':memory:')
+        self._db.execute('create table exon_set (exon_set_id integer, tx_ac text, alt_ac text, alt_strand integer, alt_aln_method text)')
+        self._db.execute('create table exon (exon_set_id integer, start_i integer, end_i integer)')
+        for exon_set_id, (tx_ac, alt_ac, alt_strand, alt_aln_method, exons) in enumerate(alignments):
+            self._db.execute('insert into exon_set values (?, ?, ?, ?, ?)', (exon_set_id, tx_ac, alt_ac, alt_strand, alt_aln_method))
+            self._db.executemany('insert into exon values (?, ?, ?)', [(exon_set_id, start_i, end_i) for start_i, end_i in exons])
+        self.query_count = 0
+
+    def get_tx_for_region(self, alt_ac, alt_aln_method, start_i, end_i):
+        self.query_count += 1
+        rows = self._db.execute(hgvs.dataproviders.uta.UTABase._queries['alignments_for_region'], [alt_ac, start_i, end_i]).fetchall()
+        return [row for row in rows if row[3] == alt_aln_method]
+
+
+class TxEffHgvsBulkTest(unittest.TestCase):
+    '''
+    Test the bulk UTA range query, which doesn't need the reference FASTA or a UTA connection
+    '''
+    def _get_tx_eff_hgvs(self, hdp):
+        tx_eff_hgvs = TxEffHgvs(None, bulk = True)
+        tx_eff_hgvs.hdp = hdp
+        tx_eff_hgvs.hgvs_parser = hgvs.parser.Parser()
+        return tx_eff_hgvs
+
+    def test__get_bulk_tx_for_region_matches_per_variant(self):
+        hdp = SqliteAlignments([('NM_000001.1', 'NC_000001.10', 1, 'splign', [(1000, 1200), (1500, 2000)]),
+                                ('NM_000002.1', 'NC_000001.10', -1, 'splign', [(1100, 1300)]),
+                                ('NM_000003.1', 'NC_000001.10', 1, 'splign', [(1001000, 1002000)]),
+                                ('NM_000004.1', 'NC_000001.10', 1, 'splign', [(1800, 1001500)]),
+                                ('NM_000005.1', 'NC_000001.10', 1, 'genebuild', [(1000, 2000)]),
+                                ('NM_000006.1', 'NC_000002.11', 1, 'splign', [(1000, 2000)])])
+        tx_eff_hgvs = self._get_tx_eff_hgvs(hdp)
+
+        # Variants a megabase apart are in one group, and a variant that is further away than BULK_QUERY_MAX_GAP is in its own 
+        variants = [Variant('1', 1150, 'A', 'G'), Variant('1', 1001, 'A', 'G'), Variant('1', 2000, 'A', 'G'), Variant('1', 1000, 'A', 'G'),
+                    Variant('1', 1001500, 'A', 'G'), Variant('1', 1002001, 'A', 'G'), Variant('1', 1002001 + BULK_QUERY_MAX_GAP + 1, 'A', 'G'),
+                    Variant('2', 1500, 'A', 'G')]
+        items = tx_eff_hgvs._get_bulk_tx_for_region(variants)
+        self.assertEqual(hdp.query_count, 3, 'One query per group of nearby variants')
+        self.assertEqual(len(items), len(variants))
+
+        for variant, var_g, tx_list in items:
+            expected = hdp.get_tx_for_region(str(var_g.ac), 'splign', var_g.posedit.pos.start.base, var_g.posedit.pos.end.base)
+            self.assertEqual(sorted(tuple(row) for row in tx_list), sorted(tuple(row) for row in expected), f'Transcripts for {variant}')
+
+        tx_by_position = {var_g.posedit.pos.start.base: sorted(row[0] for row in tx_list) for _, var_g, tx_list in items if str(var_g.ac) == 'NC_000001.10'}
+        self.assertEqual(tx_by_position[1150], ['NM_000001.1', 'NM_000002.1'])
+        self.assertEqual(tx_by_position[1001500], ['NM_000003.1', 'NM_000004.1'])
+        self.assertEqual(tx_by_position[1000], [], 'The start is exclusive')
+        self.assertEqual(tx_by_position[2000], ['NM_000001.1', 'NM_000004.1'], 'The end is inclusive')
@@ -0,0 +1,211 @@
+'''
+Test the TxEffVcf class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import os
+import tempfile
+import types
+import unittest
+
+from edu.ohsu.compbio.annovar.annovar_parser import AnnovarVariantFunction
+from edu.ohsu.compbio.txeff.tx_eff_vcf import TxEffVcf, TranscriptEffect, get_annovar_checksums
+from edu.ohsu.compbio.txeff.variant import Variant
+from edu.ohsu.compbio.txeff.variant_transcript import VariantTranscript
+
+VCF_HEADER = '##fileformat=VCFv4.2\n##contig=<ID=1>\n##contig=<ID=2>\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tabcd-123\n'
+
+class TxEffVcfTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tx_eff_vcf = TxEffVcf('1.0', None, None, 'data-version')
+
+    def _get_transcript(self, refseq_transcript, protein_transcript, c_dot, exon):
+        transcript = VariantTranscript('1', 123, 'C', 'G')
+        transcript.refseq_transcript = refseq_transcript
+        transcript.protein_transcript = protein_transcript
+        transcript.hgvs_c_dot = c_dot
+        transcript.hgvs_p_dot_one = 'p.R10G' if protein_transcript else None
+        transcript.hgvs_p_dot_three = 'p.Arg10Gly' if protein_transcript else None
+        transcript.hgvs_amino_acid_position = '10' if protein_transcript else None
+        transcript.hgvs_base_position = '28'
+        transcript.exon = exon
+        transcript.hgnc_gene = 'ABC'
+        transcript.sequence_variant = 'g.123C>G'
+        transcript.variant_effect = 'nonsynonymous SNV'
+        transcript.variant_type = 'exonic'
+        transcript.reference_context = 'ACCTTCGCCCCGCTGCCGCCT'
+        return transcript
+
+    def test__get_transcripts_from_info(self):
+        '''
+        Transcripts written to the INFO fields are read back the same 
+        '''
+        variant = Variant('1', 123, 'C', 'G')
+        transcripts = [self._get_transcript('NM_000001.1', 'NP_000001.1', 'c.28C>G', '2'),
+                       self._get_transcript('NM_000002.3', None, None, None)]
+        vcf_record = types.SimpleNamespace(INFO=dict())
+
+        self.tx_eff_vcf._add_transcripts_to_record(variant, vcf_record, transcripts)
+        previous_transcripts = self.tx_eff_vcf._get_transcripts_from_info(variant, vcf_record.INFO)
+
+        self.assertEqual(len(previous_transcripts), 2)
+        for transcript, previous_transcript in zip(sorted(transcripts), sorted(previous_transcripts)):
+            self.assertEqual(previous_transcript.refseq_transcript, transcript.refseq_transcript)
+            self.assertEqual(previous_transcript.protein_transcript, transcript.protein_transcript)
+            self.assertEqual(previous_transcript.hgvs_c_dot, transcript.hgvs_c_dot)
+            self.assertEqual(previous_transcript.hgvs_p_dot_three, transcript.hgvs_p_dot_three)
+            self.assertEqual(previous_transcript.exon, transcript.exon)
+            self.assertEqual(previous_transcript.reference_context, transcript.reference_context)
+            self.assertEqual(previous_transcript.variant_effect, 'nonsynonymous_SNV')
+
+        # Writing the transcripts that were read gives the same INFO fields 
+        reused_record = types.SimpleNamespace(INFO=dict())
+        self.tx_eff_vcf._add_transcripts_to_record(variant, reused_record, previous_transcripts)
+        self.assertEqual(reused_record.INFO, vcf_record.INFO)
+
+    def test__get_transcripts_from_info_without_effects(self):
+        self.assertEqual(self.tx_eff_vcf._get_transcripts_from_info(Variant('1', 123, 'C', 'G'), dict()), [])
+
+    def test__get_transcripts_from_info_bad_array(self):
+        info = {TranscriptEffect.TFX_TRANSCRIPT.value: ['NM_000001.1:NM_000002.3'],
+                TranscriptEffect.TFX_GENE.value: ['ABC']}
+
+        with self.assertRaises(ValueError):
+            self.tx_eff_vcf._get_transcripts_from_info(Variant('1', 123, 'C', 'G'), info)
+
+    def _write_vcf(self, directory, variants):
+        '''
+        Write a VCF with one row for each (chromosome, position, ref, alt) and return its name
+        '''
+        vcf_filename = os.path.join(directory, 'in.vcf')
+        with open(vcf_filename, 'w') as vcf_file:
+            vcf_file.write(VCF_HEADER)
+            for chromosome, position, ref, alt in variants:
+                vcf_file.write(f'{chromosome}\t{position}\t.\t{ref}\t{alt}\t1.0\tPASS\tx=y\tGT\t0/1\n')
+        return vcf_filename
+
+    def _get_variant_transcript(self, chromosome, position, ref, alt, refseq_transcript):
+        transcript = self._get_transcript(refseq_transcript, None, None, '1')
+        transcript.chromosome = chromosome
+        transcript.position = position
+        transcript.reference = ref
+        transcript.alt = alt
+        return transcript
+
+    def _create_vcf(self, in_vcf, transcripts, streaming):
+        '''
+        Run create_vcf and return the lines of the output VCF
+        '''
+        out_vcf = in_vcf + ('.streamed.vcf' if streaming else '.vcf')
+        TxEffVcf('1.0', in_vcf, out_vcf, 'data-version').create_vcf(transcripts, streaming=streaming)
+        with open(out_vcf) as vcf_file:
+            return vcf_file.readlines()
+
+    def test__create_vcf_streaming_matches(self):
+        '''
+        Streaming gives the same VCF as reading the whole VCF first  
+        '''
+        variants = [('1', 100, 'C', 'G'), ('1', 100, 'C', 'T'), ('1', 250, 'A', 'AT'), ('1', 900, 'G', 'A'), ('2', 50, 'T', 'C')]
+        transcripts = [self._get_variant_transcript('1', 100, 'C', 'T', 'NM_000002.1'),
+                       self._get_variant_transcript('2', 50, 'T', 'C', 'NM_000005.1'),
+                       self._get_variant_transcript('1', 100, 'C', 'G', 'NM_000001.1'),
+                       self._get_variant_transcript('1', 250, 'A', 'AT', 'NM_000003.1'),
+                       self._get_variant_transcript('1', 250, 'A', 'AT', 'NM_000004.2'),
+                       self._get_variant_transcript('1', 500, 'C', 'G', 'NM_000006.1')]
+
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = self._write_vcf(directory, variants)
+            streamed = self._create_vcf(in_vcf, transcripts, True)
+            self.assertEqual(streamed, self._create_vcf(in_vcf, transcripts, False))
+
+        records = [line for line in streamed if not line.startswith('#')]
+        self.assertEqual(len(records), len(variants))
+        self.assertIn('TFX_TRANSCRIPT=NM_000003.1:NM_000004.2', records[2])
+        self.assertNotIn('TFX_TRANSCRIPT', records[3])
+
+    def test__create_vcf_streaming_test_vcf(self):
+        '''
+        Streaming the test VCF gives the same VCF as reading it first
+        '''
+        transcripts = [self._get_variant_transcript('1', 980556, 'C', 'G', 'NM_000001.1')]
+
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = os.path.join(directory, 'test_in.vcf')
+            with open('test-data/test_in.vcf') as test_vcf, open(in_vcf, 'w') as vcf_file:
+                vcf_file.write(test_vcf.read())
+            self.assertEqual(self._create_vcf(in_vcf, transcripts, True), self._create_vcf(in_vcf, transcripts, False))
+
+    def test__create_vcf_streaming_unsorted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = self._write_vcf(directory, [('1', 250, 'A', 'AT'), ('1', 100, 'C', 'G')])
+            with self.assertRaises(ValueError):
+                self._create_vcf(in_vcf, [], True)
+
+    def test__create_vcf_streaming_duplicate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = self._write_vcf(directory, [('1', 100, 'C', 'G'), ('1', 100, 'C', 'T'), ('1', 100, 'C', 'G')])
+            with self.assertRaisesRegex(Exception, 'Duplicate variant'):
+                self._create_vcf(in_vcf, [], True)
+
+    def test__create_vcf_streaming_other_chromosome(self):
+        '''
+        Transcripts on a chromosome that isn't in the VCF are skipped
+        '''
+        transcripts = [self._get_variant_transcript('2', 100, 'C', 'G', 'NM_000001.1'),
+                       self._get_variant_transcript('1', 100, 'C', 'G', 'NM_000002.1')]
+
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = self._write_vcf(directory, [('1', 100, 'C', 'G'), ('1', 200, 'C', 'G')])
+            records = [line for line in self._create_vcf(in_vcf, transcripts, True) if not line.startswith('#')]
+
+        self.assertEqual(len(records), 2)
+        self.assertIn('TFX_TRANSCRIPT=NM_000002.1', records[0])
+        self.assertNotIn('NM_000001.1', ''.join(records))
+
+    def _get_annovar_record(self, chromosome, position, ref, alt, variant_effect):
+        annovar_record = AnnovarVariantFunction(chromosome, position, ref, alt)
+        annovar_record.refseq_transcript = 'NM_000001.1'
+        annovar_record.variant_effect = variant_effect
+        return annovar_record
+
+    def test__get_annovar_checksums(self):
+        first = self._get_annovar_record('1', 100, 'C', 'G', 'nonsynonymous SNV')
+        second = self._get_annovar_record('1', 100, 'C', 'G', 'synonymous SNV')
+        other = self._get_annovar_record('1', 200, 'C', 'G', 'synonymous SNV')
+
+        checksums = get_annovar_checksums([first, second, other])
+        self.assertEqual(len(checksums), 2)
+
+        # The order of a variant's records doesn't matter, but their values do
+        self.assertEqual(get_annovar_checksums([second, first])[Variant('1', 100, 'C', 'G')], checksums[Variant('1', 100, 'C', 'G')])
+        self.assertNotEqual(get_annovar_checksums([first])[Variant('1', 100, 'C', 'G')], checksums[Variant('1', 100, 'C', 'G')])
+
+    def test__get_previous_transcripts_annovar_checksum(self):
+        '''
+        Transcripts are only reused for variants whose annovar records are the same as in the previous run
+        '''
+        variants = [('1', 100, 'C', 'G'), ('1', 250, 'A', 'AT')]
+        transcripts = [self._get_variant_transcript('1', 100, 'C', 'G', 'NM_000001.1'),
+                       self._get_variant_transcript('1', 250, 'A', 'AT', 'NM_000003.1')]
+        annovar_records = [self._get_annovar_record('1', 100, 'C', 'G', 'nonsynonymous SNV'),
+                           self._get_annovar_record('1', 250, 'A', 'AT', 'frameshift insertion')]
+        changed_records = [annovar_records[0], self._get_annovar_record('1', 250, 'A', 'AT', 'nonframeshift insertion')]
+
+        with tempfile.TemporaryDirectory() as directory:
+            in_vcf = self._write_vcf(directory, variants)
+            previous_vcf = os.path.join(directory, 'previous.vcf')
+            TxEffVcf('1.0', in_vcf, previous_vcf, 'data-version', get_annovar_checksums(annovar_records)).create_vcf(transcripts)
+
+            same = TxEffVcf('1.0', in_vcf, None, 'data-version', get_annovar_checksums(annovar_records)).get_previous_transcripts(previous_vcf)
+            changed = TxEffVcf('1.0', in_vcf, None, 'data-version', get_annovar_checksums(changed_records)).get_previous_transcripts(previous_vcf)
+            missing = TxEffVcf('1.0', in_vcf, None, 'data-version').get_previous_transcripts(previous_vcf)
+
+        self.assertEqual(set(same), {Variant(*variant) for variant in variants})
+        self.assertEqual(set(changed), {Variant('1', 100, 'C', 'G')})
+        self.assertEqual(missing, dict())
+
+if __name__ == "__main__":
+    unittest.main()
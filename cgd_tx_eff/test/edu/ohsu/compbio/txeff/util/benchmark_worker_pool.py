@@ -0,0 +1,49 @@
+'''
+Measure how WorkerPool throughput scales with the number of workers when each lookup waits on a simulated UTA round
+trip. Throughput should scale roughly linearly because each worker has its own connection. This depends on wall clock
+time, so it is a benchmark rather than a unit test and isn't run by run_tests.sh.
+
+Usage: PYTHONPATH=src python test/edu/ohsu/compbio/txeff/util/benchmark_worker_pool.py [--variants 48] [--round_trip 0.02]
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import argparse
+import time
+
+from edu.ohsu.compbio.txeff.util.benchmarking import Benchmarking
+from edu.ohsu.compbio.txeff.util.worker_pool import WorkerPool
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description='Measure WorkerPool throughput with a simulated UTA round trip')
+    parser.add_argument('--variants', type=int, default=48, help='Number of variants to look up')
+    parser.add_argument('--round_trip', type=float, default=1/50, help='Seconds that each lookup waits')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8], help='Worker counts to compare')
+    return parser.parse_args()
+
+def main():
+    args = _parse_args()
+    benchmarking = Benchmarking()
+
+    def lookup(worker, variant):
+        time.sleep(args.round_trip)
+        return [variant]
+
+    # Speedup is relative to looking up every variant one after another with no overhead
+    serial_time = args.variants * args.round_trip * 1000.0
+    print('workers\ttotal_ms\tvariants_per_second\tspeedup')
+    for worker_count in args.workers:
+        pool = WorkerPool(worker_count, object)
+        name = f'{worker_count} workers'
+        benchmarking.start(name)
+        results = list(pool.imap_unordered(lookup, range(args.variants)))
+        benchmarking.stop(name)
+        assert len(results) == args.variants
+
+        total_time = benchmarking.get_time_total(name)
+        print(f'{worker_count}\t{total_time:.1f}\t{args.variants / total_time * 1000.0:.1f}\t{serial_time / total_time:.2f}')
+
+if __name__ == '__main__':
+    main()
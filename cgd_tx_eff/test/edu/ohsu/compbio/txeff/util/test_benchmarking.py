@@ -54,4 +54,18 @@ class TestBenchmarking(unittest.TestCase):
         b_actual_average = benchmarking.get_time_average('B')
 
         self.assertTrue(math.isclose(b_expected_total, b_actual_total, abs_tol=1e+2), f'Total times are not close: {b_expected_total} and {b_actual_total}')        
-        self.assertTrue(math.isclose(b_expected_average, b_actual_average, abs_tol=1e+1), f'Total times are not close: {b_expected_average} and {b_actual_average}')
\ No newline at end of file
+        self.assertTrue(math.isclose(b_expected_average, b_actual_average, abs_tol=1e+1), f'Total times are not close: {b_expected_average} and {b_actual_average}')
+
+    def test__counters(self):
+        benchmarking = Benchmarking()
+        benchmarking.increment('hits')
+        benchmarking.increment('hits', 2)
+        benchmarking.increment('misses')
+
+        # Clearing the timers doesn't clear the counters
+        benchmarking.clear()
+
+        self.assertEqual(benchmarking.get_count('hits'), 3)
+        self.assertEqual(benchmarking.get_count('misses'), 1)
+        self.assertEqual(benchmarking.get_count('unknown'), 0)
+        self.assertEqual(set(benchmarking.get_counter_names()), {'hits', 'misses'})
@@ -0,0 +1,46 @@
+'''
+Test the IntervalIndex class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import random
+import unittest
+
+from edu.ohsu.compbio.txeff.util.interval_index import IntervalIndex
+
+
+class TestIntervalIndex(unittest.TestCase):
+    '''
+    Test the IntervalIndex class
+    '''
+    def test__containing(self):
+        index = IntervalIndex([(100, 200, 'a'), (150, 160, 'b'), (300, 5000, 'c'), (1000, 1100, 'd')])
+
+        self.assertEqual(len(index), 4)
+        self.assertEqual(sorted(index.containing(155, 155)), ['a', 'b'])
+        self.assertEqual(index.containing(100, 100), [], 'Start is exclusive')
+        self.assertEqual(index.containing(101, 200), ['a'], 'End is inclusive')
+        self.assertEqual(index.containing(199, 201), [], 'An interval that only partly overlaps the region is not returned')
+        self.assertEqual(index.containing(150, 250), [])
+        self.assertEqual(sorted(index.containing(1050, 1051)), ['c', 'd'], 'A long interval that starts far upstream is found')
+        self.assertEqual(index.containing(6000, 7000), [])
+
+    def test__empty(self):
+        self.assertEqual(IntervalIndex([]).containing(1, 2), [])
+
+    def test__containing_matches_linear_scan(self):
+        # Compare with the condition UTA uses in get_tx_for_region: min(start_i) < start and end <= max(end_i)
+        rng = random.Random(7)
+        intervals = []
+        for i in range(500):
+            start = rng.randint(0, 100000)
+            intervals.append((start, start + rng.randint(1, 20000), i))
+        index = IntervalIndex(intervals)
+
+        for _ in range(500):
+            start = rng.randint(0, 120000)
+            end = start + rng.randint(0, 50)
+            expected = sorted(value for interval_start, interval_end, value in intervals if interval_start < start and end <= interval_end)
+            self.assertEqual(sorted(index.containing(start, end)), expected)
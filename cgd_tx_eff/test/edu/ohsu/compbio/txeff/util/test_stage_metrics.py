@@ -0,0 +1,70 @@
+'''
+Test the StageMetrics class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from edu.ohsu.compbio.txeff.util.stage_metrics import StageMetrics
+
+
+class TestStageMetrics(unittest.TestCase):
+    '''
+    Test the StageMetrics class
+    '''
+    def test__stage(self):
+        metrics = StageMetrics()
+
+        with metrics.stage('first', 100):
+            time.sleep(0.05)
+
+        with metrics.stage('second') as stage:
+            stage.records = 10
+
+        stages = metrics.get_stages()
+        self.assertEqual([stage.name for stage in stages], ['first', 'second'])
+        self.assertGreaterEqual(stages[0].wall_seconds, 0.05)
+        self.assertGreater(stages[0].peak_rss_mb, 0)
+        self.assertEqual(stages[1].records, 10, 'The record count can be set inside the stage')
+
+        first = stages[0].to_dict()
+        self.assertAlmostEqual(first['records_per_second'], 100 / stages[0].wall_seconds)
+
+    def test__stage_with_exception(self):
+        metrics = StageMetrics()
+
+        with self.assertRaises(ValueError):
+            with metrics.stage('failed'):
+                raise ValueError('Failed stage')
+
+        self.assertEqual(len(metrics.get_stages()), 1, 'A stage that fails is still recorded')
+
+    def test__write(self):
+        metrics = StageMetrics()
+        metrics.add_info('version', '1.2.3')
+        metrics.add_cache('hdp.get_tx_info', 3, 1)
+        metrics.add_cache('unused', 0, 0)
+        with metrics.stage('first', 5):
+            pass
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'metrics.json')
+            metrics.write(filename)
+            with open(filename) as json_file:
+                report = json.load(json_file)
+
+        self.assertEqual(report['info'], {'version': '1.2.3'})
+        self.assertEqual(report['stages'][0]['name'], 'first')
+        self.assertEqual(report['stages'][0]['records'], 5)
+        self.assertEqual(report['caches'][0], {'name': 'hdp.get_tx_info', 'hits': 3, 'misses': 1, 'hit_rate': 0.75})
+        self.assertIsNone(report['caches'][1]['hit_rate'])
+        self.assertIn('peak_rss_mb', report)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+'''
+Test the TfxCache class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import os
+import tempfile
+import unittest
+
+from edu.ohsu.compbio.txeff.util.benchmarking import Benchmarking
+from edu.ohsu.compbio.txeff.util.tfx_cache import TfxCache
+
+
+class TestTfxCache(unittest.TestCase):
+    '''
+    Test the TfxCache class
+    '''
+    def setUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self._filename = os.path.join(self._directory.name, 'cache.sqlite')
+
+    def tearDown(self):
+        self._directory.cleanup()
+
+    def test__get_put(self):
+        cache = TfxCache('a', 'v1')
+        self.assertIsNone(cache.get(['x', 1]), 'Empty cache')
+
+        cache.put(['x', 1], [['NM_1.1', 'NC_1']])
+        self.assertEqual(cache.get(['x', 1]), [['NM_1.1', 'NC_1']])
+        self.assertEqual(cache.hits, 1)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(cache.get_hit_rate(), 0.5)
+
+    def test__memory_eviction(self):
+        cache = TfxCache('a', 'v1', max_size=2)
+        cache.put('x', 1)
+        cache.put('y', 2)
+
+        # Reading x makes y the least recently used entry
+        cache.get('x')
+        cache.put('z', 3)
+
+        self.assertEqual(cache.get('x'), 1)
+        self.assertIsNone(cache.get('y'), 'y should have been evicted')
+        self.assertEqual(cache.get('z'), 3)
+        self.assertEqual(cache.evictions, 1)
+
+    def test__persistent(self):
+        cache = TfxCache('a', 'v1', self._filename)
+        cache.put('x', {'hgnc': 'BRAF'})
+        cache.close()
+
+        cache = TfxCache('a', 'v1', self._filename)
+        self.assertEqual(cache.get('x'), {'hgnc': 'BRAF'}, 'Value should be read from file')
+        cache.close()
+
+        # Different versions and namespaces don't share values
+        cache = TfxCache('a', 'v2', self._filename)
+        self.assertIsNone(cache.get('x'))
+        cache.close()
+
+        cache = TfxCache('b', 'v1', self._filename)
+        self.assertIsNone(cache.get('x'))
+        cache.close()
+
+    def test__disk_eviction(self):
+        cache = TfxCache('a', 'v1', self._filename, max_disk_size=2)
+        cache.put('x', 1)
+        cache.put('y', 2)
+        cache.put('z', 3)
+        cache.close()
+
+        cache = TfxCache('a', 'v1', self._filename)
+        self.assertIsNone(cache.get('x'), 'Oldest entry should have been evicted')
+        self.assertEqual(cache.get('y'), 2)
+        self.assertEqual(cache.get('z'), 3)
+        cache.close()
+
+    def test__benchmarking_counters(self):
+        benchmarking = Benchmarking()
+        cache = TfxCache('a', 'v1', benchmarking=benchmarking)
+        cache.get('x')
+        cache.put('x', 1)
+        cache.get('x')
+        cache.get('x')
+
+        self.assertEqual(benchmarking.get_count('a (cache hit)'), 2)
+        self.assertEqual(benchmarking.get_count('a (cache miss)'), 1)
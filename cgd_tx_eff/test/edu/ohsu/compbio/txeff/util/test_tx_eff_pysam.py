@@ -0,0 +1,50 @@
+'''
+Test the reference block cache in PysamTxEff
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import unittest
+
+from edu.ohsu.compbio.txeff.util.tx_eff_pysam import PysamTxEff, ReferenceBlockCache
+
+
+FILE_TEST_REFERENCE_FASTA = 'test-data/test_chr1.fa'
+TEST_CHROMOSOME = '1:1-1000000'
+
+class TestPysamTxEff(unittest.TestCase):
+    '''
+    Test the reference block cache in PysamTxEff
+    '''
+    def test__faidx_query_cached_matches_uncached(self):
+        cached = PysamTxEff(FILE_TEST_REFERENCE_FASTA)
+        uncached = PysamTxEff(FILE_TEST_REFERENCE_FASTA, cache_bytes=0)
+
+        # Include positions near both ends of the reference
+        for pos in [1, 1500, 2001, 65536, 65537, 500000, 998500, 1000000]:
+            self.assertEqual(cached.faidx_query(TEST_CHROMOSOME, pos), uncached.faidx_query(TEST_CHROMOSOME, pos), f'Sequence differs at {pos}')
+
+        cached.close()
+        uncached.close()
+
+    def test__neighbouring_queries_hit_cache(self):
+        pysam_file = PysamTxEff(FILE_TEST_REFERENCE_FASTA)
+
+        for pos in range(100000, 101000, 10):
+            pysam_file.faidx_query(TEST_CHROMOSOME, pos)
+
+        self.assertEqual(pysam_file.block_cache.misses, 1, 'All windows fall in one block')
+        self.assertEqual(pysam_file.block_cache.hits, 99)
+        self.assertEqual(pysam_file.block_cache.get_hit_rate(), 0.99)
+        pysam_file.close()
+
+    def test__memory_cap(self):
+        pysam_file = PysamTxEff(FILE_TEST_REFERENCE_FASTA, cache_bytes=0)
+        block_cache = ReferenceBlockCache(pysam_file.my_fasta, block_size=1000, max_bytes=3000)
+
+        for start in range(0, 100000, 1000):
+            self.assertEqual(block_cache.fetch(TEST_CHROMOSOME, start, start + 1500), pysam_file.my_fasta.fetch(TEST_CHROMOSOME, start, start + 1500))
+            self.assertTrue(block_cache._bytes <= 3000, 'Cache must not exceed its memory cap')
+
+        pysam_file.close()
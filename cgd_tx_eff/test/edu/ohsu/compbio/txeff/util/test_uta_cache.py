@@ -0,0 +1,66 @@
+'''
+Test the UtaCache class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+import os
+import tempfile
+import unittest
+
+from edu.ohsu.compbio.txeff.util.uta_cache import UtaCache
+
+
+class MockHdp(object):
+    '''
+    Stand-in for the UTA data provider that counts how many times it is queried 
+    '''
+    def __init__(self):
+        self.queries = 0
+
+    def data_version(self):
+        return 'uta_20210129'
+
+    def get_tx_for_region(self, alt_ac, alt_aln_method, start_i, end_i):
+        self.queries += 1
+        return [['NM_004333.4', alt_ac, -1, alt_aln_method, start_i - 10, end_i + 10]]
+
+    def get_tx_info(self, tx_ac, alt_ac, alt_aln_method):
+        self.queries += 1
+        return {'hgnc': 'BRAF', 'tx_ac': tx_ac, 'alt_ac': alt_ac, 'alt_aln_method': alt_aln_method}
+
+
+class TestUtaCache(unittest.TestCase):
+    '''
+    Test the UtaCache class
+    '''
+    def test__get_tx_for_region(self):
+        hdp = MockHdp()
+        uta_cache = UtaCache(hdp)
+
+        first = uta_cache.get_tx_for_region('NC_000007.13', 'splign', 140453135, 140453136)
+        second = uta_cache.get_tx_for_region('NC_000007.13', 'splign', 140453135, 140453136)
+
+        self.assertEqual(first, second)
+        self.assertEqual(first[0][0], 'NM_004333.4')
+        self.assertEqual(hdp.queries, 1, 'The second lookup should come from the cache')
+
+        uta_cache.get_tx_for_region('NC_000007.13', 'splign', 140453136, 140453137)
+        self.assertEqual(hdp.queries, 2, 'A different region is a cache miss')
+
+    def test__get_tx_info_persistent(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, 'uta_cache.sqlite')
+
+            hdp = MockHdp()
+            uta_cache = UtaCache(hdp, filename)
+            self.assertEqual(uta_cache.get_tx_info('NM_004333.4', 'NC_000007.13', 'splign')['hgnc'], 'BRAF')
+            uta_cache.close()
+
+            # A new run reads the value from file
+            hdp = MockHdp()
+            uta_cache = UtaCache(hdp, filename)
+            self.assertEqual(uta_cache.get_tx_info('NM_004333.4', 'NC_000007.13', 'splign')['hgnc'], 'BRAF')
+            self.assertEqual(hdp.queries, 0, 'UTA should not be queried')
+            uta_cache.close()
@@ -0,0 +1,92 @@
+'''
+Test the WorkerPool class
+
+Created on Oct. 18, 2026
+
+@author: pleyte
+'''
+from collections import Counter
+import threading
+import unittest
+
+from edu.ohsu.compbio.txeff.util.worker_pool import WorkerPool
+
+
+class Worker(object):
+    '''
+    Stand-in for the per-thread resources (eg a UTA connection) 
+    '''
+    def __init__(self):
+        self.thread = threading.current_thread().name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class TestWorkerPool(unittest.TestCase):
+    '''
+    Test the WorkerPool class
+    '''
+    def test__imap_unordered(self):
+        workers = []
+        lock = threading.Lock()
+
+        def create_worker():
+            worker = Worker()
+            with lock:
+                workers.append(worker)
+            return worker
+
+        pool = WorkerPool(3, create_worker, lambda worker: worker.close())
+        results = list(pool.imap_unordered(lambda worker, x: (worker.thread, x * x), range(100)))
+
+        self.assertEqual(sorted(x for _, x in results), [x * x for x in range(100)], 'Every item is processed once')
+        self.assertEqual(len(workers), 3, 'One worker is created per thread')
+        self.assertTrue(all(worker.closed for worker in workers), 'Every worker is closed')
+
+        # Each result was produced by the worker belonging to the thread that processed it
+        self.assertTrue({thread for thread, _ in results} <= {worker.thread for worker in workers})
+
+    def test__imap_unordered_concurrency(self):
+        # Each call waits at the barrier until every worker has reached it, so the workers must run at the same time and 
+        # each round of the barrier is made up of one item from each worker
+        worker_count = 4
+        rounds = 12
+        barrier = threading.Barrier(worker_count, timeout=10)
+        lock = threading.Lock()
+        active = 0
+        peak = 0
+
+        def lookup(worker, x):
+            nonlocal active, peak
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            barrier.wait()
+            with lock:
+                active -= 1
+            return (worker.thread, x)
+
+        pool = WorkerPool(worker_count, Worker, lambda worker: worker.close())
+        results = list(pool.imap_unordered(lookup, range(worker_count * rounds)))
+
+        self.assertEqual(sorted(x for _, x in results), list(range(worker_count * rounds)), 'Every item is processed once')
+        self.assertEqual(peak, worker_count, 'Every worker runs at the same time')
+        self.assertEqual(sorted(Counter(thread for thread, _ in results).values()), [rounds] * worker_count, 'Each worker processes one item per round')
+
+    def test__imap_unordered_exception(self):
+        def function(worker, x):
+            if x == 13:
+                raise ValueError("Unlucky")
+            return x
+
+        pool = WorkerPool(2, Worker, lambda worker: worker.close())
+        with self.assertRaises(ValueError):
+            list(pool.imap_unordered(function, range(100)))
+
+    def test__imap_unordered_generator(self):
+        # The input is consumed as it is processed, so a generator larger than the queue can be used
+        pool = WorkerPool(2, queue_size=2)
+        results = pool.imap_unordered(lambda worker, x: x, (x for x in range(1000)))
+        self.assertEqual(sum(results), sum(range(1000)))
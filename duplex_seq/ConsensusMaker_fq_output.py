@@ -9,7 +9,7 @@ Based on work by Scott Kennedy
 January 21, 2014
 
 Written for Python 2.7.3
-Required modules: Pysam, Samtools
+Required modules: Pysam, NumPy, Samtools
 
 Inputs: 
     A position-sorted paired-end BAM file containing reads with a duplex tag in the header.  
@@ -107,51 +107,48 @@ Details of different arguments:
 """
 
 import sys
+import numpy as np
 import pysam
 import random
 import string
 from collections import defaultdict
 from argparse import ArgumentParser
 
+nucKeys = 'TCGAN'
+nucCodeTable = np.full(256, 4, dtype=np.uint8) # Anything that isn't T, C, G or A counts as an N
+for nucCode, nuc in enumerate(nucKeys[:4]):
+    nucCodeTable[ord(nuc)] = nucCode
+
 def printRead(readIn):
     sys.stderr.write("%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\t%s\n" % (readIn.qname, readIn.flag, readIn.tid, readIn.pos, readIn.mapq, readIn.cigar, readIn.mrnm, readIn.mpos, readIn.isize, readIn.seq, readIn.qual, readIn.tags))
 
 
 def consensusMaker (groupedReadsList,  cutoff,  readLength) :
-    '''The consensus maker uses a simple "majority rules" algorithm to qmake a consensus at each base position.  If no nucleotide majority reaches above the minimum theshold (--cutoff), the position is considered undefined and an 'N' is placed at that position in the read.'''
-    nucIdentityList=[0, 0, 0, 0, 0, 0] # In the order of T, C, G, A, N, Total
-    nucKeyDict = {0:'T', 1:'C', 2:'G', 3:'A', 4:'N'}
-    consensusRead = ''
-
-    for i in xrange(readLength) : # Count the types of nucleotides at a position in a read. i is the nucleotide index within a read in groupedReadsList
-        for j in xrange(len(groupedReadsList)): # Do this for every read that comprises a SMI group. j is the read index within groupedReadsList
-            try:
-                if groupedReadsList[j][i] == 'T' :
-                    nucIdentityList[0] += 1
-                elif groupedReadsList[j][i] == 'C':
-                    nucIdentityList[1] += 1
-                elif groupedReadsList[j][i] == 'G':
-                    nucIdentityList[2] += 1
-                elif groupedReadsList[j][i] == 'A':
-                    nucIdentityList[3] += 1
-                elif groupedReadsList[j][i] == 'N':
-                    nucIdentityList[4] += 1
-                else:
-                    nucIdentityList[4] += 1
-                nucIdentityList[5] += 1
-            except:
-                break
-        try:
-            for j in [0, 1, 2, 3, 4] :
-                if float(nucIdentityList[j])/float(nucIdentityList[5]) > cutoff :
-                    consensusRead += nucKeyDict[j]
-                    break
-                elif j==4:
-                    consensusRead += 'N'
-        except:
-            consensusRead += 'N'
-        nucIdentityList=[0, 0, 0, 0, 0, 0] # Reset for the next nucleotide position
-    return consensusRead
+    '''The consensus maker uses a simple "majority rules" algorithm to qmake a consensus at each base position.  If no nucleotide majority reaches above the minimum theshold (--cutoff), the position is considered undefined and an 'N' is placed at that position in the read.
+
+    The family is encoded as a reads x readLength matrix of nucleotide codes (T, C, G, A, and N for anything else), and every position is counted and called at once.  A position is counted over the reads up to the first one that is too short to reach it.'''
+    if readLength <= 0:
+        return ''
+    reads = [read or '' for read in groupedReadsList]
+    if not reads:
+        return 'N' * readLength
+
+    padded = ''.join([read[:readLength].ljust(readLength) for read in reads])
+    nucCodes = nucCodeTable[np.frombuffer(padded.encode('ascii'), dtype=np.uint8)].reshape(len(reads), readLength)
+
+    # Reads are counted at a position until one is reached that is too short to cover it
+    reach = np.minimum.accumulate(np.array([len(read) for read in reads]))
+    counted = reach[:, np.newaxis] > np.arange(readLength)
+    nucCodes[~counted] = len(nucKeys)
+
+    nucIdentityCounts = (nucCodes[np.newaxis, :, :] == np.arange(4)[:, np.newaxis, np.newaxis]).sum(axis=1) # In the order of T, C, G, A
+    total = counted.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        called = nucIdentityCounts / total.astype(np.float64) > cutoff # Positions with no reads are nan, and so N
+
+    # The first of T, C, G, A above the cutoff, otherwise N
+    consensusCodes = np.where(called.any(axis=0), called.argmax(axis=0), 4)
+    return ''.join([nucKeys[code] for code in consensusCodes.tolist()])
 
 def tagStats(tagCountsFile):
     familySizeCounts=defaultdict( lambda: 0 )
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+"""
+Consensus Maker benchmark
+Checks that the NumPy consensusMaker in ConsensusMaker_fq_output.py (2.0.1) calls the same consensus as the per-base
+loop it replaced (2.0.0), then times both on synthetic families of varying size.
+
+Written for Python 2.7, like ConsensusMaker_fq_output.py
+Required modules: Pysam, NumPy
+
+usage: benchmark_consensus_maker.py [-h] [--families FAMILIES] [--sizes SIZES [SIZES ...]] [--read_length READ_LENGTH]
+                                    [--cutoff CUTOFF] [--seed SEED]
+"""
+
+from __future__ import print_function
+
+import random
+from argparse import ArgumentParser
+from timeit import default_timer
+
+from ConsensusMaker_fq_output import consensusMaker
+
+try:
+    xrange
+except NameError:
+    xrange = range
+
+
+def referenceConsensusMaker (groupedReadsList,  cutoff,  readLength) :
+    '''The consensusMaker from version 2.0.0, kept unchanged as the reference for the equivalence check.'''
+    nucIdentityList=[0, 0, 0, 0, 0, 0] # In the order of T, C, G, A, N, Total
+    nucKeyDict = {0:'T', 1:'C', 2:'G', 3:'A', 4:'N'}
+    consensusRead = ''
+
+    for i in xrange(readLength) : # Count the types of nucleotides at a position in a read. i is the nucleotide index within a read in groupedReadsList
+        for j in xrange(len(groupedReadsList)): # Do this for every read that comprises a SMI group. j is the read index within groupedReadsList
+            try:
+                if groupedReadsList[j][i] == 'T' :
+                    nucIdentityList[0] += 1
+                elif groupedReadsList[j][i] == 'C':
+                    nucIdentityList[1] += 1
+                elif groupedReadsList[j][i] == 'G':
+                    nucIdentityList[2] += 1
+                elif groupedReadsList[j][i] == 'A':
+                    nucIdentityList[3] += 1
+                elif groupedReadsList[j][i] == 'N':
+                    nucIdentityList[4] += 1
+                else:
+                    nucIdentityList[4] += 1
+                nucIdentityList[5] += 1
+            except:
+                break
+        try:
+            for j in [0, 1, 2, 3, 4] :
+                if float(nucIdentityList[j])/float(nucIdentityList[5]) > cutoff :
+                    consensusRead += nucKeyDict[j]
+                    break
+                elif j==4:
+                    consensusRead += 'N'
+        except:
+            consensusRead += 'N'
+        nucIdentityList=[0, 0, 0, 0, 0, 0] # Reset for the next nucleotide position
+    return consensusRead
+
+def randomEdgeCaseFamily(rng):
+    '''Make a family with the cases the old loop handled implicitly: empty families, reads shorter or longer than readLength, missing sequences, non-ACGT bases and exact ties.'''
+    readLength = rng.choice([0, 1, 5, 20, 84])
+    alphabet = rng.choice(['ACGT', 'AACGTN', 'TTTTTA', 'ACGTNacgt.', 'AAAAAAAC'])
+    family = []
+    for _ in xrange(rng.randint(0, 12)):
+        length = readLength if rng.random() < 0.8 else rng.randint(0, readLength + 5)
+        family.append(''.join(rng.choice(alphabet) for _ in xrange(length)) if rng.random() > 0.02 else None)
+    cutoff = rng.choice([0.7, 0.5, 0.3, 0.0, 2.0/3, 1.0, 0.25])
+    return family, cutoff, readLength
+
+def randomFamily(rng, size, readLength, errorRate=0.05):
+    '''Make a family of reads copied from one random molecule, with a few random substitutions.'''
+    molecule = ''.join(rng.choice('ACGT') for _ in xrange(readLength))
+    return [''.join(base if rng.random() > errorRate else rng.choice('ACGTN') for base in molecule) for _ in xrange(size)]
+
+def checkEquivalence(rng, families):
+    '''Compare the two consensus makers on random edge case families and raise an AssertionError on the first difference.'''
+    for _ in xrange(families):
+        family, cutoff, readLength = randomEdgeCaseFamily(rng)
+        expected = referenceConsensusMaker(family, cutoff, readLength)
+        actual = consensusMaker(family, cutoff, readLength)
+        assert actual == expected, 'family=%s cutoff=%s readLength=%s: expected %s but got %s' % (family, cutoff, readLength, expected, actual)
+
+def timeConsensusMaker(function, families, cutoff, readLength):
+    start = default_timer()
+    consensuses = [function(family, cutoff, readLength) for family in families]
+    return default_timer() - start, consensuses
+
+def main():
+    parser = ArgumentParser()
+    parser.add_argument('--families', type=int, default=20000, help="Number of random families in the equivalence check [20000]")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[3, 10, 50, 200, 1000], help="Family sizes to time [3 10 50 200 1000]")
+    parser.add_argument('--read_length', type=int, default=150, help="Read length of the timed families [150]")
+    parser.add_argument('--cutoff', type=float, default=0.7, help="Consensus cutoff of the timed families [0.7]")
+    parser.add_argument('--seed', type=int, default=11, help="Random seed [11]")
+    o = parser.parse_args()
+
+    rng = random.Random(o.seed)
+    checkEquivalence(rng, o.families)
+    print('2.0.0 and 2.0.1 called the same consensus for %s random families' % o.families)
+
+    print('family size\t2.0.0 (s)\t2.0.1 (s)\tfamilies')
+    for size in o.sizes:
+        families = [randomFamily(rng, size, o.read_length) for _ in xrange(2000 if size < 200 else 200)]
+        oldTime, oldConsensuses = timeConsensusMaker(referenceConsensusMaker, families, o.cutoff, o.read_length)
+        newTime, newConsensuses = timeConsensusMaker(consensusMaker, families, o.cutoff, o.read_length)
+        assert newConsensuses == oldConsensuses, 'Consensus differs for family size %s' % size
+        print('%s\t%.2f\t%.2f\t%s' % (size, oldTime, newTime, len(families)))
+
+if __name__ == "__main__":
+    main()
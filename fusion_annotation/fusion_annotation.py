@@ -4,6 +4,8 @@
 # 0.5.2 - remove single quotes in cheetah xml section for booleans
 # 0.5.3 - Get all exons from GTF if there is an ENST supplied.
 # 0.5.4 - Added more regexes
+# 0.5.5 - --gencode_gtf may be a transcript index compiled with gtf.py, GTF records are loaded when first used
+# 0.5.6 - Fetch all breakpoint sequences through one open FASTA
 
 import argparse
 import json
@@ -13,7 +15,9 @@ from collections import OrderedDict
 from ensembldb import EnsemblDbImport
 from gtf import Gtf
 
-VERSION = '0.5.4'
+VERSION = '0.5.6'
+
+COMPLEMENT = str.maketrans('ACGT', 'TGCA')
 
 
 def supply_args():
@@ -26,7 +30,7 @@ def supply_args():
     parser.add_argument('--json_sample_metrics', help="Sample level metrics file")
     parser.add_argument('--ensembl_mapping', help="TSV mapping of ENST to RefSeq transcript IDs.")
     parser.add_argument('--path_to_fasta', help='Full path to fasta.fa file, with index file')
-    parser.add_argument('--gencode_gtf', help='GENCODE GTF, as used in CTAT resource package.')
+    parser.add_argument('--gencode_gtf', help='GENCODE GTF, as used in CTAT resource package, or a transcript index compiled from it with gtf.py.')
     parser.add_argument('--filt', action='store_true', help='filter out specific ribosomal and mitochondrial fusions')
     parser.add_argument('--cr_rem', action='store_true', help='this is a v1.10.0 star-fusion output, get rid of the crs')
     parser.add_argument('--output', default='starfusion_output.bedpe', help='output file')
@@ -294,24 +298,17 @@ def reverse_complement(seq):
         print(reverse_complement(seq))
         > GGGCCCGA
     """
-    complement = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-    bases = list(seq)
-    bases = reversed([complement.get(base, base) for base in bases])
-    bases = ''.join(bases)
-    return bases
+    return seq.translate(COMPLEMENT)[::-1]
 
 
-def get_nucleotides_with_samtools(mafline, genome_refpath, fusionside):
+def breakpoint_interval(mafline, fusionside):
     """
-    Use samtools faidx to find genomic sequences 25 nts upstream (if maflite_left), downatream (if maflite_right).
+    Find the region 25 nts upstream (if maflite_left), downstream (if maflite_right) of a breakpoint.
     Args:
         mafline(list):  [chrom, start, stop, nt/-, nt/-]
-        genome_refpath (str): string containing the fai reference path
         fusionside
     Returns:
-        maf_seqs (list of str): sequence of nts for each row of coordinates in the maflite file
-    Examples:
-        original bash command: samtools faidx Homo_sapiens.GRCh37.75.dna.primary_assembly.fa 2:112615802-112615805
+        interval (str): samtools style region, chrom:start-stop
     """
     interval = None
     if fusionside == 'left':
@@ -326,8 +323,62 @@ def get_nucleotides_with_samtools(mafline, genome_refpath, fusionside):
         else:
             interval = mafline[0] + ':' + mafline[1] + '-' + str(int(mafline[1])+25)
 
-    seq = pysam.FastaFile(filename=genome_refpath).fetch(region=interval)
-    return [interval, seq]
+    return interval
+
+
+def get_nucleotides_with_samtools(mafline, genome_refpath, fusionside):
+    """
+    Use samtools faidx to find genomic sequences 25 nts upstream (if maflite_left), downatream (if maflite_right).
+    Opens the FASTA for a single lookup, use ReferenceSeqs to look up many breakpoints.
+    Args:
+        mafline(list):  [chrom, start, stop, nt/-, nt/-]
+        genome_refpath (str): string containing the fai reference path
+        fusionside
+    Returns:
+        maf_seqs (list of str): sequence of nts for each row of coordinates in the maflite file
+    Examples:
+        original bash command: samtools faidx Homo_sapiens.GRCh37.75.dna.primary_assembly.fa 2:112615802-112615805
+    """
+    with ReferenceSeqs(genome_refpath) as ref:
+        return ref.fetch_all([breakpoint_interval(mafline, fusionside)])[0]
+
+
+class ReferenceSeqs:
+    """
+    Fetch breakpoint sequences from a reference FASTA that is opened, and its index loaded, only once.
+    """
+    def __init__(self, genome_refpath):
+        self.fasta = pysam.FastaFile(filename=genome_refpath)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.fasta.close()
+
+    @staticmethod
+    def _region_key(interval):
+        """
+        Sort regions by contig and then start, so the FASTA is read in order.
+        :return:
+        """
+        chrom, _, coords = interval.rpartition(':')
+        return chrom, int(coords.split('-')[0])
+
+    def fetch_all(self, intervals):
+        """
+        Look up a batch of samtools style regions, fetching each distinct region once.
+        Returns [interval, seq] for each region, in the order given.
+        :param intervals:
+        :return:
+        """
+        seqs = {}
+        for interval in sorted(set(intervals), key=self._region_key):
+            seqs[interval] = self.fasta.fetch(region=interval)
+        return [[interval, seqs[interval]] for interval in intervals]
 
 def collect_ccds(txs, gencode):
     """
@@ -339,8 +390,7 @@ def collect_ccds(txs, gencode):
     ccds = {}
     mygtf = Gtf(gencode, txs=txs)
     for entry in txs:
-        tx_only = mygtf.filt_tx(mygtf.raw, entry)
-        feat_only = mygtf.filt_feature(tx_only, feat='transcript')
+        feat_only = mygtf.raw.get(entry, {}).get('transcript', [])
         ccds[entry] = mygtf.exon_to_ccds(feat_only)
     return ccds
 
@@ -379,9 +429,23 @@ def main():
         regex_filt = None
 
     sf = StarFusionOutput(args.starfusion, args.cr_rem)
-    my_sf = sf.fusions
+    my_sf = [FusionAnnot(line) for line in sf.fusions]
     my_gtf = Gtf(args.gencode_gtf, sf.my_txs)
 
+    # Look up the sequence on both sides of every breakpoint in one pass over the reference.
+    intervals = []
+    for fusion in my_sf:
+        linebedpe = fusion.output_line
+        mafline_left = [linebedpe['chrom1'], linebedpe['start1'], linebedpe['end1'],
+                        linebedpe['LeftBreakDinuc'][0], linebedpe['strand1']]
+        mafline_right = [linebedpe['chrom2'], linebedpe['start2'], linebedpe['end2'],
+                         linebedpe['RightBreakDinuc'][0], linebedpe['strand2']]
+        intervals.append(breakpoint_interval(mafline_left, "left"))
+        intervals.append(breakpoint_interval(mafline_right, "right"))
+    if intervals:
+        with ReferenceSeqs(args.path_to_fasta) as ref:
+            seqs = ref.fetch_all(intervals)
+
     cols = False
     # If there are no results, we need at least a header to send to the CGD...
     hard_header = ["chrom1", "start1", "end1", "chrom2", "start2", "end2", "name", "score", "strand1", "strand2",
@@ -397,8 +461,7 @@ def main():
         sf_out.write('\n')
 
     header_set = False
-    for line in my_sf:
-        fusion = FusionAnnot(line)
+    for i, fusion in enumerate(my_sf):
         linebedpe = fusion.output_line
 
         if not header_set:
@@ -413,12 +476,8 @@ def main():
             header_set = True
 
         # get seqs left and right
-        mafline_left = [linebedpe['chrom1'], linebedpe['start1'], linebedpe['end1'],
-                        linebedpe['LeftBreakDinuc'][0], linebedpe['strand1']]
-        mafline_right = [linebedpe['chrom2'], linebedpe['start2'], linebedpe['end2'],
-                         linebedpe['RightBreakDinuc'][0], linebedpe['strand2']]
-        seq_left = get_nucleotides_with_samtools(mafline_left, args.path_to_fasta, "left")
-        seq_right = get_nucleotides_with_samtools(mafline_right, args.path_to_fasta, "right")
+        seq_left = seqs[2 * i]
+        seq_right = seqs[2 * i + 1]
 
         if on_target:
             linebedpe['NormalizedFrags'] = calc_on_target(on_target, linebedpe['JunctionReadCount'],
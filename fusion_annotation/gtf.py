@@ -1,8 +1,84 @@
+import argparse
+import sqlite3
+
+# The first 16 bytes of every SQLite database file.
+SQLITE_MAGIC = b'SQLite format 3\x00'
+# Bump when the layout of the compiled index changes.
+INDEX_VERSION = '1'
+# Stay under the SQLite limit on the number of ? parameters in a query.
+QUERY_CHUNK = 500
+
+
+def supply_args():
+    """
+    Populate args.
+    https://docs.python.org/2.7/library/argparse.html
+    """
+    parser = argparse.ArgumentParser(description='Compile a GENCODE GTF in to a transcript index that can be '
+                                                 'passed to fusion_annotation.py as --gencode_gtf.')
+    parser.add_argument('gtf', help='GENCODE GTF, as used in CTAT resource package.')
+    parser.add_argument('index', help='Output SQLite transcript index')
+    args = parser.parse_args()
+    return args
+
+
+def is_gtf_index(filename):
+    """
+    Check whether a file is a compiled GTF index rather than a GTF.
+    :param filename:
+    :return:
+    """
+    with open(filename, 'rb') as myfile:
+        return myfile.read(len(SQLITE_MAGIC)) == SQLITE_MAGIC
+
+
+def compile_gtf(gtf_filename, index_filename):
+    """
+    Compile a GTF in to a SQLite file holding one row per GTF record, indexed by transcript_id, so that the
+    records for a handful of transcripts can be read without parsing the whole GTF.  The start and end of each
+    record are stored as integers, making it an interval table of the exons.
+    :param gtf_filename:
+    :param index_filename:
+    :return:
+    """
+    conn = sqlite3.connect(index_filename)
+    try:
+        conn.execute('DROP TABLE IF EXISTS meta')
+        conn.execute('DROP TABLE IF EXISTS records')
+        conn.execute('CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT)')
+        conn.execute('CREATE TABLE records (transcript_id TEXT, seqname TEXT, source TEXT, feature TEXT, '
+                     'start INTEGER, end INTEGER, score TEXT, strand TEXT, frame TEXT, info TEXT)')
+        conn.executemany('INSERT INTO meta VALUES (?, ?)', [('version', INDEX_VERSION), ('gtf', gtf_filename)])
+        with open(gtf_filename) as myfile:
+            conn.executemany('INSERT INTO records VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                             Gtf.gtf_records(myfile))
+        conn.execute('CREATE INDEX records_tx ON records (transcript_id, feature)')
+        conn.commit()
+    finally:
+        conn.close()
+
+
 class Gtf:
+    """
+    GTF records of the transcripts in txs:
+    {TX_ID: {FEAT: [rec, rec, ...]}}
+
+    filename may be a GTF, or an index made from one with compile_gtf, in which case only the records of txs are
+    read.  Records are loaded the first time raw is used.
+    """
     def __init__(self, filename, txs=None):
         self.filename = filename
         self.txs = txs
-        self.raw = self._gather_txs()
+        self._raw = None
+
+    @property
+    def raw(self):
+        if self._raw is None:
+            if is_gtf_index(self.filename):
+                self._raw = self._load_txs()
+            else:
+                self._raw = self._gather_txs()
+        return self._raw
 
     @staticmethod
     def _info_to_dict(line):
@@ -14,9 +90,16 @@ class Gtf:
         level 2; havana_gene "OTTHUMG00000000961.2";
         :return:
         """
+        return Gtf._parse_info(line.rstrip('\n').split('\t')[8])
+
+    @staticmethod
+    def _parse_info(info):
+        """
+        Parse the final GTF column in to a dictionary.
+        :return:
+        """
         info_dict = {}
-        info = line.rstrip('\n').split('\t')[8].split(';')
-        for entry in info:
+        for entry in info.split(';'):
             if entry:
                 entry = entry.strip()
                 key = entry.split(' ')[0].strip()
@@ -24,6 +107,34 @@ class Gtf:
                 info_dict[key] = val
         return info_dict
 
+    @staticmethod
+    def _tx_id(line):
+        """
+        Pull the transcript_id out of the final GTF column without parsing the rest of it.
+        :return:
+        """
+        tx_id = None
+        info = line.rstrip('\n').split('\t')[8]
+        for entry in info.split(';'):
+            entry = entry.strip()
+            if entry.startswith('transcript_id '):
+                tx_id = entry.split(' ')[1].strip().strip('\"')
+        return tx_id
+
+    @classmethod
+    def gtf_records(cls, myfile):
+        """
+        Yield the columns of each GTF record, with the transcript_id in front, for compile_gtf.
+        :param myfile:
+        :return:
+        """
+        for rec in myfile:
+            if not rec.startswith('#'):
+                tx_id = cls._tx_id(rec)
+                if tx_id is not None:
+                    rec = rec.rstrip('\n').split('\t')
+                    yield [tx_id] + rec[:9]
+
     @staticmethod
     def filt_feature(choices, feat='exon'):
         """
@@ -58,31 +169,75 @@ class Gtf:
         :return:
         """
         gtf_recs = {}
+        if not self.txs:
+            return gtf_recs
+        txs = set(self.txs)
         with open(self.filename) as myfile:
             for rec in myfile:
                 if not rec.startswith('#'):
-                    info = self._info_to_dict(rec)
-                    tx_id = info['transcript_id']
-                    if self.txs:
-                        if tx_id in self.txs:
-                            rec = rec.rstrip('\n').split('\t')
-                            feat = rec[2]
-                            this_rec = {'seqname': rec[0],
-                                        'source': rec[1],
-                                        'feature': feat,
-                                        'start': rec[3],
-                                        'end': rec[4],
-                                        'score': rec[5],
-                                        'strand': rec[6],
-                                        'frame': rec[7],
-                                        'info': info}
-
-                            if tx_id not in gtf_recs:
-                                gtf_recs[tx_id] = {}
-                            if feat not in gtf_recs[tx_id]:
-                                gtf_recs[tx_id][feat] = []
-
-                            gtf_recs[tx_id][feat].append(this_rec)
+                    # Only parse the whole info column of the transcripts we want.
+                    tx_id = self._tx_id(rec)
+                    if tx_id in txs:
+                        info = self._info_to_dict(rec)
+                        rec = rec.rstrip('\n').split('\t')
+                        feat = rec[2]
+                        this_rec = {'seqname': rec[0],
+                                    'source': rec[1],
+                                    'feature': feat,
+                                    'start': rec[3],
+                                    'end': rec[4],
+                                    'score': rec[5],
+                                    'strand': rec[6],
+                                    'frame': rec[7],
+                                    'info': info}
+
+                        if tx_id not in gtf_recs:
+                            gtf_recs[tx_id] = {}
+                        if feat not in gtf_recs[tx_id]:
+                            gtf_recs[tx_id][feat] = []
+
+                        gtf_recs[tx_id][feat].append(this_rec)
+
+        return gtf_recs
+
+    def _load_txs(self):
+        """
+        Read the records of the transcripts we care about from a compiled index, in the same order as the GTF.
+        {TX_ID: {FEAT: [rec, rec, ...]}}
+        :return:
+        """
+        gtf_recs = {}
+        if not self.txs:
+            return gtf_recs
+        txs = list(dict.fromkeys(self.txs))
+        conn = sqlite3.connect(self.filename)
+        try:
+            version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            if version is None or version[0] != INDEX_VERSION:
+                raise Exception(f"{self.filename} is not a version {INDEX_VERSION} GTF index, please recompile it.")
+            for i in range(0, len(txs), QUERY_CHUNK):
+                chunk = txs[i:i + QUERY_CHUNK]
+                query = ('SELECT transcript_id, seqname, source, feature, start, end, score, strand, frame, info '
+                         'FROM records WHERE transcript_id IN ({}) ORDER BY rowid'.format(','.join('?' * len(chunk))))
+                for tx_id, seqname, source, feat, start, end, score, strand, frame, info in conn.execute(query, chunk):
+                    this_rec = {'seqname': seqname,
+                                'source': source,
+                                'feature': feat,
+                                'start': str(start),
+                                'end': str(end),
+                                'score': score,
+                                'strand': strand,
+                                'frame': frame,
+                                'info': self._parse_info(info)}
+
+                    if tx_id not in gtf_recs:
+                        gtf_recs[tx_id] = {}
+                    if feat not in gtf_recs[tx_id]:
+                        gtf_recs[tx_id][feat] = []
+
+                    gtf_recs[tx_id][feat].append(this_rec)
+        finally:
+            conn.close()
 
         return gtf_recs
 
@@ -108,3 +263,12 @@ class Gtf:
                 if chrom == exon_chrom:
                     if int(coord) >= start and int(coord) <= end:
                         return exon_no
+
+
+def main():
+    args = supply_args()
+    compile_gtf(args.gtf, args.index)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,13 @@
 #!/usr/bin/env python
 
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import zip_longest
 import sys
 from natsort import natsorted
 import argparse
 
-VERSION = '1.0.5'
+VERSION = '1.0.8'
 
 CHROMS = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10", "11", "12", "13", "14", "15", "16", "17", "18", "19", "20", "21", "22", "X", "Y", "MT"]
 
@@ -128,6 +131,55 @@ def parseGff3(handle):
     return all_cds, refseq_gene, refseq_coords
 
 
+class CoverageRuns(object):
+
+    """ Per-locus depths for one chromosome, held as runs of consecutive coordinates.  Each run is
+    an array of depths, so the depths over an interval are a few slices rather than a dict lookup
+    per base. """
+
+    def __init__(self):
+        self.starts = []
+        self.runs = []
+        self.unordered = False
+
+    def append(self, coord, depth):
+        if self.runs and coord == self.starts[-1] + len(self.runs[-1]):
+            self.runs[-1].append(depth)
+        else:
+            if self.runs and coord < self.starts[-1] + len(self.runs[-1]):
+                self.unordered = True
+            self.starts.append(coord)
+            self.runs.append(array('i', [depth]))
+
+    def finish(self):
+        """ DepthOfCoverage writes loci in order, but if it did not, rebuild the runs in coordinate
+        order.  As with a dict, the last depth seen for a locus wins. """
+        if self.unordered:
+            depths = {}
+            for start, run in zip(self.starts, self.runs):
+                for i, depth in enumerate(run, start):
+                    depths[i] = depth
+            self.starts = []
+            self.runs = []
+            self.unordered = False
+            for coord in sorted(depths):
+                self.append(coord, depths[coord])
+
+    def segments(self, start, stop):
+        """ Return (start, depths) for each covered stretch of the closed interval start-stop. """
+        segments = []
+        i = max(bisect_right(self.starts, start) - 1, 0)
+        while i < len(self.starts) and self.starts[i] <= stop:
+            run_start = self.starts[i]
+            run = self.runs[i]
+            lo = max(start, run_start)
+            hi = min(stop, run_start + len(run) - 1)
+            if lo <= hi:
+                segments.append((lo, run[lo - run_start:hi - run_start + 1]))
+            i += 1
+        return segments
+
+
 def createDocDict(handle):
 
     """ Create dictionary to hold coverage values per coordinate.  Input file originates
@@ -135,7 +187,7 @@ def createDocDict(handle):
     DepthOfCoverage will be run on an interval list from the capture kit manufacturer.
 
     Input: handle: file handle
-    Output: doc_dict: {"chrom:coord": depth} """
+    Output: doc_dict: {chrom: CoverageRuns} """
 
     print("Creating depth of coverage dictionary.")
 
@@ -147,32 +199,185 @@ def createDocDict(handle):
             if i % 1000000 == 0:
                 print(i)
             line = line.rstrip('\n').split('\t')
-            chrom = str(line[0].split(':')[0])
-            coord = str(line[0].split(':')[1])
-            depth = int(line[1])
+            locus = line[0].split(':')
+            chrom = locus[0]
             if chrom not in doc_dict:
-                doc_dict[chrom] = {}
-            doc_dict[chrom][coord] = depth
+                doc_dict[chrom] = CoverageRuns()
+            doc_dict[chrom].append(int(locus[1]), int(line[1]))
             i += 1
 
+    for coverage in doc_dict.values():
+        coverage.finish()
+
     return doc_dict
 
 
-def calcDepth(depth, total_depths, my_depths):
+def calcDepth(depths, my_depths):
 
     """
-    Calculate the depths at values as defined by DEPTHS globally.
-    Input: depth, total_depths
-    Output: updated total_depths
+    Count the depths at or above each value in my_depths.
+    Input: depths, an array of per-locus depths
+    Output: counts, in the same order as my_depths
     """
 
-    if len(total_depths) != len(my_depths):
-        raise Exception("total_depths is not the right size, please check code.")
-
+    ordered = sorted(depths)
+    total = len(ordered)
+    counts = len(my_depths) * [0.0]
     for value in my_depths:
-        if depth >= int(value):
-            total_depths[my_depths.index(value)] += 1
-    return total_depths
+        # A repeated cutoff is counted against its first occurrence.
+        counts[my_depths.index(value)] += total - bisect_left(ordered, int(value))
+    return counts
+
+
+def intervalDepth(coverage_0, coverage_30, start, stop, my_depths):
+
+    """
+    Total the Q0 and Q30 depths over the loci in start-stop that have a Q0 depth, and count
+    the loci at or above each depth cutoff.
+    Output: [covered, q0, q30, d1, d2, ...]
+    """
+
+    depths = array('i')
+    q30 = 0
+    for seg_start, run in coverage_0.segments(start, stop):
+        depths.extend(run)
+        for _, run_30 in coverage_30.segments(seg_start, seg_start + len(run) - 1):
+            q30 += sum(run_30)
+    return [float(len(depths)), float(sum(depths)), float(q30)] + calcDepth(depths, my_depths)
+
+
+def collectIntervals(all_intervals, probe_refseq_runs, refseq_coords):
+
+    """
+    Gather every interval that depth metrics are needed for: the probes, the stretches of
+    each probe covered by a RefSeq, and the RefSeq CDS coordinates.
+    Output: {chrom: [[start, stop], ...]}, sorted by start.
+    """
+
+    intervals = {}
+    for chrom in all_intervals:
+        chrom_intervals = intervals.setdefault(chrom, set())
+        for probe, refseq_runs in zip(all_intervals[chrom], probe_refseq_runs.get(chrom, [])):
+            for runs in refseq_runs.values():
+                chrom_intervals.update(tuple(run) for run in runs)
+        chrom_intervals.update((probe[0], probe[1]) for probe in all_intervals[chrom])
+    for coords in refseq_coords.values():
+        for coord in coords:
+            intervals.setdefault(coord[0], set()).add((int(coord[1]), int(coord[2])))
+
+    return dict((chrom, sorted(chrom_intervals)) for chrom, chrom_intervals in intervals.items())
+
+
+def depthStats(intervals, doc_dict_0, doc_dict_30, my_depths):
+
+    """
+    Depth metrics for each interval, from DepthOfCoverage outputs held in memory.
+    Output: {(chrom, start, stop): [covered, q0, q30, d1, d2, ...]}
+    """
+
+    depth_stats = {}
+    for chrom, chrom_intervals in intervals.items():
+        coverage_0 = doc_dict_0.get(chrom, CoverageRuns())
+        coverage_30 = doc_dict_30.get(chrom, CoverageRuns())
+        for start, stop in chrom_intervals:
+            depth_stats[(chrom, start, stop)] = intervalDepth(coverage_0, coverage_30, start, stop, my_depths)
+
+    return depth_stats
+
+
+def readDocRuns(doc_0_handle, doc_30_handle, max_run=100000):
+
+    """
+    Read the Q0 and Q30 DepthOfCoverage outputs together, and yield runs of consecutive loci
+    as (chrom, start, q0 depths, q30 depths).  Both files must list the same loci, sorted by
+    position within each chromosome, which is how DepthOfCoverage writes them when it is run
+    on the same interval list.
+    """
+
+    with doc_0_handle as doc_0, doc_30_handle as doc_30:
+        next(doc_0) # Skip header lines.
+        next(doc_30)
+        done_chroms = set()
+        run_chrom = None
+        run_start = None
+        run_0 = array('i')
+        run_30 = array('i')
+        i = 0
+        for line_0, line_30 in zip_longest(doc_0, doc_30):
+            if i % 1000000 == 0:
+                print(i)
+            if line_0 is None or line_30 is None:
+                raise Exception("The Q0 and Q30 DepthOfCoverage files do not have the same number of loci.")
+            line_0 = line_0.rstrip('\n').split('\t')
+            line_30 = line_30.rstrip('\n').split('\t')
+            if line_0[0] != line_30[0]:
+                raise Exception("Locus " + line_0[0] + " in the Q0 DepthOfCoverage file does not match locus "
+                                + line_30[0] + " in the Q30 file.")
+            locus = line_0[0].split(':')
+            chrom = locus[0]
+            coord = int(locus[1])
+
+            if chrom == run_chrom and coord == run_start + len(run_0) and len(run_0) < max_run:
+                run_0.append(int(line_0[1]))
+                run_30.append(int(line_30[1]))
+            else:
+                if run_0:
+                    yield run_chrom, run_start, run_0, run_30
+                if chrom != run_chrom:
+                    if chrom in done_chroms:
+                        raise Exception("The DepthOfCoverage files are not sorted, " + chrom + " appears twice.")
+                    done_chroms.add(chrom)
+                elif coord < run_start + len(run_0):
+                    raise Exception("The DepthOfCoverage files are not sorted at " + line_0[0] + ".")
+                run_chrom = chrom
+                run_start = coord
+                run_0 = array('i', [int(line_0[1])])
+                run_30 = array('i', [int(line_30[1])])
+            i += 1
+
+        if run_0:
+            yield run_chrom, run_start, run_0, run_30
+
+
+def streamDepthStats(intervals, doc_0_handle, doc_30_handle, my_depths):
+
+    """
+    Depth metrics for each interval, accumulated while streaming the Q0 and Q30 DepthOfCoverage
+    outputs, so only one run of loci is held in memory at a time.  Each run is merged against
+    the intervals sorted by start, keeping the intervals that are still open.
+    Output: {(chrom, start, stop): [covered, q0, q30, d1, d2, ...]}, and the chromosomes with coverage
+    """
+
+    depth_stats = {}
+    for chrom, chrom_intervals in intervals.items():
+        for start, stop in chrom_intervals:
+            depth_stats[(chrom, start, stop)] = [0.0, 0.0, 0.0] + (len(my_depths) * [0.0])
+
+    doc_chroms = set()
+    chrom = None
+    for run_chrom, run_start, run_0, run_30 in readDocRuns(doc_0_handle, doc_30_handle):
+        if run_chrom != chrom:
+            chrom = run_chrom
+            doc_chroms.add(chrom)
+            chrom_intervals = intervals.get(chrom, [])
+            next_interval = 0
+            open_intervals = []
+        run_stop = run_start + len(run_0) - 1
+
+        while next_interval < len(chrom_intervals) and chrom_intervals[next_interval][0] <= run_stop:
+            open_intervals.append(chrom_intervals[next_interval])
+            next_interval += 1
+        open_intervals = [interval for interval in open_intervals if interval[1] >= run_start]
+
+        for start, stop in open_intervals:
+            lo = max(start, run_start) - run_start
+            hi = min(stop, run_stop) - run_start + 1
+            depths = run_0[lo:hi]
+            run_stats = [len(depths), sum(depths), sum(run_30[lo:hi])] + calcDepth(depths, my_depths)
+            stats = depth_stats[(chrom, start, stop)]
+            depth_stats[(chrom, start, stop)] = [total + value for total, value in zip(stats, run_stats)]
+
+    return depth_stats, doc_chroms
 
 
 def writeHeader(report_out, pre_header, my_depths):
@@ -233,7 +438,7 @@ def writeReportQC(report_qc, total_bp, report_out, refseq_gene, transcripts):
     report_out.close()
 
 
-def writeProbeQC(all_intervals, position_refseq, doc_dict_0, doc_dict_30, probe_out, refseq_gene, my_depths, dlen, pf_bases_aligned):
+def writeProbeQC(all_intervals, probe_refseq_runs, depth_stats, doc_chroms, probe_out, refseq_gene, my_depths, dlen, pf_bases_aligned):
 
     ## From GFF:
     ## [18461046, 18461153, 'XM_005260650.1', 'POLR3F', 0, 0, 0, 0, 0, 0, 0]
@@ -246,24 +451,14 @@ def writeProbeQC(all_intervals, position_refseq, doc_dict_0, doc_dict_30, probe_
     total_counts = [0.0, 0.0, 0.0] # seqlen, q0, q30, d200, d100, d50, d20, d10
     total_counts.extend(dlen * [0.0])
     for chrom in all_intervals:
-        if chrom in doc_dict_0:
-            for probe in all_intervals[chrom]:
-                probe_temp = [0.0, 0.0]
-                probe_temp.extend(dlen * [0.0])
-                temp_refseq = []
+        if chrom in doc_chroms:
+            chrom_refseq_runs = probe_refseq_runs.get(chrom, len(all_intervals[chrom]) * [{}])
+            for probe, refseq_runs in zip(all_intervals[chrom], chrom_refseq_runs):
+                temp_refseq = list(refseq_runs)
                 start = probe[0]
                 stop = probe[1]
                 seqlen = stop - start + 1
-                for i in range(int(start), int(stop)+1):
-                    if str(i) in doc_dict_0[chrom]:
-                        probe_temp[0] += doc_dict_0[chrom][str(i)]
-                        probe_temp[1] += doc_dict_30[chrom][str(i)]
-                        probe_temp[2:] = calcDepth(doc_dict_0[chrom][str(i)], probe_temp[2:], my_depths)
-                    else:
-                        pass
-
-                    if str(i) in position_refseq[chrom]:
-                        temp_refseq.extend(position_refseq[chrom][str(i)])
+                probe_temp = depth_stats[(chrom, start, stop)][1:]
                 if probe_temp[0] != 0.0:
                     q30 = str("{:.4}".format((probe_temp[1]*100)/probe_temp[0]))
                 else:
@@ -320,63 +515,96 @@ def writeProbeQC(all_intervals, position_refseq, doc_dict_0, doc_dict_30, probe_
     probe_out.close()
 
 
-def positionRefSeq(refseq_coords):
+def refSeqIndex(refseq_coords):
 
-    ### Associate positions to the RefSeq ID's overlapping them.
+    ### Index the RefSeq coordinates by chromosome.  The coordinates of each RefSeq are merged where they
+    ### overlap or abut, so that each position is covered at most once per RefSeq.  The rank is the order
+    ### the RefSeq was read from the GFF.
+    ### Output: {chrom: [[start, stop, rank, refseq], ...]}, sorted by start.
 
-    position_refseq = {}
-    for refseq, coords in refseq_coords.items():
+    refseq_index = {}
+    for rank, (refseq, coords) in enumerate(refseq_coords.items()):
+        by_chrom = {}
         for coord in coords:
-            chrom = coord[0]
-            if chrom not in position_refseq:
-                position_refseq[chrom] = {}
-            for i in range(int(coord[1]), int(coord[2])+1):
-                if str(i) not in position_refseq[chrom]:
-                    position_refseq[chrom][str(i)] = [refseq]
+            by_chrom.setdefault(coord[0], []).append([int(coord[1]), int(coord[2])])
+        for chrom, chrom_coords in by_chrom.items():
+            merged = []
+            for start, stop in sorted(chrom_coords):
+                if merged and start <= merged[-1][1] + 1:
+                    merged[-1][1] = max(merged[-1][1], stop)
                 else:
-                    if refseq not in position_refseq[chrom][str(i)]:
-                        position_refseq[chrom][str(i)].append(refseq)
+                    merged.append([start, stop])
+            refseq_index.setdefault(chrom, []).extend([start, stop, rank, refseq] for start, stop in merged)
 
-    return position_refseq
+    for chrom_index in refseq_index.values():
+        chrom_index.sort(key=lambda x: x[0])
 
+    return refseq_index
 
-def create_report_qc(all_intervals, position_refseq, doc_dict_0, doc_dict_30, dlen, my_depths):
 
-    ### Develop the metrics for gene-level QC reporting.
-    ### To do this, we iterate over probe coordinates, and check to see if they are in the position_refseq dict.
+def probeRefSeqRuns(all_intervals, refseq_index):
 
-    report_qc = {}
-    total_bp = {}
+    ### For each probe, find the stretches of the probe covered by each RefSeq.  Probes are visited in order of
+    ### start, sweeping over the RefSeq index and keeping the RefSeq coordinates that are still open.
+    ### Output: {chrom: [{refseq: [[start, stop], ...]}, ...]}, in the same order as all_intervals.
+
+    probe_refseq_runs = {}
     j = 0
     for chrom in all_intervals:
-        if chrom in position_refseq:
-            for probe in all_intervals[chrom]:
+        if chrom in refseq_index:
+            chrom_index = refseq_index[chrom]
+            probes = all_intervals[chrom]
+            probe_refseq_runs[chrom] = len(probes) * [None]
+            next_coord = 0
+            open_coords = []
+            for k in sorted(range(len(probes)), key=lambda k: probes[k][0]):
                 if j % 10000 == 0:
                     print(j)
-                for i in range(int(probe[0]), int(probe[1])+1):
-                    if str(i) in position_refseq[chrom]:
-                        for refseq in position_refseq[chrom][str(i)]:
-                            if refseq not in total_bp:
-                                total_bp[refseq] = 1
-                            else:
-                                total_bp[refseq] += 1
-                            if refseq not in report_qc:
-                                report_qc[refseq] = [0.0, 0.0] + (dlen * [0.0])
-                            if str(i) in doc_dict_0[chrom]:
-                                report_qc[refseq][0] += doc_dict_0[chrom][str(i)]
-                                report_qc[refseq][1] += doc_dict_30[chrom][str(i)]
-                                report_qc[refseq][2:] = calcDepth(doc_dict_0[chrom][str(i)], report_qc[refseq][2:], my_depths)
-                            else:
-                                pass
+                j += 1
+                probe_start = int(probes[k][0])
+                probe_stop = int(probes[k][1])
+                while next_coord < len(chrom_index) and chrom_index[next_coord][0] <= probe_stop:
+                    open_coords.append(chrom_index[next_coord])
+                    next_coord += 1
+                open_coords = [coord for coord in open_coords if coord[1] >= probe_start]
+
+                refseq_runs = {}
+                # Visit the RefSeq ID's in the order they are found walking along the probe, as the HGNC column is
+                # written from a set.
+                for start, rank, stop, refseq in sorted((max(start, probe_start), rank, stop, refseq)
+                                                        for start, stop, rank, refseq in open_coords):
+                    if start <= probe_stop:
+                        refseq_runs.setdefault(refseq, []).append([start, min(stop, probe_stop)])
+                probe_refseq_runs[chrom][k] = refseq_runs
 
         else:
-            print("Chromosome " + chrom + " not in position_refseq.")
-        j += 1
+            print("Chromosome " + chrom + " not in the RefSeq index.")
+            j += len(all_intervals[chrom])
+
+    return probe_refseq_runs
+
+
+def create_report_qc(probe_refseq_runs, depth_stats, dlen):
+
+    ### Develop the metrics for gene-level QC reporting, from the stretches of each probe covered by a RefSeq.
+
+    report_qc = {}
+    total_bp = {}
+    for chrom in probe_refseq_runs:
+        for refseq_runs in probe_refseq_runs[chrom]:
+            for refseq, runs in refseq_runs.items():
+                if refseq not in total_bp:
+                    total_bp[refseq] = 0
+                    report_qc[refseq] = [0.0, 0.0] + (dlen * [0.0])
+                for start, stop in runs:
+                    total_bp[refseq] += stop - start + 1
+                    run_qc = depth_stats[(chrom, start, stop)][1:]
+                    report_qc[refseq] = [total + value for total, value in zip(report_qc[refseq], run_qc)]
 
     return report_qc, total_bp
 
 
-def findHoles(refseq_coords, refseq_gene, doc_dict_0, hole_handle):
+def findHoles(refseq_coords, refseq_gene, depth_stats, hole_handle):
 
     ### Find CDS regions not covered by our probes.
     hole_dict = {}
@@ -389,9 +617,7 @@ def findHoles(refseq_coords, refseq_gene, doc_dict_0, hole_handle):
             stop = int(coord[2])
             seqlen = stop - start + 1
             hole_stats[0] += seqlen
-            for i in range(start, stop+1):
-                if str(i) in doc_dict_0[chrom]:
-                    hole_stats[1] += 1
+            hole_stats[1] += depth_stats[(chrom, start, stop)][0]
 
         covered = str("{:.1}".format(hole_stats[1]/hole_stats[0]))
         hole_dict[refseq] = [covered, refseq, refseq_gene[refseq]]
@@ -452,6 +678,8 @@ def main():
     parser.add_argument('depth', nargs='+', help='Depth cutoffs.')
     parser.add_argument('picard_metrics', help='Picard Alignment Summary Metrics.')
     parser.add_argument('--transcripts', help='List of RefSeq transcript id\'s to include in output.')
+    parser.add_argument('--stream', action='store_true', help='Read the DepthOfCoverage outputs together, a run of loci at a time, '
+                        'instead of loading them in to memory.  Both must list the same loci, sorted by position.')
 
     ### Optional, will be used to find percent coverage of CDS regions by our interval set.
     parser.add_argument('--hole_out', help='Percent covered CDS sequences based on input probe set.')
@@ -471,14 +699,26 @@ def main():
     all_intervals = parseBed(probe_handle, dlen)
     print("Creating dictionary to hold GFF3 CDS definitions.")
     all_cds, refseq_gene, refseq_coords = parseGff3(gff_handle)
-    print("Creating dictionary to hold DepthOfCoverage coordinate/depth pairs at Q0.")
-    doc_dict_0 = createDocDict(doc_0_handle)
-    print("Creating dictionary to hold DepthOfCoverage coordinate/depth pairs at Q30.")
-    doc_dict_30 = createDocDict(doc_30_handle)
-    print("Creating positionRefSeq, to associate each coordinate with a RefSeq ID.")
-    position_refseq = positionRefSeq(refseq_coords)
+    print("Creating refSeqIndex, to find the RefSeq ID's overlapping an interval.")
+    refseq_index = refSeqIndex(refseq_coords)
+    print("Finding the RefSeq ID's covered by each probe.")
+    probe_refseq_runs = probeRefSeqRuns(all_intervals, refseq_index)
+    intervals = collectIntervals(all_intervals, probe_refseq_runs, refseq_coords)
+
+    if args.stream:
+        print("Streaming DepthOfCoverage coordinate/depth pairs at Q0 and Q30.")
+        depth_stats, doc_chroms = streamDepthStats(intervals, doc_0_handle, doc_30_handle, args.depth)
+    else:
+        print("Creating dictionary to hold DepthOfCoverage coordinate/depth pairs at Q0.")
+        doc_dict_0 = createDocDict(doc_0_handle)
+        print("Creating dictionary to hold DepthOfCoverage coordinate/depth pairs at Q30.")
+        doc_dict_30 = createDocDict(doc_30_handle)
+        depth_stats = depthStats(intervals, doc_dict_0, doc_dict_30, args.depth)
+        doc_chroms = set(doc_dict_0)
+        del doc_dict_0, doc_dict_30
+
     print("Creating report_qc and total_bp.  These will hold data for the report-level QC metrics.")
-    report_qc, total_bp = create_report_qc(all_intervals, position_refseq, doc_dict_0, doc_dict_30, dlen, args.depth)
+    report_qc, total_bp = create_report_qc(probe_refseq_runs, depth_stats, dlen)
  
     pre_header = ["REFSEQ", "HGNC"]
     print("Writing the header for gene metrics.")
@@ -501,12 +741,12 @@ def main():
     pf_bases_aligned = parsePicardMetrics(args.picard_metrics)
     print("Create and write probe metrics to file.")
     
-    writeProbeQC(all_intervals, position_refseq, doc_dict_0, doc_dict_30, probe_out, refseq_gene, args.depth, dlen, pf_bases_aligned)
+    writeProbeQC(all_intervals, probe_refseq_runs, depth_stats, doc_chroms, probe_out, refseq_gene, args.depth, dlen, pf_bases_aligned)
 
     if args.hole_out:
         print("Finding holes in probe coverage.")
         hole_handle = open(args.hole_out, 'w')
-        findHoles(refseq_coords, refseq_gene, doc_dict_0, hole_handle)
+        findHoles(refseq_coords, refseq_gene, depth_stats, hole_handle)
 
 
 if __name__ == "__main__":
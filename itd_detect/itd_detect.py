@@ -5,7 +5,6 @@
 # you'd like, then run PEAR to merge reads (if using paired-end).  Then, run BWA and output a coordinate sorted
 # BAM file.  This is an appropriate input file for the detection algorithm.
 # Paired mode is not working very well especially when estimating VAFs, use at own risk.
-# VAFs are also off in paired-end mode because I am only looking for exact matches during overlap determination.
 # 0.4.2 - If we can't get HGVS results, just return an output file where they are blank.
 # 1.0.0 - Remove hgvs from script, create vcf as output.
 # 1.0.2 - Added bcor and fgfr targets
@@ -14,15 +13,19 @@
 # 1.1.1 - Added BCOR and FGFR regions to support STP4 workflows
 # 1.2.0 - Allow for multiple targets to be selected.
 # 1.2.1 - Added min_depth argument
+# 1.2.2 - Find the longest repeats in each read with longest_repeats() instead of building a SuffixArray per read,
+#       - and only once for each distinct read sequence.
+# 1.2.3 - Count reference support for all ITD calls in one pass through the BAM, and only for calls that are written.
+# 1.2.4 - Merge overlapping pairs in to a MergedRead instead of a deepcopy of the pysam record, and allow mismatches
+#       - when finding the overlap.
 
 import argparse
 import pysam
 from collections import defaultdict
-from copy import deepcopy
-from itertools import groupby
-from operator import itemgetter
+from itertools import compress, groupby
+from operator import eq, itemgetter
 
-VERSION = '1.2.1'
+VERSION = '1.2.4'
 
 def supply_args():
     """
@@ -187,6 +190,41 @@ class SuffixArray:
         return dict((k, sorted(v)) for k, v in result.items())
 
 
+def longest_repeats(text):
+    """
+    Find the longest substrings that occur more than once in the text, and the start of every occurrence.  The result
+    is the same as SuffixArray(text).longest_common_substring_sample(), including the order of the keys.  Reads are
+    short, so instead of building a suffix array by prefix doubling the suffixes are sliced and sorted directly, which
+    is done in C.  Neighbouring suffixes are only compared base by base when they beat the longest repeat so far.
+    :param text:
+    :return: {substring: [start1, start2, ...]}
+    """
+    size = len(text)
+    if size < 2:
+        return {}
+
+    suffixes = sorted(text[i:] for i in range(size))
+
+    maxlen = 0
+    for left, right in zip(suffixes, suffixes[1:]):
+        if left[:maxlen + 1] == right[:maxlen + 1]:
+            maxlen += 1
+            shortest = min(len(left), len(right))
+            while maxlen < shortest and left[maxlen] == right[maxlen]:
+                maxlen += 1
+
+    # Neighbours that share the first maxlen bases are occurrences of the same repeat.  The start of a suffix is
+    # size - len(suffix).
+    prefixes = list(map(itemgetter(slice(0, maxlen)), suffixes))
+    result = {}
+    for i in compress(range(1, size), map(eq, prefixes, prefixes[1:])):
+        substring = prefixes[i]
+        if substring not in result:
+            result[substring] = [size - len(suffixes[i - 1])]
+        result[substring].append(size - len(suffixes[i]))
+    return dict((k, sorted(v)) for k, v in result.items())
+
+
 class GetSeq:
     """
     Retrieve the sequence we need to search through, utilizing the pysam package.
@@ -250,16 +288,32 @@ class Sequence:
     """
     Dissecting pysam objects for necessary info, but will also include additional necessary structures on the sequence level.
     """
-    def __init__(self, seq):
+    def __init__(self, seq, repeat_cache=None):
         self.gnmic_seq = seq.seq
         self.chrom = seq.rname
         self.cigar = seq.cigar
         self.soft_clip = self._soft_clip_amt()
         self.pos = seq.pos
-        self.itd_arr = SuffixArray(self.gnmic_seq)
-        self.curr_long = self.itd_arr.longest_common_substring_sample()
+        self.curr_long = self._longest_repeats(repeat_cache)
         self.dup_idx = self._dup_idx()
 
+    def _longest_repeats(self, repeat_cache, max_cache_size=100000):
+        """
+        Amplicon reads are often identical, so the repeats found in each read sequence are kept in the cache shared
+        by all reads in the collection.  The results are only read, never modified, so they can be shared.
+        :return:
+        """
+        if repeat_cache is None:
+            return longest_repeats(self.gnmic_seq)
+
+        curr_long = repeat_cache.get(self.gnmic_seq)
+        if curr_long is None:
+            if len(repeat_cache) >= max_cache_size:
+                repeat_cache.clear()
+            curr_long = longest_repeats(self.gnmic_seq)
+            repeat_cache[self.gnmic_seq] = curr_long
+        return curr_long
+
     def _dup_idx(self):
         dup_idx = {}
         for k, v in self.curr_long.items():
@@ -278,6 +332,19 @@ class Sequence:
         return 0
 
 
+class MergedRead(object):
+    """
+    The fields of a merged read pair that a Sequence object needs, taken from the template record without copying it.
+    """
+    __slots__ = ('seq', 'rname', 'cigar', 'pos')
+
+    def __init__(self, seq, rname, cigar, pos):
+        self.seq = seq
+        self.rname = rname
+        self.cigar = cigar
+        self.pos = pos
+
+
 class SequenceCollection:
     """
     Structures resulting from operations on multiple Sequence objects.
@@ -290,10 +357,12 @@ class SequenceCollection:
         self.max_pos = {}
         self.refseq = refseq
         self.flt3 = refseq.my_seq
+        # Repeats found in each distinct read sequence
+        self.repeat_cache = {}
 
         if not paired:
             for line in self.samfile.fetch(reference=refseq.coords[0], start=refseq.coords[1], end=refseq.coords[2]):
-                self.this_seq = Sequence(line)
+                self.this_seq = Sequence(line, self.repeat_cache)
                 self._seq_diffs(self.this_seq)
         else:
             for read1, read2 in self.read_pair_generator():
@@ -306,7 +375,7 @@ class SequenceCollection:
                         else:
                             # use r1 as template
                             new_read = self._record_modify(combine[0], read1)
-                        self.this_seq = Sequence(new_read)
+                        self.this_seq = Sequence(new_read, self.repeat_cache)
                         self._seq_diffs(self.this_seq)
                     else:
                         pass
@@ -320,24 +389,44 @@ class SequenceCollection:
 
     def _record_modify(self, new_seq, rec):
         """
-        Record should be modified to then be passed to a Sequence object.
+        Create the read that is passed to a Sequence object, using the merged sequence and the template record.
         :return:
         """
-        new_rec = deepcopy(rec)
-        new_rec.seq = new_seq
-        return new_rec
+        return MergedRead(new_seq, rec.rname, rec.cigar, rec.pos)
 
-    def _combine_overlap_reads(self, r1, r2, o=20):
+    def _combine_overlap_reads(self, r1, r2, o=20, max_mismatch_rate=0.05):
         """
-        Look for the similar portion, then combine.
-        :return:
+        Look for the similar portion, then combine.  Bases from the read that starts later are used where the reads
+        overlap, and the end of the other read is kept if it goes past the end of that read.
+        :return: (combined sequence, True if r2 starts first) or None
         """
-        if r1[:o] in r2:
-            mtch_pnt = r2.index(r1[:o])
-            return (r2[:mtch_pnt] + r1, True)
-        elif r2[:o] in r1:
-            mtch_pnt = r1.index(r2[:o])
-            return (r1[:mtch_pnt] + r2, False)
+        mtch_pnt = self._find_overlap(r1, r2, o, max_mismatch_rate)
+        if mtch_pnt is not None:
+            return (r2[:mtch_pnt] + r1 + r2[mtch_pnt + len(r1):], True)
+        mtch_pnt = self._find_overlap(r2, r1, o, max_mismatch_rate)
+        if mtch_pnt is not None:
+            return (r1[:mtch_pnt] + r2 + r1[mtch_pnt + len(r2):], False)
+        return None
+
+    def _find_overlap(self, later, earlier, o, max_mismatch_rate):
+        """
+        Find where the read that starts later begins in the read that starts earlier.  Seeds of o bases from the later
+        read are looked up in the earlier read, and the overlap each one implies is accepted if it has few enough
+        mismatches.  A sequencing error in the first o bases doesn't stop the reads from being merged.
+        :return: offset in the earlier read, or None
+        """
+        for seed_start in range(0, len(later) - o + 1, o):
+            seed = later[seed_start:seed_start + o]
+            idx = earlier.find(seed, seed_start)
+            while idx != -1:
+                offset = idx - seed_start
+                overlap = min(len(earlier) - offset, len(later))
+                if later[:overlap] == earlier[offset:offset + overlap]:
+                    return offset
+                mismatches = sum(1 for a, b in zip(later[:overlap], earlier[offset:offset + overlap]) if a != b)
+                if mismatches <= overlap * max_mismatch_rate:
+                    return offset
+                idx = earlier.find(seed, idx + 1)
         return None
 
     def read_pair_generator(self):
@@ -362,19 +451,36 @@ class SequenceCollection:
                     yield read_dict[qname][0], read
                 del read_dict[qname]
 
-    def _sam_seq_count(self, seq_to_find, seq_to_excl):
+    def _sam_seq_counts(self, probes):
         """
-        Move through the BAM file and count records when they contain a sequence we are looking for.
-        :return:
+        Move through the BAM file once and, for each (seq_to_find, seq_to_excl) pair in probes, count records when
+        they contain the sequence we are looking for but not the one to exclude.  Each record is broken in to a set
+        of its k-mers, one k for each probe length, so every probe is matched with a set lookup rather than its own
+        substring scan.
+        :return: counts in the same order as probes
         """
+        counts = [0] * len(probes)
+        if not probes:
+            return counts
+
+        lengths = set(len(seq) for probe in probes for seq in probe)
+        find_idx = defaultdict(list)
+        for idx, (seq_to_find, seq_to_excl) in enumerate(probes):
+            find_idx[seq_to_find].append((idx, seq_to_excl))
+
         samfile = pysam.AlignmentFile(self.filename, 'rb')
-        match_cnt = 0
         for line in samfile.fetch(reference=self.refseq.coords[0], start=self.refseq.coords[1], end=self.refseq.coords[2]):
-            if line.seq:
-                if seq_to_find in line.seq and seq_to_excl not in line.seq:
-                    match_cnt += 1
+            seq = line.seq
+            if seq:
+                kmers = set()
+                for k in lengths:
+                    kmers.update(seq[i:i + k] for i in range(len(seq) - k + 1))
+                for seq_to_find in kmers.intersection(find_idx):
+                    for idx, seq_to_excl in find_idx[seq_to_find]:
+                        if seq_to_excl not in kmers:
+                            counts[idx] += 1
         samfile.close()
-        return match_cnt
+        return counts
 
     def _ref_seq_create(self, pos, buffer=10):
         """
@@ -405,9 +511,12 @@ class SequenceCollection:
          itd_list looks like:
          35: ['GGAATGGAATGGAATGGAATGGAATGGAA', 'GGAATGGAATGGAATGGAATGGAATGGAA', 'GGAATGGAATGGAATGGAATGGAATGGAA', 'GGAATGGAATGGAATGGAATGGAATGGAA']
         TODO: This function is a disaster.
+        Reference support for all the calls is counted together in one pass through the BAM file, after the calls
+        have been found.
         :return:
         """
         sample_data = []
+        calls = []
         for k, v in self.itd_list.items():
             in_ref_cnt = 0
             total_cnt = len(v)
@@ -435,19 +544,26 @@ class SequenceCollection:
                 # for the VCF, need to get the base that precedes the insertion
                 padding_base = self.refseq.fasta.fetch(reference=chrom, start=start_coord - 2, end=start_coord - 1)
                 itd_cnt = len(self.itd_list[diff])
-                if paired:
-                    ref_cnt = (self._sam_seq_count(self._ref_seq_create(stop_coord), self._dup_junc_seq_create(this_seq))) / 2
-                else:
-                    ref_cnt = self._sam_seq_count(self._ref_seq_create(stop_coord), self._dup_junc_seq_create(this_seq))
                 # TODO: Parameter
                 if len(set(self.itd_list[diff])) > 10 or max([len(x) for x in self.itd_list[diff]]) > 30:
-                    to_write = [chrom, str(start_coord), str(stop_coord), str(diff), str(itd_cnt), str(ref_cnt),
-                                    "{0:0.3f}".format(self._calc_vaf(ref_cnt, itd_cnt)), this_seq]
-                    self.handle_out.write('\t'.join(to_write))
-                    self.handle_out.write('\n')
-                    sample_data.append(ItdCallVcf(chrom, str(start_coord), str(stop_coord), str(diff), itd_cnt,
-                                               ref_cnt, "{0:0.3f}".format(self._calc_vaf(ref_cnt, itd_cnt)),
-                                               this_seq, padding_base))
+                    calls.append((chrom, start_coord, stop_coord, diff, itd_cnt, this_seq, padding_base))
+
+        probes = [(self._ref_seq_create(stop_coord), self._dup_junc_seq_create(this_seq))
+                  for chrom, start_coord, stop_coord, diff, itd_cnt, this_seq, padding_base in calls]
+        counts = self._sam_seq_counts(probes)
+
+        for (chrom, start_coord, stop_coord, diff, itd_cnt, this_seq, padding_base), count in zip(calls, counts):
+            if paired:
+                ref_cnt = count / 2
+            else:
+                ref_cnt = count
+            to_write = [chrom, str(start_coord), str(stop_coord), str(diff), str(itd_cnt), str(ref_cnt),
+                            "{0:0.3f}".format(self._calc_vaf(ref_cnt, itd_cnt)), this_seq]
+            self.handle_out.write('\t'.join(to_write))
+            self.handle_out.write('\n')
+            sample_data.append(ItdCallVcf(chrom, str(start_coord), str(stop_coord), str(diff), itd_cnt,
+                                       ref_cnt, "{0:0.3f}".format(self._calc_vaf(ref_cnt, itd_cnt)),
+                                       this_seq, padding_base))
         return sample_data
 
     def _seq_diffs(self, seq):
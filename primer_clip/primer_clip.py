@@ -2,15 +2,19 @@
 
 # DESCRIPTION: Clip primers based on a BED file.
 # USAGE: primer_clip.py --bed <BED> --bamfile <SAM> --outfile <OUTPUT SAM>
+#        primer_clip.py --bed <BED> --bamfile <BAM> --outfile <OUTPUT BAM> --bam --processes 8
 # CODED BY: John Letaw
 
 from __future__ import print_function
 import bed
 import argparse
+from bisect import bisect_left
+from collections import deque
+import multiprocessing
 import pysam
 import re
 
-VERSION = '0.1.6'
+VERSION = '0.1.8'
 
 
 def supply_args():
@@ -23,6 +27,8 @@ def supply_args():
     parser.add_argument('--bamfile', help='Input SAM file.')
     parser.add_argument('--outfile', help='Output SAM file.')
     parser.add_argument('--v4', action='store_true', default=False, help='Use qiaseq v4 type bed input.')
+    parser.add_argument('--bam', action='store_true', default=False, help='Input is a query name sorted BAM and output is written as BAM.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes used to clip read pairs.')
     parser.add_argument('--version', action='version', version='%(prog)s ' + VERSION)
     args = parser.parse_args()
     return args
@@ -44,6 +50,30 @@ def get_pcoords(start, stop, strand):
 #    return range(pstart, pstop)
 
 
+def index_primer_ends(primer_coords):
+    """
+    Sort and de-duplicate the primer ends for each chromosome and strand, so
+    they can be searched with find_primer_ends().
+    {CHROM: {STRAND: [a, b, c, ...]}}
+    :return:
+    """
+    primer_index = {}
+    for chrom in primer_coords:
+        primer_index[chrom] = {}
+        for strand in primer_coords[chrom]:
+            primer_index[chrom][strand] = sorted(set(primer_coords[chrom][strand]))
+    return primer_index
+
+
+def find_primer_ends(primer_ends, start, stop):
+    """
+    Return the sorted primer ends that are in range(start, stop).  This is a
+    bisect of the index rather than building and intersecting sets.
+    :return:
+    """
+    return primer_ends[bisect_left(primer_ends, start):bisect_left(primer_ends, stop)]
+
+
 def soft_clip_offset(entry):
     """
     Tell me if there are soft-clipped bases in the CIGAR string.
@@ -266,127 +296,249 @@ def fix_cigar(cigar):
     return new_cigar
 
 
+def val_pairs(samfile, primer_coords, write_header):
+    """
+    Walk through the query name sorted SAM lines and yield each read 1 and
+    read 2 that should be considered for clipping, as lists of SAM fields.
+    Header lines are passed to write_header.  Only the flags, chromosome and
+    read names are looked at here, so this is cheap compared to clip_pair().
+    :param samfile:
+    :param primer_coords:
+    :param write_header:
+    :return:
+    """
+    samfile = iter(samfile)
+    mismatch = False
+
+    i = 0
+    for entry in samfile:
+        if i % 1000000 == 0:
+                print(str(i) + " read pairs processed.")
+        if entry.startswith('@'):
+            write_header(entry)
+        else:
+            if not mismatch:
+                line1 = entry.rstrip('\n').split('\t')
+                line1, samfile = val_r1(line1, primer_coords, samfile)
+                id1 = line1[0]
+
+                try:
+                    entry = next(samfile)
+                except StopIteration:
+                    break
+
+                line2 = entry.rstrip('\n').split('\t')
+                line2, samfile = val_r2(line2, primer_coords, samfile)
+                id2 = line2[0]
+
+                if id1 != id2:
+                    mismatch = True
+                    line1 = line2
+                    continue
+            else:
+                line1, samfile = val_r1(line1, primer_coords, samfile)
+                line2 = entry.rstrip('\n').split('\t')
+                line2, samfile = val_r2(line2, primer_coords, samfile)
+
+                mismatch = False
+
+            if line1[0] != line2[0]:
+                print(line1)
+                print(line2)
+                print("Reads 1 and 2 don't match, ouch!")
+                continue
+
+            yield line1, line2
+
+        i += 1
+
+
+def clip_pair(line1, line2, primer_coords):
+    """
+    Clip the primer from a read pair.  Returns the two SAM lines that should
+    be written, or nothing if the pair is dropped.
+    :param line1:
+    :param line2:
+    :param primer_coords:
+    :return:
+    """
+    to_remove = 0
+    clipped = []
+
+    pos = int(line1[3])
+    cigar = change_cigar_format(line1[5])
+    pnext = int(line1[7])
+    tlen = int(line1[8])
+    sco = soft_clip_offset(cigar)
+
+    l2_pos = int(line2[3])
+    l2_cigar = change_cigar_format(line2[5])
+
+    flag = int(line1[1])
+    chrom = str(line1[2])
+
+    # If first read is mapped to fwd strand.
+    if not (flag & 0x10):
+        primer_choices = find_primer_ends(primer_coords[chrom]['1'], pos + sco, pos + tlen)
+
+        if primer_choices:
+            for coord in primer_choices:
+                check_remove = coord - pos
+                if check_remove < 50 and check_remove >= 5:
+                    to_remove = check_remove
+            cigar = cigar_adj(to_remove, cigar)
+            line2_cigar_adj = to_remove - (l2_pos - pos)
+            line1[3] = str(int(line1[3]) + to_remove)
+            if line2_cigar_adj <= to_remove and line2_cigar_adj > 0:
+                l2_cigar = cigar_adj(line2_cigar_adj, l2_cigar)
+                line2[3] = str(int(line2[3]) + line2_cigar_adj)
+                line1[7] = line2[3]
+
+            line2[7] = line1[3]
+
+            line1[5] = cigar_for_writing(fix_cigar(cigar))
+            line2[5] = cigar_for_writing(fix_cigar(l2_cigar))
+            if check_len(cigar) and check_len(l2_cigar):
+                clipped.append('\t'.join(line1))
+                clipped.append('\t'.join(line2))
+    else:
+        try:
+            primer_choices = find_primer_ends(primer_coords[chrom]['0'], pos, (pnext - tlen) - sco)
+        except KeyError:
+            primer_choices = None
+        if primer_choices:
+             for coord in primer_choices:
+                 check_remove = (pnext - tlen) - coord
+                 if check_remove < 50 and check_remove >= 5:
+                     to_remove = check_remove
+                 else:
+                     to_remove = 0
+             if to_remove != 0:
+                 cigar = cigar_adj(to_remove, cigar[::-1])
+                 line2_cigar_adj = to_remove - (pos - l2_pos)
+                 if line2_cigar_adj <= to_remove and line2_cigar_adj > 0:
+                     l2_cigar = cigar_adj(line2_cigar_adj, l2_cigar[::-1])
+                     line2[5] = cigar_for_writing(fix_cigar(l2_cigar[::-1]))
+                 else:
+                     line2[5] = cigar_for_writing(fix_cigar(l2_cigar))
+                 line1[5] = cigar_for_writing(fix_cigar(cigar[::-1]))
+                 if check_len(cigar) and check_len(l2_cigar):
+                     clipped.append('\t'.join(line1))
+                     clipped.append('\t'.join(line2))
+
+    return clipped
+
+
+# Primer ends used by clip_chunk() in the worker processes.
+_worker_primer_coords = None
+
+
+def init_worker(primer_coords):
+    """
+    Give each worker process its own copy of the primer ends.
+    :param primer_coords:
+    :return:
+    """
+    global _worker_primer_coords
+    _worker_primer_coords = primer_coords
+
+
+def clip_chunk(pairs):
+    """
+    Clip a chunk of read pairs in a worker process.
+    :param pairs:
+    :return:
+    """
+    clipped = []
+    for line1, line2 in pairs:
+        clipped.extend(clip_pair(line1, line2, _worker_primer_coords))
+    return clipped
+
+
+def chunk_pairs(pairs, chunk_size):
+    """
+    Group the read pairs in to lists of chunk_size pairs.  Both reads of a
+    pair are always in the same chunk.
+    :param pairs:
+    :param chunk_size:
+    :return:
+    """
+    chunk = []
+    for pair in pairs:
+        chunk.append(pair)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def clip_in_processes(pairs, primer_coords, processes, write, chunk_size=10000):
+    """
+    Clip chunks of read pairs across a pool of processes.  Chunks are written
+    in the order they were read, so the output is identical to clipping in a
+    single process.  Only a few chunks per process are held in memory.
+    :param pairs:
+    :param primer_coords:
+    :param processes:
+    :param write:
+    :param chunk_size:
+    :return:
+    """
+    pool = multiprocessing.Pool(processes, init_worker, (primer_coords,))
+    pending = deque()
+    try:
+        for chunk in chunk_pairs(pairs, chunk_size):
+            pending.append(pool.apply_async(clip_chunk, (chunk,)))
+            if len(pending) >= processes * 2:
+                for line in pending.popleft().get():
+                    write(line)
+        while pending:
+            for line in pending.popleft().get():
+                write(line)
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    pool.join()
+
+
 def main():
     args = supply_args()
-    samfile = open(args.bamfile, 'r')
-    outfile = open(args.outfile, 'w')
     if args.v4:
         primer_coords = bed.ExtBedReader(args.bed, header=True, strand=5, pstart=6, pstop=7).get_v4_primer_ends()
     else:
         primer_coords = bed.ExtBedReader(args.bed, header=True, strand=5).get_primer_ends()
+    primer_coords = index_primer_ends(primer_coords)
 
-    mismatch = False
+    if args.bam:
+        # Records are clipped as SAM lines, the same as the SAM path, and
+        # converted back to BAM records when they are written.
+        samfile = pysam.AlignmentFile(args.bamfile, 'rb')
+        outfile = pysam.AlignmentFile(args.outfile, 'wb', template=samfile)
+        sam_lines = (entry.to_string() for entry in samfile)
 
-    i = 0
-    with samfile as sam:
-        for entry in sam:
-            if i % 1000000 == 0:
-                    print(str(i) + " read pairs processed.")
-            to_remove = 0
-            if entry.startswith('@'):
-                outfile.write(entry)
-            else:
-                if not mismatch:
-                    line1 = entry.rstrip('\n').split('\t')
-                    line1, samfile = val_r1(line1, primer_coords, samfile)
-                    id1 = line1[0]
-
-                    try:
-                        entry = next(samfile)
-                    except StopIteration:
-                        break
-
-                    line2 = entry.rstrip('\n').split('\t')
-                    line2, samfile = val_r2(line2, primer_coords, samfile)
-                    id2 = line2[0]
-
-                    if id1 != id2:
-                        mismatch = True
-                        line1 = line2
-                        continue
-                else:
-                    line1, samfile = val_r1(line1, primer_coords, samfile)
-                    line2 = entry.rstrip('\n').split('\t')
-                    line2, samfile = val_r2(line2, primer_coords, samfile)
+        def write(line):
+            outfile.write(pysam.AlignedSegment.fromstring(line, outfile.header))
+    else:
+        samfile = open(args.bamfile, 'r')
+        outfile = open(args.outfile, 'w')
+        sam_lines = samfile
 
-                    mismatch = False
+        def write(line):
+            outfile.write(line)
+            outfile.write('\n')
 
-                if line1[0] != line2[0]:
-                    print(line1)
-                    print(line2)
-                    print("Reads 1 and 2 don't match, ouch!")
-                    continue
+    pairs = val_pairs(sam_lines, primer_coords, outfile.write)
 
-                pos = int(line1[3])
-                cigar = change_cigar_format(line1[5])
-                pnext = int(line1[7])
-                tlen = int(line1[8])
-                sco = soft_clip_offset(cigar)
-
-                l2_pos = int(line2[3])
-                l2_cigar = change_cigar_format(line2[5])
-
-                flag = int(line1[1])
-                chrom = str(line1[2])
-
-                # If first read is mapped to fwd strand.
-                if not (flag & 0x10):
-                    seqloc = (chrom, range(pos + sco, pos + tlen))
-                    primer_choices = set(primer_coords[seqloc[0]][
-                                '1']).intersection(set(seqloc[1]))
-
-                    if primer_choices:
-                        for coord in primer_choices:
-                            check_remove = coord - pos
-                            if check_remove < 50 and check_remove >= 5:
-                                to_remove = check_remove
-                        cigar = cigar_adj(to_remove, cigar)
-                        line2_cigar_adj = to_remove - (l2_pos - pos)
-                        line1[3] = str(int(line1[3]) + to_remove)
-                        if line2_cigar_adj <= to_remove and line2_cigar_adj > 0:
-                            l2_cigar = cigar_adj(line2_cigar_adj, l2_cigar)
-                            line2[3] = str(int(line2[3]) + line2_cigar_adj)
-                            line1[7] = line2[3]
-
-                        line2[7] = line1[3]
-
-                        line1[5] = cigar_for_writing(fix_cigar(cigar))
-                        line2[5] = cigar_for_writing(fix_cigar(l2_cigar))
-                        if check_len(cigar) and check_len(l2_cigar):
-                            outfile.write('\t'.join(line1))
-                            outfile.write('\n')
-                            outfile.write('\t'.join(line2))
-                            outfile.write('\n')
-                else:
-                    seqloc = (chrom, range(pos, (pnext - tlen) - sco))
-                    try:
-                        primer_choices = set(primer_coords[seqloc[0]]['0']).intersection(set(seqloc[1]))
-                    except KeyError:
-                        primer_choices = None
-                    if primer_choices:
-                         for coord in primer_choices:
-                             check_remove = (pnext - tlen) - coord
-                             if check_remove < 50 and check_remove >= 5:
-                                 to_remove = check_remove
-                             else:
-                                 to_remove = 0
-                         if to_remove != 0:
-                             cigar = cigar_adj(to_remove, cigar[::-1])
-                             line2_cigar_adj = to_remove - (pos - l2_pos)
-                             if line2_cigar_adj <= to_remove and line2_cigar_adj > 0:
-                                 l2_cigar = cigar_adj(line2_cigar_adj, l2_cigar[::-1])
-                                 line2[5] = cigar_for_writing(fix_cigar(l2_cigar[::-1]))
-                             else:
-                                 line2[5] = cigar_for_writing(fix_cigar(l2_cigar))
-                             line1[5] = cigar_for_writing(fix_cigar(cigar[::-1]))
-                             if check_len(cigar) and check_len(l2_cigar):
-                                 outfile.write('\t'.join(line1))
-                                 outfile.write('\n')
-                                 outfile.write('\t'.join(line2))
-                                 outfile.write('\n')
-
-            i += 1
+    if args.processes > 1:
+        clip_in_processes(pairs, primer_coords, args.processes, write)
+    else:
+        for line1, line2 in pairs:
+            for line in clip_pair(line1, line2, primer_coords):
+                write(line)
 
+    samfile.close()
     outfile.close()
 
 
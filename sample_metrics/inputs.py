@@ -1,4 +1,6 @@
+from collections import Counter
 import csv
+import multiprocessing
 import os
 import pysam
 import vcfpy
@@ -36,17 +38,114 @@ class GatkCollectRnaSeqMetrics:
         raise ImportError("Can't find METRICS CLASS data from the input CollectRnaSeqMetrics file.")
 
 
+def read_bed_regions(bedfile):
+    """
+    Read a BED file the way samtools view -L does.  Lines are split on whitespace, blank and # lines are skipped, as
+    are browser and track lines.  A line with only a chromosome and a position is a single 1-based position.
+    :return: {chrom: [(start, end), ...]}, 0-based half-open, sorted and with overlapping or touching regions merged
+    """
+    regions = {}
+    with open(bedfile, 'r') as myfile:
+        for line in myfile:
+            fields = line.split()
+            if not fields or fields[0].startswith('#'):
+                continue
+            try:
+                start = int(fields[1])
+            except (IndexError, ValueError):
+                if fields[0] in ('browser', 'track'):
+                    continue
+                raise ValueError("Invalid line in BED file {0}: {1}".format(bedfile, line.rstrip('\n')))
+            try:
+                end = int(fields[2])
+            except (IndexError, ValueError):
+                end = start
+                start -= 1
+            if end < start:
+                raise ValueError("Invalid region in BED file {0}: {1}".format(bedfile, line.rstrip('\n')))
+            regions.setdefault(fields[0], []).append((start, end))
+
+    for chrom in regions:
+        merged = []
+        for start, end in sorted(regions[chrom]):
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        regions[chrom] = merged
+
+    return regions
+
+
+def count_contig_reads(filename, index_filename, contig, regions):
+    """
+    Count the reads on one contig that overlap any of the regions, using the BAM index to fetch only the regions.
+    A read overlaps a region if it starts before the region ends and ends after the region starts, where an
+    unmapped or zero length read is one base long, as in samtools.  The regions are sorted and do not touch, so a
+    read found in more than one region is only counted in the first.
+    :return:
+    """
+    count = 0
+    with pysam.AlignmentFile(filename, 'rb', index_filename=index_filename) as bam:
+        prev_end = None
+        for start, end in regions:
+            for read in bam.fetch(contig, start, max(end, start + 1)):
+                read_start = read.reference_start
+                read_end = read.reference_end
+                if not read_end or read_end <= read_start:
+                    read_end = read_start + 1
+                if read_start < end and read_end > start and (prev_end is None or read_start >= prev_end):
+                    count += 1
+            prev_end = end
+    return count
+
+
+def _count_contig_reads_star(args):
+    """
+    Unpack arguments for count_contig_reads in a process pool.
+    """
+    return count_contig_reads(*args)
+
+
 class SamReader:
     """
     Read a BAM file, get stuff we need from it, like total counts of all reads.
+    The count of reads on target is made from the BAM index, one contig at a time, across a pool of processes.  If
+    the BAM can't be read this way, fall back to samtools view -L.
     """
-    def __init__(self, filename, bedfile):
+    def __init__(self, filename, bedfile, processes=1, index_filename=None):
         self.filename = filename
         self.bedfile = bedfile
+        self.processes = processes
+        self.index_filename = index_filename
         try:
-            self.count = self._pysam_get_target_count()
+            self.count = self._indexed_get_target_count()
         except:
-            self.count = self._run_cmd(self._get_target_count_cmd())
+            try:
+                self.count = self._pysam_get_target_count()
+            except:
+                self.count = self._run_cmd(self._get_target_count_cmd())
+
+    def _indexed_get_target_count(self):
+        """
+        Count the reads overlapping the BED regions, which should match samtools view -L -c.
+        :return:
+        """
+        regions = read_bed_regions(self.bedfile)
+        with pysam.AlignmentFile(self.filename, 'rb', index_filename=self.index_filename) as bam:
+            if not bam.has_index():
+                raise ValueError("No index found for {0}".format(self.filename))
+            contigs = [contig for contig in bam.references if contig in regions]
+
+        jobs = [(self.filename, self.index_filename, contig, regions[contig]) for contig in contigs]
+        if self.processes > 1 and len(jobs) > 1:
+            pool = multiprocessing.Pool(min(self.processes, len(jobs)))
+            try:
+                return sum(pool.imap_unordered(_count_contig_reads_star, jobs))
+            finally:
+                pool.close()
+                pool.join()
+        return sum(_count_contig_reads_star(job) for job in jobs)
 
     @staticmethod
     def _run_cmd(cmd):
@@ -138,37 +237,40 @@ class PerLocusRead:
     Ingest a GATK DepthofCoverage per locus type file and prepare.
     Locus	Total_Depth	Average_Depth_sample	Depth_for_DNA-15-03359-1
     1:2496455	0	0.00	0
+    The file is read once, keeping the number of loci seen at each depth rather than the depth of every locus, so
+    memory does not grow with the size of the target.
     """
 
     def __init__(self, infile):
-        self.infile = csv.DictReader(open(infile, 'r'), delimiter='\t')
-        self.headers = self.infile.fieldnames
-        self.perlocus = self._perlocus_fill()
+        with open(infile, 'r') as handle:
+            reader = csv.reader(handle, delimiter='\t')
+            self.headers = next(reader, None)
+            self.depth_counts = self._depth_counts_fill(reader)
+        self.loci = sum(self.depth_counts.values())
 
-    def __div__(self, other):
-
-        div_perlocus = {}
-        for coord in self.perlocus:
-            try:
-                div_perlocus[coord] = float(self.perlocus[coord]) / float(
-                    other.perlocus[coord])
-            except ZeroDivisionError:
-                div_perlocus[coord] = 0.0
+    def _depth_counts_fill(self, reader):
+        """
+        Count the loci at each Total_Depth value.
+        :return:
+        """
+        depth_counts = Counter()
+        if not self.headers:
+            return depth_counts
+        depth_idx = self.headers.index('Total_Depth')
+        for entry in reader:
+            depth_counts[int(entry[depth_idx])] += 1
 
-        return div_perlocus
+        return depth_counts
 
-    def _perlocus_fill(self):
+    def uniformity(self, average_depth):
         """
-        Put information from per locus file in to dict of dicts.
+        Percentage of loci with a depth greater than 0.2 times the average depth.
+        :param average_depth:
         :return:
         """
-        perlocus = {}
-        for entry in self.infile:
-            chrom = entry['Locus'].split(':')[0]
-            coord = entry['Locus'].split(':')[1]
-            perlocus[(chrom, coord)] = entry['Total_Depth']
-
-        return perlocus
+        cutoff = float(average_depth) * 0.2
+        above = sum(count for depth, count in self.depth_counts.items() if depth > cutoff)
+        return float(above / self.loci * 100)
 
 
 class ProbeQcRead:
@@ -2,6 +2,12 @@
 Create sample level metrics to be passed to the CGD.  Metrics are passed as a json dump.
 
 VERSION HISTORY
+0.9.4
+    Only parse the input files needed by the workflow's metrics, unless outfile_txt is requested
+0.9.3
+    Count primer reads from the BAM index across a process pool, instead of a full samtools view -L scan
+0.9.2
+    Read the GATK per locus file in one pass, keeping counts of loci per depth instead of every locus
 0.9.1
     Update to allow for case when picard_summary and picard_summary_umi are None
 0.9.0
@@ -39,13 +45,14 @@ VERSION HISTORY
 """
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 import json
 # User libraries
 from inputs import (ProbeQcRead, PerLocusRead, AlignSummaryMetrics, GatkDepthOfCoverageRead, GatkCountReads,
                     MsiSensor, SamReader, GatkCollectRnaSeqMetrics)
 from inputs import FastQcRead
 
-VERSION = '0.9.1'
+VERSION = '0.9.4'
 
 
 def supply_args():
@@ -55,34 +62,36 @@ def supply_args():
     """
     parser = argparse.ArgumentParser(description='')
     # Input files that will be parsed for data.
-    parser.add_argument('--probeqc_after', required=False, type=ProbeQcRead,
+    parser.add_argument('--probeqc_after', required=False,
                         help='Probe coverage QC after UMI deduplication metrics.')
-    parser.add_argument('--probeqc_before', required=False, type=ProbeQcRead,
+    parser.add_argument('--probeqc_before', required=False,
                         help='Probe coverage QC before UMI deduplication metrics.')
 
-    parser.add_argument('--fastqc_r1', type=FastQcRead, help='FastQC stats for read 1.')
-    parser.add_argument('--fastqc_r2', type=FastQcRead, help='FastQC stats for read 2.')
+    parser.add_argument('--fastqc_r1', help='FastQC stats for read 1.')
+    parser.add_argument('--fastqc_r2', help='FastQC stats for read 2.')
 
-    parser.add_argument('--picard_summary', type=AlignSummaryMetrics,
+    parser.add_argument('--picard_summary',
                         help='Picard alignment summary metrics file.')
-    parser.add_argument('--picard_summary_umi', type=AlignSummaryMetrics,
+    parser.add_argument('--picard_summary_umi',
                         help='Picard alignment summary metrics file taken after umi deduplication.')
 
-    parser.add_argument('--gatk_depth_cov_prop', type=GatkDepthOfCoverageRead,
+    parser.add_argument('--gatk_depth_cov_prop',
                         help='GATK DepthOfCoverage file.')
-    parser.add_argument('--gatk_depth_cov_cnts', type=PerLocusRead,
+    parser.add_argument('--gatk_depth_cov_cnts',
                         help='GATK DepthOfCoverage locus file.')
-    parser.add_argument('--gatk_coll_rnaseq_mets', type=GatkCollectRnaSeqMetrics,
+    parser.add_argument('--gatk_coll_rnaseq_mets',
                         help='GATK CollectRnaSeqMetrics file.')
-    parser.add_argument('--gatk_count_reads_total', type=GatkCountReads,
+    parser.add_argument('--gatk_count_reads_total',
                         help='Output from GATK4 CountReads with total read count.')
-    parser.add_argument('--gatk_count_reads_ints', type=GatkCountReads,
+    parser.add_argument('--gatk_count_reads_ints',
                         help='Output from GATK4 CountReads with read count for reads overlapping targets.')
 
-    parser.add_argument('--msi', type=MsiSensor, help='TSV file containing MSI results')
+    parser.add_argument('--msi', help='TSV file containing MSI results')
 
     parser.add_argument('--primers_bam', help='BAM file to calculate primer reads on target.')
     parser.add_argument('--primers_bed', help='BED file containing primer coordinates only.')
+    parser.add_argument('--primers_bai', help='Index of primers_bam, if it is not next to the BAM.')
+    parser.add_argument('--processes', type=int, default=1, help='Number of processes used to count primer reads.')
 
     parser.add_argument('--blia_pre', help='JSON from Ding correlation subtyping, pre-normalization.')
     parser.add_argument('--blia_post', help='JSON from Ding correlation subtyping, post-normalization.')
@@ -127,65 +136,67 @@ class RawMetricCollector:
     msi = from MSIsensor, TSV output file
     """
     def __init__(self, args):
-        if args.gatk_count_reads_total:
-            self.gatk_cr_total = args.gatk_count_reads_total.count
-            self.gatk_cr_ints = args.gatk_count_reads_ints.count
+        inputs = self._load_inputs(args)
+
+        if inputs.get('gatk_count_reads_total') and inputs.get('gatk_count_reads_ints'):
+            self.gatk_cr_total = inputs['gatk_count_reads_total'].count
+            self.gatk_cr_ints = inputs['gatk_count_reads_ints'].count
         else:
             self.gatk_cr_total = None
             self.gatk_cr_ints = None
 
-        if args.msi:
-            self.msi = args.msi.msi
+        if inputs.get('msi'):
+            self.msi = inputs['msi'].msi
         else:
             self.msi = None
 
-        if args.picard_summary:
-            self.picard_summary = args.picard_summary.metrics
+        if inputs.get('picard_summary'):
+            self.picard_summary = inputs['picard_summary'].metrics
         else:
             self.picard_summary = None
 
-        if args.picard_summary_umi:
-            self.picard_summary_umi = args.picard_summary_umi.metrics
+        if inputs.get('picard_summary_umi'):
+            self.picard_summary_umi = inputs['picard_summary_umi'].metrics
         else:
             self.picard_summary_umi = None
 
-        if args.gatk_depth_cov_prop:
-            self.gatk_depth_cov_prop = args.gatk_depth_cov_prop
+        if inputs.get('gatk_depth_cov_prop'):
+            self.gatk_depth_cov_prop = inputs['gatk_depth_cov_prop']
         else:
             self.gatk_depth_cov_prop = None
 
-        if args.gatk_depth_cov_cnts:
-            self.gatk_depth_cov_cnts = args.gatk_depth_cov_cnts
+        if inputs.get('gatk_depth_cov_cnts'):
+            self.gatk_depth_cov_cnts = inputs['gatk_depth_cov_cnts']
         else:
             self.gatk_depth_cov_cnts = None
 
-        if args.gatk_coll_rnaseq_mets:
-            self.gatk_coll_rnaseq_mets = args.gatk_coll_rnaseq_mets.metrics
+        if inputs.get('gatk_coll_rnaseq_mets'):
+            self.gatk_coll_rnaseq_mets = inputs['gatk_coll_rnaseq_mets'].metrics
         else:
             self.gatk_coll_rnaseq_mets = None
 
-        if args.fastqc_r1:
-            self.gc_pct_1 = args.fastqc_r1.gc_pct
-            self.fastqc_seq_count = args.fastqc_r1.seq_cnt
+        if inputs.get('fastqc_r1'):
+            self.gc_pct_1 = inputs['fastqc_r1'].gc_pct
+            self.fastqc_seq_count = inputs['fastqc_r1'].seq_cnt
         else:
             self.gc_pct_1 = None
             self.fastqc_seq_count = None
 
-        if args.fastqc_r2:
-            self.gc_pct_2 = args.fastqc_r2.gc_pct
+        if inputs.get('fastqc_r2'):
+            self.gc_pct_2 = inputs['fastqc_r2'].gc_pct
         else:
             self.gc_pct_2 = None
 
-        if args.probeqc_before:
-            self.probeqc_before = args.probeqc_before.probeqc
-            self.probeqc_header_before = args.probeqc_before.headers
+        if inputs.get('probeqc_before'):
+            self.probeqc_before = inputs['probeqc_before'].probeqc
+            self.probeqc_header_before = inputs['probeqc_before'].headers
         else:
             self.probeqc_before = None
             self.probeqc_header_before = None
 
-        if args.probeqc_after:
-            self.probeqc_after = args.probeqc_after.probeqc
-            self.probeqc_header_after = args.probeqc_after.headers
+        if inputs.get('probeqc_after'):
+            self.probeqc_after = inputs['probeqc_after'].probeqc
+            self.probeqc_header_after = inputs['probeqc_after'].headers
         else:
             self.probeqc_after = None
             self.probeqc_header_after = None
@@ -195,36 +206,78 @@ class RawMetricCollector:
         else:
             self.wf = None
 
-        if args.primers_bam:
-            self.primers_bam = SamReader(args.primers_bam, args.primers_bed).count
+        if inputs.get('primers_bam'):
+            self.primers_bam = inputs['primers_bam'].count
         else:
             self.primers_bam = None
 
-        if args.blia_pre:
-            self.blia_pre = self._json_in([args.blia_pre])
+        if inputs.get('blia_pre'):
+            self.blia_pre = inputs['blia_pre']
         else:
             self.blia_pre = {'blia': None, 'blis': None, 'lar': None, 'mes': None}
 
-        if args.blia_post:
-            self.blia_post = self._json_in([args.blia_post])
+        if inputs.get('blia_post'):
+            self.blia_post = inputs['blia_post']
         else:
             self.blia_post = {'blia': None, 'blis': None, 'lar': None, 'mes': None}
 
-        if args.json_in:
-            self.json_mets = self._json_in(args.json_in)
+        if inputs.get('json_in'):
+            self.json_mets = inputs['json_in']
         else:
             self.json_mets = None
 
-        if args.dragen_metrics:
-            self.dragen_metrics = DragenMetrics(args.dragen_metrics)
+        if inputs.get('dragen_metrics'):
+            self.dragen_metrics = inputs['dragen_metrics']
         else:
             self.dragen_metrics = None
 
-        if args.dragen_qc:
-            self.dragen_qc = DragenQC(args.dragen_qc)
+        if inputs.get('dragen_qc'):
+            self.dragen_qc = inputs['dragen_qc']
         else:
             self.dragen_qc = None
 
+    def _load_inputs(self, args):
+        """
+        Parse the input files needed by the workflow's required metrics.  If the workflow is not known, or the text
+        output is requested, every input file given is parsed.  The parsers are pure Python and hold the GIL, so the
+        thread pool only overlaps their file reads; the saving comes from the inputs that are skipped.
+        :return: {argument name: parsed input}
+        """
+        loaders = {'probeqc_after': lambda: ProbeQcRead(args.probeqc_after),
+                   'probeqc_before': lambda: ProbeQcRead(args.probeqc_before),
+                   'fastqc_r1': lambda: FastQcRead(args.fastqc_r1),
+                   'fastqc_r2': lambda: FastQcRead(args.fastqc_r2),
+                   'picard_summary': lambda: AlignSummaryMetrics(args.picard_summary),
+                   'picard_summary_umi': lambda: AlignSummaryMetrics(args.picard_summary_umi),
+                   'gatk_depth_cov_prop': lambda: GatkDepthOfCoverageRead(args.gatk_depth_cov_prop),
+                   'gatk_depth_cov_cnts': lambda: PerLocusRead(args.gatk_depth_cov_cnts),
+                   'gatk_coll_rnaseq_mets': lambda: GatkCollectRnaSeqMetrics(args.gatk_coll_rnaseq_mets),
+                   'gatk_count_reads_total': lambda: GatkCountReads(args.gatk_count_reads_total),
+                   'gatk_count_reads_ints': lambda: GatkCountReads(args.gatk_count_reads_ints),
+                   'msi': lambda: MsiSensor(args.msi),
+                   'primers_bam': lambda: SamReader(args.primers_bam, args.primers_bed, args.processes,
+                                                    args.primers_bai),
+                   'blia_pre': lambda: self._json_in([args.blia_pre]),
+                   'blia_post': lambda: self._json_in([args.blia_post]),
+                   'json_in': lambda: self._json_in(args.json_in),
+                   'dragen_metrics': lambda: DragenMetrics(args.dragen_metrics),
+                   'dragen_qc': lambda: DragenQC(args.dragen_qc)}
+
+        # The text output reports every metric, not just the workflow's.
+        needed = None if args.outfile_txt else MetricPrep.req_inputs(args.workflow)
+        names = [name for name in loaders if getattr(args, name) and (needed is None or name in needed)]
+
+        # SamReader may fork a process pool, which isn't safe while other threads are running, so it is run on the
+        # main thread once the thread pool has shut down.
+        pooled = [name for name in names if name != 'primers_bam']
+        with ThreadPoolExecutor(max_workers=max(len(pooled), 1)) as executor:
+            futures = dict((name, executor.submit(loaders[name])) for name in pooled)
+        inputs = dict((name, future.result()) for name, future in futures.items())
+
+        if 'primers_bam' in names:
+            inputs['primers_bam'] = loaders['primers_bam']()
+        return inputs
+
     @staticmethod
     def _json_in(json_in):
         """
@@ -675,12 +728,86 @@ class MetricPrep(SampleMetrics):
         """
         try:
             # calculate using perlocusread instead to get decimal places
-            return "{:.1f}".format(float(sum(float(i) > float(average_depth)*0.2 for i in
-                                             list(self.gatk_depth_cov_cnts.perlocus.values())) /
-                                         len(list(self.gatk_depth_cov_cnts.perlocus.values())) * 100))
+            return "{:.1f}".format(self.gatk_depth_cov_cnts.uniformity(average_depth))
         except:
             return None
 
+    @classmethod
+    def req_inputs(cls, workflow):
+        """
+        Based on test name, list which input files are needed to calculate the metrics that should be provided.
+        Returns None if the workflow is not known, or one of its metrics is not in _metric_inputs(), in which case
+        every input should be read.
+        :return:
+        """
+        req = cls._req()
+        if workflow not in req:
+            return None
+        metric_inputs = cls._metric_inputs()
+        needed = set()
+        for metric in req[workflow]:
+            if metric not in metric_inputs:
+                return None
+            needed.update(metric_inputs[metric])
+        return needed
+
+    @staticmethod
+    def _metric_inputs():
+        """
+        The input files, by argument name, each metric in _req() is calculated from.
+        :return:
+        """
+        probeqc = ['probeqc_after']
+        json_in = ['json_in']
+        dragen = ['dragen_metrics']
+        return {'qthirty': probeqc,
+                'averageDepth': probeqc,
+                'depthTen': probeqc,
+                'depthTwenty': probeqc,
+                'depthFifty': probeqc,
+                'depthOneHundred': probeqc,
+                'depthTwoHundredFifty': probeqc,
+                'depthSevenHundred': probeqc,
+                'depthTwelveHundredFifty': probeqc,
+                'uniformity_of_coverage': ['probeqc_after', 'gatk_depth_cov_cnts'],
+                'percentUmi': ['picard_summary', 'picard_summary_umi'],
+                # percentOnTarget is worked out alongside percentOnTarget_after, and is dropped if that fails.
+                'percentOnTarget': ['picard_summary', 'picard_summary_umi', 'fastqc_r1'],
+                'total_on_target_transcripts': ['primers_bam'],
+                'total_on_target_transcripts_pct': ['primers_bam', 'picard_summary'],
+                'gc_pct_r1': ['fastqc_r1'],
+                'gc_pct_r2': ['fastqc_r2'],
+                'gatk_pct_mrna_bases': ['gatk_coll_rnaseq_mets'],
+                'gatk_pct_correct_strand_reads': ['gatk_coll_rnaseq_mets'],
+                'msi_sites': ['msi'],
+                'msi_somatic_sites': ['msi'],
+                'msi_pct': ['msi'],
+                'tmb': json_in,
+                'allele_balance': json_in,
+                'allele_balance_het_count': json_in,
+                'bio_sex_check': json_in,
+                'y_ploidy_check': json_in,
+                'homozygosity_flag': json_in,
+                'parentage_sites': json_in,
+                'parentage_disc': json_in,
+                'parentage_binom': json_in,
+                'parentage_confirmed': json_in,
+                'forced_calls_above': json_in,
+                'forced_calls_below': json_in,
+                'cnv_median_segment_mad_cn': json_in,
+                'q30_bases_pct': dragen,
+                'average_alignment_coverage_over_target_region': dragen,
+                'pct_of_target_region_with_coverage_10x_inf': dragen,
+                'pct_of_target_region_with_coverage_20x_inf': dragen,
+                'pct_of_target_region_with_coverage_50x_inf': dragen,
+                'pct_of_target_region_with_coverage_100x_inf': dragen,
+                'aligned_reads_in_target_region_pct': dragen,
+                'number_of_large_roh_gt_eq_3000000': dragen,
+                'ploidy_estimation': dragen,
+                'dragen_gc_pct_r1': ['dragen_metrics', 'dragen_qc'],
+                'dragen_gc_pct_r2': ['dragen_metrics', 'dragen_qc']
+                }
+
     @staticmethod
     def _req():
         """
@@ -12,7 +12,7 @@ import vcfreader
 import vcfwriter
 import argparse
 
-VERSION = '0.8.2'
+VERSION = '0.8.3'
 
 
 def supply_args():
@@ -299,6 +299,38 @@ def unphase(rec):
     return new_rec
 
 
+def split_records(myvcf, unphase_gts=False):
+    """
+    Read records from the VCF and yield the lines to write, with multiallelic records split.
+    :param myvcf:
+    :param unphase_gts:
+    :return:
+    """
+    info_number = myvcf.info_number
+    samples_number = myvcf.samples_number
+
+    for vrnt in myvcf.records():
+        if len(vrnt.ALT) > 1:
+            out_vcf_recs = []
+            split_vrnt = VcfRecDecomp(vrnt, info_number, samples_number).decomp_vrnts
+            for svrnt in split_vrnt:
+                if svrnt.samples:
+                    uniq_gts = set([x['GT'] for x in svrnt.samples])
+                    if uniq_gts != {'./.'}:
+                        out_vcf_recs.append(svrnt.print_rec())
+                else:
+                    out_vcf_recs.append(svrnt.print_rec())
+        else:
+            out_vcf_recs = [vrnt.print_rec()]
+
+        for entry in out_vcf_recs:
+            # If unphase option is set, remove all the pipe symbols.
+            if unphase_gts:
+                yield unphase(entry)
+            else:
+                yield entry
+
+
 def main():
     """
     # 1
@@ -340,36 +372,14 @@ def main():
 
     args = supply_args()
     myvcf = vcfreader.VcfReader(args.input)
-    info_number = myvcf.info_number
-    samples_number = myvcf.samples_number
     header_dict = {'id': 'MAsite',
                    'desc': 'Site was split from a multiallelic site.'}
-    out_vcf_recs = []
-
-    for vrnt in myvcf.myvcf.values():
-        if len(vrnt.ALT) > 1:
-            split_vrnt = VcfRecDecomp(vrnt, info_number, samples_number).decomp_vrnts
-            for svrnt in split_vrnt:
-                if svrnt.samples:
-                    uniq_gts = set([x['GT'] for x in svrnt.samples])
-                    if uniq_gts != {'./.'}:
-                        out_vcf_recs.append(svrnt.print_rec())
-                else:
-                    out_vcf_recs.append(svrnt.print_rec())
-        else:
-            out_vcf_recs.append(vrnt.print_rec())
 
     new_header = vcfwriter.VcfHeader(myvcf.raw_header)
     new_header.add_header_line('FILTER', header_dict)
-    # If unphase option is set, remove all the pipe symbols.
-    if args.unphase:
-        new_out = []
-        for entry in out_vcf_recs:
-            new_entry = unphase(entry)
-            new_out.append(new_entry)
-        vcfwriter.VcfWriter(args.output, new_out, new_header.raw_header).write_me()
-    else:
-        vcfwriter.VcfWriter(args.output, out_vcf_recs, new_header.raw_header).write_me()
+    # Records are split and written as they are read.
+    out_vcf_recs = split_records(myvcf, args.unphase)
+    vcfwriter.VcfWriter(args.output, out_vcf_recs, new_header.raw_header).write_me()
 
 
 if __name__ == "__main__":
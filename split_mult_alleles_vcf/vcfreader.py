@@ -1,5 +1,11 @@
 from collections import OrderedDict
+from copy import deepcopy
+import gzip
 import re
+try:
+    import pysam
+except ImportError:
+    pysam = None
 
 
 class VcfAllele(object):
@@ -98,6 +104,41 @@ class VcfSamples(object):
         return my_samps
 
 
+class _Unset(object):
+    """
+    Marks a VcfRecBase field that has not been parsed yet.  Copies of a record share the same marker.
+    """
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+_UNSET = _Unset()
+
+
+class _LazyField(object):
+    """
+    A VcfRecBase field that is parsed from the raw record the first time it is read, and can be replaced.
+    """
+    def __init__(self, slot, parse):
+        self.slot = slot
+        self.parse = parse
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        val = getattr(obj, self.slot)
+        if val is _UNSET:
+            val = self.parse(obj)
+            setattr(obj, self.slot, val)
+        return val
+
+    def __set__(self, obj, val):
+        setattr(obj, self.slot, val)
+
+
 class VcfRecBase(object):
     """
     Basic parsing of VCF records.
@@ -122,65 +163,70 @@ class VcfRecBase(object):
 
     """
 
+    __slots__ = ('rec', '_CHROM', '_POS', '_ID', '_REF', '_ALT', '_QUAL', '_FILTER', '_INFO', '_my_samps', '_uniq_key')
+
     def __init__(self, rec):
 
         self.rec = rec.rstrip('\n').split('\t')
-
+        # Fields are parsed from self.rec the first time they are used.
+        self._CHROM = _UNSET
+        self._POS = _UNSET
+        self._ID = _UNSET
+        self._REF = _UNSET
+        self._ALT = _UNSET
+        self._QUAL = _UNSET
+        self._FILTER = _UNSET
+        self._INFO = _UNSET
+        self._my_samps = _UNSET
+        self._uniq_key = _UNSET
+
+    def _parse_pos(self):
         try:
-            self.CHROM = str(self.rec[0])
+            return int(self.rec[1])
         except ValueError:
-            self.CHROM = None
+            return None
 
+    def _parse_my_samps(self):
         try:
-            self.POS = int(self.rec[1])
-        except ValueError:
-            self.POS = None
-
-        try:
-            self.ID = str(self.rec[2])
-        except ValueError:
-            self.ID = None
-
-        try:
-            self.REF = VcfAllele(str(self.rec[3]), is_alt=False).alleles
-        except ValueError:
-            self.REF = None
-
-        try:
-            self.ALT = VcfAllele(str(self.rec[4]), is_alt=True).alleles
-        except ValueError:
-            self.ALT = None
-
-        # QUAL may need to be manipulated, but it should be passed here as a string.
-        try:
-            self.QUAL = self.rec[5]
-        except ValueError:
-            self.QUAL = None
-
-        try:
-            self.FILTER = VcfFilt(self.rec[6]).filt
-        except ValueError:
-            self.FILTER = None
-
-        try:
-            self.INFO = VcfInfo(self.rec[7]).info
-        except ValueError:
-            self.INFO = None
-
-        try:
-            self.my_samps = VcfSamples(self.rec[8], self.rec[9:])
+            return VcfSamples(self.rec[8], self.rec[9:])
         except IndexError:
-            self.my_samps = None
+            return None
+
+    CHROM = _LazyField('_CHROM', lambda self: str(self.rec[0]))
+    POS = _LazyField('_POS', _parse_pos)
+    ID = _LazyField('_ID', lambda self: str(self.rec[2]))
+    REF = _LazyField('_REF', lambda self: VcfAllele(str(self.rec[3]), is_alt=False).alleles)
+    ALT = _LazyField('_ALT', lambda self: VcfAllele(str(self.rec[4]), is_alt=True).alleles)
+    # QUAL may need to be manipulated, but it should be passed here as a string.
+    QUAL = _LazyField('_QUAL', lambda self: self.rec[5])
+    FILTER = _LazyField('_FILTER', lambda self: VcfFilt(self.rec[6]).filt)
+    INFO = _LazyField('_INFO', lambda self: VcfInfo(self.rec[7]).info)
+    my_samps = _LazyField('_my_samps', _parse_my_samps)
+
+    @property
+    def FORMAT(self):
+        if self.my_samps:
+            return self.my_samps.frmt
+        return None
 
-        try:
-            self.FORMAT = self.my_samps.frmt
-            self.samples = self.my_samps.my_samps
-        except (ValueError, AttributeError):
-            self.FORMAT = None
-            self.samples = None
+    @property
+    def samples(self):
+        if self.my_samps:
+            return self.my_samps.my_samps
+        return None
+
+    # Use this as a key for the vcf dict.  The reader sets it when the record is read, before any edits.
+    uniq_key = _LazyField('_uniq_key', lambda self: (self.CHROM, self.POS, tuple(self.REF), tuple(self.ALT)))
 
-        # Use this as a key for the vcf dict.
-        self.uniq_key = (self.CHROM, self.POS, tuple(self.REF), tuple(self.ALT))
+    def __deepcopy__(self, memo):
+        """
+        Copy the record, keeping fields that have not been parsed yet unparsed.
+        """
+        new_rec = VcfRecBase.__new__(VcfRecBase)
+        new_rec.rec = list(self.rec)
+        for slot in VcfRecBase.__slots__[1:]:
+            setattr(new_rec, slot, deepcopy(getattr(self, slot), memo))
+        return new_rec
 
     def print_rec(self):
         """
@@ -307,15 +353,73 @@ class VcfHeader(object):
 class VcfReader(object):
     """
     Hold VCF records, manage access to them based in chrom, pos, ref, alt.
+    Only the header is read when the reader is created.  records() streams the records from the file, myvcf holds
+    all of them in memory the first time it is used, and get() looks up a single record, through the tabix or CSI
+    index when the VCF is bgzipped and indexed.
     """
 
     def __init__(self, filename):
         self.filename = filename
-        self.raw_header = []
-        self.myvcf = self._create_vcf()
+        self.raw_header = self._read_header()
         self.header = VcfHeader(self.raw_header)
         self.info_number = self.header.info_number
         self.samples_number = self.header.samples_number
+        self._myvcf = None
+        self._tabix = None
+
+    def _open(self):
+        """
+        Open the VCF, which may be gzipped or bgzipped.
+        :return:
+        """
+        if self.filename.endswith('.gz'):
+            return gzip.open(self.filename, 'rt')
+        return open(self.filename, 'r')
+
+    def _read_header(self):
+        """
+        Read the header lines at the top of the VCF.
+        :return:
+        """
+        raw_header = []
+        with self._open() as vcf:
+            for line in vcf:
+                if not line.startswith('#'):
+                    break
+                raw_header.append(line.rstrip('\n'))
+        return raw_header
+
+    def records(self):
+        """
+        Stream the records in the VCF.  Duplicate records share a position, so in a sorted VCF they are next to
+        each other, and only the keys at the current position are kept to find them.
+        :return:
+        """
+        seen = set()
+        curr_pos = None
+        with self._open() as vcf:
+            for line in vcf:
+                if not line.startswith('#'):
+                    vrnt = VcfRecBase(line)
+                    uniq_key = vrnt.uniq_key
+                    if uniq_key[:2] != curr_pos:
+                        curr_pos = uniq_key[:2]
+                        seen = set()
+                    if uniq_key not in seen:
+                        seen.add(uniq_key)
+                        yield vrnt
+                    else:
+                        print("Duplicate entry found: " + str(uniq_key) + " ... ignoring.")
+
+    @property
+    def myvcf(self):
+        """
+        All of the records, keyed by uniq_key.  Built the first time it is used.
+        :return:
+        """
+        if self._myvcf is None:
+            self._myvcf = self._create_vcf()
+        return self._myvcf
 
     def _create_vcf(self):
         """
@@ -323,7 +427,7 @@ class VcfReader(object):
         :return:
         """
         myvcf = OrderedDict()
-        with open(self.filename, 'r') as vcf:
+        with self._open() as vcf:
             for line in vcf:
                 if not line.startswith('#'):
                     vrnt = VcfRecBase(line)
@@ -331,6 +435,46 @@ class VcfReader(object):
                         myvcf[vrnt.uniq_key] = vrnt
                     else:
                         print("Duplicate entry found: " + str(vrnt.uniq_key) + " ... ignoring.")
-                else:
-                    self.raw_header.append(line.rstrip('\n'))
         return myvcf
+
+    def _get_tabix(self):
+        """
+        Open the tabix or CSI index of a bgzipped VCF, if there is one and pysam is installed.
+        :return:
+        """
+        if self._tabix is None:
+            self._tabix = False
+            if pysam and self.filename.endswith('.gz'):
+                try:
+                    self._tabix = pysam.TabixFile(self.filename)
+                except (IOError, OSError, ValueError):
+                    pass
+        return self._tabix
+
+    def get(self, uniq_key):
+        """
+        Find the record with the given (CHROM, POS, REF, ALT) key, or None.  Uses the index if there is one,
+        otherwise myvcf.
+        :return:
+        """
+        tabix = self._get_tabix()
+        if not tabix:
+            return self.myvcf.get(uniq_key)
+
+        chrom, pos = uniq_key[:2]
+        if chrom not in tabix.contigs:
+            return None
+        for line in tabix.fetch(chrom, pos - 1, pos):
+            vrnt = VcfRecBase(line)
+            if vrnt.uniq_key == uniq_key:
+                return vrnt
+        return None
+
+    def close(self):
+        """
+        Close the index, if it was opened.
+        :return:
+        """
+        if self._tabix:
+            self._tabix.close()
+        self._tabix = None